@@ -4,14 +4,13 @@ analysis that has been performed.
 """
 
 # Import packages
-import json
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 from streamlit_theme import st_theme
 import time
 from datetime import datetime
-import pandas as pd
 
+from utils.dashboard_data import load_arbitrage_tables, load_two_bet_tables, load_portfolio_table, load_update_times, \
+    rerun_on_data_change, ARBITRAGE_DOCUMENTS, TWO_BET_DOCUMENTS, PORTFOLIO_DOCUMENTS, UPDATE_TIMES_DOCUMENTS
 
 
 ## Prelimaries ##
@@ -24,19 +23,6 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Load the data
-with open("Data/analysed_odds.json", "r") as f:
-    loaded_data = json.load(f)
-with open("Data/analysed_odds_with_polymarket.json", "r") as f:
-    loaded_data_with_polymarket = json.load(f)
-with open("Data/update_times.json","r") as f:
-    update_times = json.load(f)
-with open("Data/two_bet_arbitrage.json","r") as f:
-    two_bet_arb = json.load(f)
-
-# Refresh every 5 seconds
-st_autorefresh(interval=5000, key='dashboard_refresh')
-
 
 
 ## Construct the page ##
@@ -52,6 +38,19 @@ else:
     else:
         using_dark_mode = False
 
+@st.fragment
+def show_update_times():
+    """
+    Shows when the site and the odds were last updated.
+    """
+
+    update_times = load_update_times()
+
+    # Specify when the site was last updated
+    st.write(f"""*Site last updated: {time.strftime('%H:%M:%S')}*    
+             *Polymarket last update: {datetime.fromisoformat(update_times['Polymarket']).strftime("%Y-%m-%d %H:%M:%S %Z")}*    
+             *Bookmakers last update: {datetime.fromisoformat(update_times['Bookmakers']).strftime("%Y-%m-%d %H:%M:%S %Z")}*""")
+
 # Customise the sidebar
 with st.sidebar:
     st.markdown("`Created by:`")
@@ -63,10 +62,7 @@ with st.sidebar:
     else:
         st.markdown(f'<a href="{github_url}" target="_blank" style="text-decoration: none; color: inherit;"><img src="https://upload.wikimedia.org/wikipedia/commons/9/91/Octicons-mark-github.svg" width="25" height="25" style="vertical-align: middle; margin-right: 10px;">`Sam Roughley`</a>', unsafe_allow_html=True)
 
-    # Specify when the site was last updated
-    st.write(f"""*Site last updated: {time.strftime('%H:%M:%S')}*    
-             *Polymarket last update: {datetime.fromisoformat(update_times['Polymarket']).strftime("%Y-%m-%d %H:%M:%S %Z")}*    
-             *Bookmakers last update: {datetime.fromisoformat(update_times['Bookmakers']).strftime("%Y-%m-%d %H:%M:%S %Z")}*""")
+    show_update_times()
 
 # Set the page title
 st.title("Arbitrage Tracker")
@@ -83,15 +79,23 @@ st.markdown("""
             - The guaranteed returns that can be achieved.
             """)
 
-include_polymarket_data = st.checkbox(label="Include Polymarket data", value=False)
+@st.fragment
+def show_arbitrage_table():
+    """
+    Shows the table of arbitrage opportunities, re-running on its own when
+    the checkbox is changed.
+    """
 
+    tables = load_arbitrage_tables()
+    include_polymarket_data = st.checkbox(label="Include Polymarket data", value=False)
 
+    # Include the dataframe
+    if include_polymarket_data:
+        st.dataframe(tables["analysed_odds_with_polymarket"], hide_index=True)
+    else:
+        st.dataframe(tables["analysed_odds"], hide_index=True)
 
-# Include the dataframe
-if include_polymarket_data:
-    st.dataframe(pd.DataFrame(loaded_data_with_polymarket), hide_index=True)
-else:
-    st.dataframe(pd.DataFrame(loaded_data), hide_index=True)
+show_arbitrage_table()
 
 # Provide descriptions of the columns
 with st.expander("ℹ️ Column details"):
@@ -104,6 +108,8 @@ with st.expander("ℹ️ Column details"):
     - **Away Stake:** Fraction of stake that should be placed on away team winning for arbitrage.
     - **Return:** Maximum guaranteed percentage return from arbitrage.  
     - **Annualised Return:** Annualised return, assuming equal opportunities once a week, 52 weeks a year.
+    - **Max Stake:** Largest total stake that remains profitable given the volume available in the Polymarket order books.
+    - **Return at Max Stake:** Guaranteed percentage return when placing the maximum stake.
     """)
 
 
@@ -114,27 +120,35 @@ st.markdown("""Polymarket, along with other prediction markets, enables bets
             arbitrage opportunities that involve only two bets. Such
             opportunities are monitored below.""")
 
-# Begin 2 columns
-col1, col2 = st.columns(2)
+@st.fragment
+def show_two_bet_tables():
+    """
+    Shows the table of 2-bet arbitrage for each match.
+    """
 
-for i, match in enumerate(two_bet_arb):
+    # Begin 2 columns
+    col1, col2 = st.columns(2)
 
-    if i%2 == 0:
-        with col1:
+    for i, (match_name, arbitrage_table) in enumerate(load_two_bet_tables()):
 
-            # Write match name
-            st.markdown(f"**{match['Match Name']}**")
+        if i%2 == 0:
+            with col1:
 
-            # Include table
-            st.dataframe(pd.DataFrame(match["Arbitrage Table"]), hide_index=True)
-        
-    else:
-        with col2:
-            # Write match name
-            st.markdown(f"**{match['Match Name']}**")
+                # Write match name
+                st.markdown(f"**{match_name}**")
+
+                # Include table
+                st.dataframe(arbitrage_table, hide_index=True)
+            
+        else:
+            with col2:
+                # Write match name
+                st.markdown(f"**{match_name}**")
 
-            # Include table
-            st.dataframe(pd.DataFrame(match["Arbitrage Table"]), hide_index=True)
+                # Include table
+                st.dataframe(arbitrage_table, hide_index=True)
+
+show_two_bet_tables()
 
 # Provide descriptions of the columns
 with st.expander("ℹ️ Column details"):
@@ -145,6 +159,41 @@ with st.expander("ℹ️ Column details"):
     - **Yes Stake:** Fraction of stake that should be placed on corresponding outcome for arbitrage.
     - **No Stake:** Fraction of stake that should be placed against corresponding outcome for arbitrage.
     - **Return:** Maximum guaranteed percentage return from arbitrage.
+    - **Max Stake:** Largest total stake that remains profitable given the volume available in the Polymarket order books.
+    - **Return at Max Stake:** Guaranteed percentage return when placing the maximum stake.
+    """)
+
+
+## Include table for the best portfolios ##
+st.markdown("### Optimal Portfolios")
+st.markdown("""Combining bets on outcomes with bets against outcomes on
+            Polymarket can find arbitrage that neither of the above finds,
+            such as backing the home team and a draw while betting against
+            the home team, which pays out whatever the result. The best
+            combination of bets for each match is shown below.""")
+
+@st.fragment
+def show_portfolio_table():
+    """
+    Shows the table of the best portfolio for each match.
+    """
+
+    # Include the dataframe
+    st.dataframe(load_portfolio_table(), hide_index=True)
+
+show_portfolio_table()
+
+# Re-run the page once the data shown on it changes
+rerun_on_data_change([ARBITRAGE_DOCUMENTS, TWO_BET_DOCUMENTS, PORTFOLIO_DOCUMENTS, UPDATE_TIMES_DOCUMENTS])
+
+# Provide descriptions of the columns
+with st.expander("ℹ️ Column details"):
+    st.markdown("""
+    - **Home Stake / Draw Stake / Away Stake:** Fraction of stake that should be placed on the outcome occuring, at the best odds available.
+    - **Not Home Stake / Not Draw Stake / Not Away Stake:** Fraction of stake that should be placed against the outcome occuring on Polymarket.
+    - **Return:** Maximum guaranteed percentage return from arbitrage.
+    - **Max Stake:** Largest total stake that remains profitable given the volume available in the Polymarket order books.
+    - **Return at Max Stake:** Guaranteed percentage return when placing the maximum stake.
     """)
 
 # Provide a disclaimer about update frequency
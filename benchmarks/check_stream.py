@@ -0,0 +1,127 @@
+"""
+Checks the streaming of the Polymarket order books end to end, against
+the fake websocket in utils/fake_polymarket_ws.py, on synthetic matches.
+
+Random order book events (a full order book for every token, followed by
+changes to individual price levels, with malformed messages mixed in) are
+served for the tokens of every market in a synthetic market catalogue.
+The Polymarket odds streamed for each match are then compared with the
+odds found by applying the same events directly to the order books.
+
+Run from the root of the repository with:
+
+python -m benchmarks.check_stream --matches 20 --events 2000
+"""
+
+# Import necessary packages
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic_data import generate_odds_payload, generate_markets
+from utils.bookie_functions import process_odds
+from utils.market_catalogue import create_market_catalogue, add_markets_to_catalogue
+from utils.polymarket_functions import find_market_slug_index
+from utils.polymarket_stream import get_token_map, apply_market_event, merge_streamed_odds, stream_polymarket_odds
+from utils.fake_polymarket_ws import serve_fake_market_feed
+
+
+# Messages the stream should skip
+MALFORMED_MESSAGES = ["not json", '"a string"', "[1, 2, 3]", '{"event_type": "unknown"}']
+
+
+def random_level(rng):
+    """
+    Returns a random price level of an order book.
+    """
+
+    return {"price": f"{rng.uniform(0.05, 0.95):.2f}", "size": f"{rng.uniform(10, 1000):.2f}"}
+
+
+def generate_events(token_ids, n_events, seed=0):
+    """
+    Returns n_events websocket events for the given tokens: a full order
+    book for each token, followed by random changes to their price
+    levels, with a malformed message every 50 events.
+    """
+
+    rng = random.Random(seed)
+
+    # Full order books
+    events = [{"event_type": "book", "asset_id": token_id,
+               "bids": [random_level(rng) for _ in range(5)], "asks": [random_level(rng) for _ in range(5)]}
+              for token_id in token_ids]
+
+    # Changes to the price levels, removing a level a third of the time
+    while len(events) < n_events:
+        if len(events) % 50 == 0:
+            events.append(rng.choice(MALFORMED_MESSAGES))
+            continue
+        level = random_level(rng)
+        if rng.random() < 1/3:
+            level["size"] = "0"
+        events.append({"event_type": "price_change",
+                       "price_changes": [level | {"asset_id": rng.choice(token_ids), "side": rng.choice(["BUY", "SELL"])}]})
+
+    return events
+
+
+def check_stream(n_matches, n_events, port=8765, duration=timedelta(seconds=5)):
+    """
+    Streams the events for n_matches synthetic matches from the fake
+    websocket for the given duration.
+
+    Returns the number of matches updated by the stream, and the number
+    whose streamed Polymarket odds differ from the expected odds.
+    """
+
+    # Generate the matches, and the catalogue of their markets
+    bookmakers_odds = process_odds(generate_odds_payload(n_matches, 5))
+    catalogue = create_market_catalogue()
+    add_markets_to_catalogue(catalogue, generate_markets(bookmakers_odds, 3*n_matches))
+    slug_index = find_market_slug_index(bookmakers_odds, catalogue)
+    token_map = get_token_map(bookmakers_odds, slug_index, catalogue)
+    events = generate_events(list(token_map), n_events)
+
+    # Keep the latest Polymarket odds streamed for each match
+    streamed_odds = {}
+
+    def on_match_update(match_index, match, polymarket_match_odds, changed_outcomes):
+        streamed_odds[match_index] = polymarket_match_odds
+
+    # Serve the events, and stream them
+    async def serve_and_stream():
+        server = asyncio.create_task(serve_fake_market_feed(events, port=port, interval=0))
+        await stream_polymarket_odds(bookmakers_odds, token_map, on_match_update, ws_url=f"ws://localhost:{port}",
+                                     run_until=datetime.now().astimezone() + duration, ping_interval=0.5)
+        server.cancel()
+
+    asyncio.run(serve_and_stream())
+
+    # Apply the events directly
+    order_books = {}
+    for event in events:
+        if isinstance(event, dict):
+            apply_market_event(order_books, event)
+    expected_odds = {i: merge_streamed_odds(match, i, token_map, order_books)[1] for i, match in enumerate(bookmakers_odds)}
+
+    mismatches = [i for i, polymarket_match_odds in streamed_odds.items() if polymarket_match_odds != expected_odds[i]]
+
+    return len(streamed_odds), len(mismatches)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check the Polymarket stream against the fake websocket.")
+    parser.add_argument("--matches", type=int, default=20, help="Number of matches")
+    parser.add_argument("--events", type=int, default=2000, help="Number of events served")
+    parser.add_argument("--port", type=int, default=8765, help="Port the fake websocket is served on")
+    args = parser.parse_args()
+
+    n_updated, n_mismatches = check_stream(args.matches, args.events, args.port)
+    print(f"Matches updated by the stream: {n_updated} of {args.matches}")
+    print(f"Matches with different odds: {n_mismatches}")
+
+    assert n_updated > 0, "No matches were updated by the stream"
+    assert n_mismatches == 0, "The streamed odds differ from the expected odds"
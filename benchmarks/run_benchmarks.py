@@ -0,0 +1,204 @@
+"""
+Times each stage of the processing and analysis on synthetic data, at
+each of the given sizes, recording the throughput and peak memory of each
+stage, and compares the results against a saved baseline.
+
+Run from the root of the repository with:
+
+python -m benchmarks.run_benchmarks --matches 20 200 2000 --save-baseline benchmarks/baseline.json
+python -m benchmarks.run_benchmarks --matches 20 200 2000 --baseline benchmarks/baseline.json
+"""
+
+# Import necessary packages
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.synthetic_data import generate_odds_payload, generate_markets, StubClobClient
+from utils import polymarket_functions
+from utils.analysis import check_for_arbitrage, create_arbitrage_engine, update_arbitrage_engine, format_data, \
+    format_for_2_bet_arb, calculate_optimal_portfolios
+from utils.bookie_functions import process_odds
+from utils.market_catalogue import create_market_catalogue, sync_market_catalogue
+from utils.polymarket_functions import find_market_slug_index, merge_polymarket_odds
+from utils.sharded_analysis import create_analysis_pool, close_analysis_pool, process_odds_sharded, \
+    update_arbitrage_engine_sharded
+
+
+def use_stub_client(client):
+    """
+    Makes the Polymarket functions use the stub client, rather than
+    connecting to the API.
+    """
+
+    for authenticated in [False, True]:
+        polymarket_functions.clob_clients[authenticated] = {"client": client, "creds_derived_at": datetime.now().astimezone()}
+
+
+def measure(function, repeats):
+    """
+    Calls the function repeats times, returning the median time taken in
+    seconds, and the peak memory allocated during a separate call in
+    bytes.
+    """
+
+    # Time the calls
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    # Measure the memory separately, as tracing slows the calls down
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return statistics.median(durations), peak_memory
+
+
+def benchmark_size(n_matches, n_bookmakers, n_markets, n_catalogue_markets, repeats, analysis_pool=None):
+    """
+    Benchmarks every stage for a single size of data. If a pool of worker
+    processes is given, the sharded processing and analysis are also
+    benchmarked.
+
+    Returns the results of each stage, keyed by name, with the number of
+    items processed, the median time taken, the throughput and the peak
+    memory.
+    """
+
+    size = f"{n_matches}x{n_bookmakers}x{n_markets}"
+    results = {}
+
+    def record(stage, n_items, function):
+        duration, peak_memory = measure(function, repeats)
+        results[f"{stage} [{size}]"] = {
+            "items": n_items,
+            "median_seconds": duration,
+            "items_per_second": n_items / duration if duration > 0 else float("inf"),
+            "peak_memory_bytes": peak_memory
+        }
+
+    # Generate the data
+    payload = generate_odds_payload(n_matches, n_bookmakers, n_markets)
+    bookmakers_odds = process_odds(payload)
+    markets = generate_markets(bookmakers_odds, max(n_catalogue_markets, 3*n_matches))
+    client = StubClobClient(markets)
+    use_stub_client(client)
+
+    # Processing the bookmakers' odds
+    record("process_odds", n_matches, lambda: process_odds(payload))
+
+    # Resolving the Polymarket market slugs, with and without the catalogue
+    catalogue = create_market_catalogue()
+    record("sync_market_catalogue", len(markets),
+           lambda: sync_market_catalogue(create_market_catalogue(), client=client, full_sync=True))
+    sync_market_catalogue(catalogue, client=client, full_sync=True)
+    record("find_market_slug_index (catalogue)", n_matches, lambda: find_market_slug_index(bookmakers_odds, catalogue))
+    record("find_market_slug_index (discovery)", n_matches, lambda: find_market_slug_index(bookmakers_odds))
+
+    # Introducing the Polymarket odds
+    slug_index = find_market_slug_index(bookmakers_odds, catalogue)
+    record("merge_polymarket_odds", n_matches, lambda: merge_polymarket_odds(bookmakers_odds, slug_index))
+    merged_odds, _ = merge_polymarket_odds(bookmakers_odds, slug_index)
+
+    # Checking for arbitrage, from the saved files
+    with open("Data/bookies_odds.json", "w") as f:
+        json.dump(bookmakers_odds, f)
+    with open("Data/bookies_odds_with_polymarket.json", "w") as f:
+        json.dump(merged_odds, f)
+    record("check_for_arbitrage", n_matches,
+           lambda: check_for_arbitrage("Data/bookies_odds.json", "Data/analysed_odds.json"))
+    record("check_for_arbitrage (with Polymarket)", n_matches,
+           lambda: check_for_arbitrage("Data/bookies_odds_with_polymarket.json", "Data/analysed_odds_with_polymarket.json",
+                                       consider_converse_outcomes=True))
+
+    # Finding the best portfolio of every match
+    record("calculate_optimal_portfolios", n_matches, lambda: calculate_optimal_portfolios(merged_odds))
+
+    # Formatting the results
+    engine = create_arbitrage_engine(consider_converse_outcomes=True)
+    update_arbitrage_engine(engine, merged_odds)
+    record("format_data", n_matches, lambda: format_data(engine["analysed_odds"]))
+    record("format_for_2_bet_arb", n_matches, lambda: format_for_2_bet_arb(engine["analysed_odds"]))
+
+    # Processing and analysing in memory, in this process and across the worker processes
+    record("update_arbitrage_engine (with Polymarket)", n_matches,
+           lambda: update_arbitrage_engine(create_arbitrage_engine(consider_converse_outcomes=True), merged_odds))
+    if analysis_pool is not None:
+        record("process_odds (sharded)", n_matches, lambda: process_odds_sharded(analysis_pool, payload))
+        record("update_arbitrage_engine (sharded, with Polymarket)", n_matches,
+               lambda: update_arbitrage_engine_sharded(analysis_pool, create_arbitrage_engine(consider_converse_outcomes=True),
+                                                       merged_odds))
+
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Prints the results, along with the change in time taken since the
+    baseline, flagging stages that are more than tolerance (a fraction)
+    slower.
+    """
+
+    print(f"{'Stage':<60} {'Median (ms)':>12} {'Items/s':>12} {'Peak (MB)':>10} {'vs Baseline':>12}")
+    for name, result in results.items():
+        line = f"{name:<60} {result['median_seconds']*1000:>12.3f} {result['items_per_second']:>12.0f} " \
+               f"{result['peak_memory_bytes']/1e6:>10.2f}"
+        if name in baseline:
+            change = result["median_seconds"] / baseline[name]["median_seconds"] - 1
+            line += f" {change:>+11.0%}"
+            if change > tolerance:
+                line += "  SLOWER"
+        print(line)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the processing and analysis on synthetic data.")
+    parser.add_argument("--matches", type=int, nargs="+", default=[20, 200, 2000], help="Numbers of matches")
+    parser.add_argument("--bookmakers", type=int, default=30, help="Number of bookmakers per match")
+    parser.add_argument("--markets", type=int, default=1, help="Number of markets per bookmaker")
+    parser.add_argument("--catalogue-markets", type=int, default=20000, help="Number of markets on Polymarket")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of times each stage is timed")
+    parser.add_argument("--processes", type=int, default=4, help="Number of worker processes for the sharded stages")
+    parser.add_argument("--baseline", help="Baseline to compare against")
+    parser.add_argument("--save-baseline", help="Where to save the results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Fraction slower than the baseline to flag")
+    args = parser.parse_args()
+
+    # Load the baseline
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    # Start the worker processes for the sharded stages
+    analysis_pool = create_analysis_pool(args.processes) if args.processes > 1 else None
+
+    # Run in a temporary directory, so the saved data is not overwritten
+    save_baseline_fpath = None if args.save_baseline is None else os.path.abspath(args.save_baseline)
+    all_results = {}
+    with tempfile.TemporaryDirectory() as tmp_dpath:
+        os.chdir(tmp_dpath)
+        os.makedirs("Data")
+        for n_matches in args.matches:
+            all_results |= benchmark_size(n_matches, args.bookmakers, args.markets, args.catalogue_markets, args.repeats,
+                                          analysis_pool)
+
+    if analysis_pool is not None:
+        close_analysis_pool(analysis_pool)
+
+    compare_with_baseline(all_results, baseline, args.tolerance)
+
+    # Save the results
+    if save_baseline_fpath is not None:
+        with open(save_baseline_fpath, "w") as f:
+            json.dump(all_results, f, indent=4)
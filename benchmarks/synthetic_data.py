@@ -0,0 +1,146 @@
+"""
+This script contains the generators of the synthetic data used by the
+benchmarks: responses of the odds API shaped like full_bookies_odds.json,
+and a stand-in for the Polymarket ClobClient serving a catalogue of
+markets and their order books.
+"""
+
+# Import necessary packages
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from py_clob_client.constants import END_CURSOR
+
+from utils.polymarket_functions import market_slugs
+
+
+TEAMS = [
+    "Arsenal", "Aston Villa", "Bournemouth", "Brentford", "Brighton and Hove Albion", "Burnley", "Chelsea",
+    "Crystal Palace", "Everton", "Fulham", "Leeds United", "Liverpool", "Manchester City", "Manchester United",
+    "Newcastle United", "Nottingham Forest", "Sunderland", "Tottenham Hotspur", "West Ham United",
+    "Wolverhampton Wanderers"
+]
+EXTRA_MARKETS = ["spreads", "totals", "h2h_lay", "btts", "draw_no_bet"]
+
+
+def generate_odds_payload(n_matches, n_bookmakers, n_markets=1, seed=0):
+    """
+    Returns a response of the odds API with the given number of matches,
+    each with odds from n_bookmakers bookmakers for n_markets markets (the
+    first being h2h).
+    """
+
+    rng = random.Random(seed)
+    start = datetime(2025, 8, 15, 19, 30, tzinfo=timezone.utc)
+
+    payload = []
+    for i in range(n_matches):
+
+        # Pick the teams, with a round of fixtures every day
+        home_team, away_team = rng.sample(TEAMS, 2)
+        commence_time = (start + timedelta(days=i // 10, hours=i % 10)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        # Fair probabilities of each outcome, which each bookmaker adds a margin to
+        home_prob = rng.uniform(0.15, 0.7)
+        draw_prob = rng.uniform(0.15, min(0.35, 0.95 - home_prob))
+        away_prob = 1 - home_prob - draw_prob
+
+        bookmakers = []
+        for j in range(n_bookmakers):
+            margin = rng.uniform(0.98, 1.08)
+            h2h_outcomes = [{"name": name, "price": round(1 / (prob * margin * rng.uniform(0.97, 1.03)), 2)}
+                            for name, prob in [(home_team, home_prob), (away_team, away_prob), ("Draw", draw_prob)]]
+            markets = [{"key": "h2h", "last_update": commence_time, "outcomes": h2h_outcomes}]
+            for market_key in EXTRA_MARKETS[:n_markets - 1]:
+                markets.append({"key": market_key, "last_update": commence_time,
+                                "outcomes": [{"name": home_team, "price": round(rng.uniform(1.5, 2.5), 2)},
+                                             {"name": away_team, "price": round(rng.uniform(1.5, 2.5), 2)}]})
+            bookmakers.append({"key": f"bookmaker_{j}", "title": f"Bookmaker {j}", "last_update": commence_time,
+                               "markets": markets})
+
+        payload.append({
+            "id": f"{seed:04d}{i:08d}",
+            "sport_key": "soccer_epl",
+            "sport_title": "EPL",
+            "commence_time": commence_time,
+            "home_team": home_team,
+            "away_team": away_team,
+            "bookmakers": bookmakers
+        })
+
+    return payload
+
+
+def generate_markets(bookmakers_odds, n_markets, seed=0):
+    """
+    Returns a catalogue of n_markets Polymarket markets, as returned by
+    the API, including the markets of the given (processed) matches
+    scattered among unrelated markets.
+    """
+
+    rng = random.Random(seed)
+
+    # The markets of the matches
+    markets = []
+    for match in bookmakers_odds:
+        for market_slug in market_slugs(match).values():
+            condition_id = f"0x{len(markets):064x}"
+            markets.append({"condition_id": condition_id, "market_slug": market_slug,
+                            "question": market_slug, "active": True, "closed": False,
+                            "tokens": [{"outcome": "Yes", "price": 0.5, "token_id": f"{condition_id}-yes"},
+                                       {"outcome": "No", "price": 0.5, "token_id": f"{condition_id}-no"}]})
+
+    # Unrelated markets
+    while len(markets) < n_markets:
+        markets.append({"condition_id": f"0x{len(markets):064x}", "market_slug": f"unrelated-market-{len(markets)}",
+                        "question": "Unrelated market", "active": True, "closed": False})
+
+    rng.shuffle(markets)
+    return markets
+
+
+class StubClobClient:
+    """
+    Stands in for py_clob_client's ClobClient, serving the given markets,
+    with order books of book_depth levels generated for each token.
+    """
+
+    def __init__(self, markets, page_size=500, book_depth=10, seed=0):
+        self.markets = markets
+        self.markets_by_id = {market["condition_id"]: market for market in markets}
+        self.page_size = page_size
+        self.book_depth = book_depth
+        self.seed = seed
+
+    def create_or_derive_api_creds(self):
+        return None
+
+    def set_api_creds(self, creds):
+        pass
+
+    def get_markets(self, next_cursor="MA=="):
+        offset = 0 if next_cursor == "MA==" else int(next_cursor)
+        page = self.markets[offset:offset + self.page_size]
+        if offset + self.page_size < len(self.markets):
+            next_cursor = str(offset + self.page_size)
+        else:
+            next_cursor = END_CURSOR
+        return {"data": page, "next_cursor": next_cursor, "count": len(page), "limit": self.page_size}
+
+    def get_market(self, condition_id):
+        market = self.markets_by_id[condition_id]
+        return {"question": market["question"],
+                "tokens": [{"outcome": "Yes", "price": 0.5, "token_id": f"{condition_id}-yes"},
+                           {"outcome": "No", "price": 0.5, "token_id": f"{condition_id}-no"}]}
+
+    def get_order_book(self, token_id):
+        rng = random.Random(f"{self.seed}-{token_id}")
+        best_ask = rng.uniform(0.05, 0.9)
+
+        # The API lists asks from worst to best, and bids from worst to best
+        asks = [SimpleNamespace(price=f"{min(best_ask + 0.01*level, 0.99):.2f}", size=f"{rng.uniform(10, 1000):.2f}")
+                for level in reversed(range(self.book_depth))]
+        bids = [SimpleNamespace(price=f"{max(best_ask - 0.01*(level + 1), 0.01):.2f}", size=f"{rng.uniform(10, 1000):.2f}")
+                for level in reversed(range(self.book_depth))]
+        return SimpleNamespace(asks=asks, bids=bids)
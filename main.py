@@ -11,48 +11,320 @@ import time
 from datetime import datetime, timedelta
 from tzlocal import get_localzone
 
-from utils.bookie_functions import update_odds, request_odds_api, process_odds
-from utils.analysis import check_for_arbitrage
-from utils.polymarket_functions import fetch_all_markets, introduce_polymarket_odds
+from utils.bookie_functions import update_odds, request_odds_api, process_odds, odds_api_quota
+from utils.analysis import check_for_arbitrage, create_arbitrage_engine
+from utils.polymarket_functions import fetch_all_markets, introduce_polymarket_odds, find_market_slug_index
+from utils.polymarket_stream import stream_polymarket_odds_to_files
+from utils.market_catalogue import load_market_catalogue, refresh_market_catalogue
+from utils.pipeline import create_pipeline, update_bookmakers_stage, update_polymarket_stage, publish_pipeline
+from utils.snapshot_store import DOCUMENT_FPATHS, open_snapshot_store, commit_snapshot, load_documents_from_files
+from utils.replay import create_recorder, record_update
+from utils.odds_history import open_odds_history, record_quotes, bookmaker_quotes, polymarket_quotes, maintain_odds_history
+from utils.scheduler import create_refresh_scheduler, update_quota, update_priorities, due_sports, mark_refreshed, \
+    next_refresh_time, wait_for_next_update
+from utils.metrics import start_metrics_server, start_metrics_file, start_tick, finish_tick, time_stage
+from utils.sharded_analysis import create_analysis_pool
+from utils.alerts import create_alerter, update_alerts, file_sink, webhook_sink
+from utils.odds_directory import save_odds_directory
 
 
 # Define variables
 bookmakers_update_period = timedelta(hours=3)   # Keep within rate limit
+bookmakers_sports = ["soccer_epl"]  # Leagues to collect, e.g. soccer_spain_la_liga, soccer_germany_bundesliga
+bookmakers_regions = ["uk"]         # Regions of the bookmakers, e.g. eu. Each sport and region uses the quota
+bookmakers_max_workers = 8          # Number of parallel requests for the bookmakers odds
+bookmakers_markets = ["h2h"]        # Markets requested, e.g. totals, spreads. Only h2h is analysed, each market uses the quota
+raw_odds_dpath = "Data/raw_odds"    # Keep the full, compressed, latest response for each sport and region, or None to not keep them
+use_refresh_scheduler = True        # If True, spread the odds API quota over the month, favouring leagues near kick off or arbitrage
+odds_api_quota_reset_day = 1        # Day of the month the odds API quota resets
+use_in_memory_pipeline = True   # If False, each stage saves its results for the next stage to load
+use_market_catalogue = True     # If False, search the API for only the current matches' markets
+catalogue_fpath = "Data/polymarket_markets_catalogue.json"
+catalogue_sync_period = timedelta(minutes=5)        # Fetch newly listed markets
+catalogue_full_sync_period = timedelta(hours=6)     # Re-fetch every market
+polymarket_max_workers = 16         # Number of parallel requests for Polymarket order books
+polymarket_request_timeout = 10     # Seconds allowed for each Polymarket request
+use_polymarket_stream = False       # If True, stream Polymarket order books rather than polling them, using the market catalogue for the tokens
+polymarket_ws_url = "wss://ws-subscriptions-clob.polymarket.com/ws/market"
+use_snapshot_store = True           # If True, publish consistent versioned snapshots for the dashboard
+use_odds_history = True             # If True, record every change in the odds
+history_dpath = "Data/history"
+history_retention_period = timedelta(days=90)       # Older history is deleted
+history_downsample_after = timedelta(days=7)        # Older history is downsampled...
+history_downsample_interval = timedelta(minutes=5)  # ...to one quote per interval
+record_updates = True               # If True, record the collected data so it can be replayed (see utils/replay.py)
+recording_dpath = "Data/recordings"
+metrics_port = 9108                     # Serve the metrics at http://localhost:9108/metrics, or None to not serve them
+metrics_host = "127.0.0.1"              # Only serve the metrics to this machine, or "0.0.0.0" to serve them to others
+metrics_fpath = "Data/metrics.jsonl"    # Log a summary of every update, or None to not log them
+analysis_processes = None           # Number of worker processes to process and analyse the odds across, sharded by league, or None to use this process only
+alerts_min_return_perc = 0.0                    # Alert opportunities with at least this percentage return
+alerts_debounce_period = timedelta(seconds=10)  # Opportunities are closed once gone for this long
+alerts_fpath = "Data/alerts.jsonl"  # Append every alert to this file, or None to not save them
+alerts_webhook_url = None           # POST every alert as JSON to this URL, e.g. http://localhost:8000/alerts, or None to not send them
+
+# Start the worker processes for the analysis, before any threads are started
+if analysis_processes is not None and use_in_memory_pipeline:
+    analysis_pool = create_analysis_pool(analysis_processes)
+else:
+    analysis_pool = None
+
+# Start exposing the metrics
+if metrics_port is not None:
+    start_metrics_server(metrics_port, metrics_host)
+if metrics_fpath is not None:
+    start_metrics_file(metrics_fpath)
+
+# Start sending alerts
+alert_sinks = []
+if alerts_fpath is not None:
+    alert_sinks.append(file_sink(alerts_fpath))
+if alerts_webhook_url is not None:
+    alert_sinks.append(webhook_sink(alerts_webhook_url))
+if len(alert_sinks) > 0:
+    alerter = create_alerter(alert_sinks, min_return_perc=alerts_min_return_perc, debounce_period=alerts_debounce_period)
+else:
+    alerter = None
+
+# Open the snapshot store
+if use_snapshot_store:
+    snapshot_conn = open_snapshot_store()
+else:
+    snapshot_conn = None
+
+# Open the history of the odds
+if use_odds_history:
+    odds_history = open_odds_history(history_dpath)
+else:
+    odds_history = None
+
+# Start recording the collected data
+if record_updates:
+    recorder = create_recorder(recording_dpath)
+
+# Warm-start the Polymarket market catalogue from the cache, which the stream needs for the token IDs
+if use_market_catalogue or use_polymarket_stream:
+    market_catalogue = load_market_catalogue(catalogue_fpath)
+else:
+    market_catalogue = None
+
+# Initialise the pipeline, or the arbitrage engines, which only re-analyse matches whose odds have changed
+if use_in_memory_pipeline:
+    pipeline = create_pipeline(analysis_pool)
+else:
+    bookmakers_engine = create_arbitrage_engine()
+    polymarket_engine = create_arbitrage_engine(consider_converse_outcomes=True)
+
+# Schedule the updates, starting from when the bookmakers odds were last updated
+if use_refresh_scheduler:
+    try:
+        with open("Data/update_times.json","r") as f:
+            bookmakers_update_time = datetime.fromisoformat(json.load(f)["Bookmakers"])
+    except (OSError, ValueError, KeyError):
+        bookmakers_update_time = None
+    refresh_scheduler = create_refresh_scheduler(bookmakers_sports,
+                                                 cost_per_refresh=len(bookmakers_regions) * len(bookmakers_markets),
+                                                 quota_reset_day=odds_api_quota_reset_day,
+                                                 last_refreshed=bookmakers_update_time,
+                                                 default_period=bookmakers_update_period)
 
 # Enter a while loop
 while True:
     
+    start_tick()
 
     # Find when bookmakers odds last updated
-    with open("Data/update_times.json","r") as f:
-        update_times = json.load(f)
+    if use_in_memory_pipeline:
+        update_times = pipeline["documents"]["update_times"]
+    else:
+        with open("Data/update_times.json","r") as f:
+            update_times = json.load(f)
     bookmakers_update_time = datetime.fromisoformat(update_times["Bookmakers"])
 
     # Get the current time
     time_now = datetime.now().astimezone()
 
+    # Find the leagues whose odds need updating, and when they next need updating
+    if use_refresh_scheduler:
+        sports_to_update = due_sports(refresh_scheduler)
+    elif time_now >= bookmakers_update_time + bookmakers_update_period:
+        sports_to_update = bookmakers_sports
+    else:
+        sports_to_update = []
     
     # Update bookmakers odds if necessary
-    if time_now >= bookmakers_update_time + bookmakers_update_period:
+    if len(sports_to_update) > 0:
 
-        # Get latest odds
-        update_odds(save_fpath="Data/bookies_odds.json")
+        if use_in_memory_pipeline:
+            # Get latest odds, and check for arbitrage
+            update_bookmakers_stage(pipeline,
+                                    sports=sports_to_update,
+                                    regions=bookmakers_regions,
+                                    max_workers=bookmakers_max_workers,
+                                    markets=bookmakers_markets,
+                                    raw_archive_dpath=raw_odds_dpath)
+            publish_pipeline(pipeline, snapshot_conn)
+        else:
+            # Get latest odds
+            with time_stage("bookmakers_update"):
+                update_odds(save_fpath="Data/bookies_odds.json",
+                            sports=sports_to_update,
+                            regions=bookmakers_regions,
+                            max_workers=bookmakers_max_workers,
+                            markets=bookmakers_markets,
+                            raw_archive_dpath=raw_odds_dpath)
 
-        # Check for arbitrage
-        check_for_arbitrage(bookies_odds_fpath="Data/bookies_odds.json",
-                            save_file_fpath="Data/analysed_odds.json")
+            # Check for arbitrage
+            with time_stage("bookmakers_analysis"):
+                check_for_arbitrage(bookies_odds_fpath="Data/bookies_odds.json",
+                                    save_file_fpath="Data/analysed_odds.json",
+                                    engine=bookmakers_engine)
+
+        # Schedule the next updates, within the remaining quota
+        if use_refresh_scheduler:
+            update_quota(refresh_scheduler, odds_api_quota["requests_remaining"], odds_api_quota["requests_used"])
+            mark_refreshed(refresh_scheduler, sports_to_update)
+
+        # Record the bookmakers odds, and the full response of the API
+        with time_stage("record"):
+            if use_in_memory_pipeline:
+                documents = pipeline["documents"]
+            elif use_odds_history or record_updates:
+                documents = load_documents_from_files(["full_bookies_odds", "update_times"])
+            if use_odds_history:
+                record_quotes(odds_history, bookmaker_quotes(documents["full_bookies_odds"]),
+                              datetime.fromisoformat(documents["update_times"]["Bookmakers"]))
+            if record_updates:
+                record_update(recorder, "bookmakers", documents["full_bookies_odds"],
+                              datetime.fromisoformat(documents["update_times"]["Bookmakers"]))
         
     
-    # Update Polymarket odds
-    introduce_polymarket_odds(bookies_odds_fpath="Data/bookies_odds.json",
-                              updated_file_fpath="Data/bookies_odds_with_polymarket.json")
-    
-    # Check for arbitrage
-    check_for_arbitrage(bookies_odds_fpath="Data/bookies_odds_with_polymarket.json",
-                        save_file_fpath="Data/analysed_odds_with_polymarket.json",
-                        consider_converse_outcomes=True)
+    # Update the Polymarket market catalogue if necessary
+    if market_catalogue is not None:
+        with time_stage("polymarket_catalogue"):
+            refresh_market_catalogue(market_catalogue,
+                                     cache_fpath=catalogue_fpath,
+                                     sync_period=catalogue_sync_period,
+                                     full_sync_period=catalogue_full_sync_period)
+
+    # Keep the size of the history of the odds bounded
+    if use_odds_history:
+        with time_stage("history_maintenance"):
+            maintain_odds_history(odds_history,
+                                  retention_period=history_retention_period,
+                                  downsample_after=history_downsample_after,
+                                  downsample_interval=history_downsample_interval)
+
+    # Stream Polymarket odds until the bookmakers odds need updating
+    if use_polymarket_stream:
+
+        # Get the condition IDs of the relevant Polymarket markets
+        with open("Data/bookies_odds.json","r") as f:
+            bookmakers_odds = json.load(f)
+        slug_index = find_market_slug_index(bookmakers_odds, market_catalogue)
+        if use_refresh_scheduler:
+            run_until = next_refresh_time(refresh_scheduler)
+        else:
+            run_until = bookmakers_update_time + bookmakers_update_period
+
+        streamed_documents = stream_polymarket_odds_to_files(bookies_odds_fpath="Data/bookies_odds.json",
+                                                             slug_index=slug_index,
+                                                             market_catalogue=market_catalogue,
+                                                             run_until=run_until,
+                                                             ws_url=polymarket_ws_url,
+                                                             snapshot_conn=snapshot_conn,
+                                                             odds_history=odds_history,
+                                                             alerter=alerter,
+                                                             recorder=recorder if record_updates else None)
+
+        # Keep the pipeline up to date with the streamed odds, for the next bookmakers update
+        if use_in_memory_pipeline:
+            pipeline["documents"] |= streamed_documents
+
+    elif use_in_memory_pipeline:
+
+        # Update Polymarket odds, and check for arbitrage
+        update_polymarket_stage(pipeline,
+                                market_catalogue=market_catalogue,
+                                max_workers=polymarket_max_workers,
+                                request_timeout=polymarket_request_timeout)
+
+        # Alert any opportunities found, before saving the results
+        if alerter is not None:
+            with time_stage("alerts"):
+                update_alerts(alerter, pipeline["polymarket_engine"]["analysed_odds"],
+                              pipeline["polymarket_engine"]["update_started_at"])
+
+        # Save the results
+        publish_pipeline(pipeline, snapshot_conn)
+
+        # Record the order books
+        if record_updates:
+            with time_stage("record"):
+                record_update(recorder, "polymarket", pipeline["polymarket_market_infos"])
+
+    else:
+
+        # Update Polymarket odds
+        with time_stage("polymarket_update"):
+            polymarket_market_infos = introduce_polymarket_odds(bookies_odds_fpath="Data/bookies_odds.json",
+                                                                updated_file_fpath="Data/bookies_odds_with_polymarket.json",
+                                                                market_catalogue=market_catalogue,
+                                                                max_workers=polymarket_max_workers,
+                                                                request_timeout=polymarket_request_timeout)
+
+        # Precompute the odds directory shown on the dashboard
+        with time_stage("odds_directory"):
+            save_odds_directory()
+        
+        # Check for arbitrage
+        with time_stage("polymarket_analysis"):
+            check_for_arbitrage(bookies_odds_fpath="Data/bookies_odds_with_polymarket.json",
+                                save_file_fpath="Data/analysed_odds_with_polymarket.json",
+                                consider_converse_outcomes=True,
+                                engine=polymarket_engine)
+
+        # Alert any opportunities found
+        if alerter is not None:
+            with time_stage("alerts"):
+                update_alerts(alerter, polymarket_engine["analysed_odds"], polymarket_engine["update_started_at"])
+
+        # Publish the saved results as a snapshot
+        if use_snapshot_store:
+            with time_stage("publish"):
+                commit_snapshot(snapshot_conn, load_documents_from_files(DOCUMENT_FPATHS))
+
+        # Record the order books
+        if record_updates:
+            with time_stage("record"):
+                record_update(recorder, "polymarket", polymarket_market_infos)
+
+    # Record the Polymarket odds, which the stream records as they change
+    if use_odds_history and not use_polymarket_stream:
+        with time_stage("record"):
+            if use_in_memory_pipeline:
+                documents = pipeline["documents"]
+            else:
+                documents = load_documents_from_files(["bookies_odds", "full_polymarket_odds"])
+            record_quotes(odds_history, polymarket_quotes(documents["bookies_odds"], documents["full_polymarket_odds"]))
+
+    # Update the priority of each league from the latest odds
+    if use_refresh_scheduler:
+        if use_in_memory_pipeline:
+            documents = pipeline["documents"]
+        elif use_polymarket_stream:
+            documents = streamed_documents
+        else:
+            documents = load_documents_from_files(["bookies_odds_with_polymarket"])
+        update_priorities(refresh_scheduler, documents["bookies_odds_with_polymarket"])
+
+    finish_tick()
     
-    time.sleep(2)
+    # Wait for the next update
+    if use_refresh_scheduler:
+        wait_for_next_update(refresh_scheduler)
+    else:
+        time.sleep(2)
 
 
 
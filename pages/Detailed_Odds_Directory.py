@@ -6,11 +6,13 @@ outcome.
 
 # Import packages
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 from streamlit_theme import st_theme
-import json
+import math
 import pandas as pd
 import time
+
+from utils.dashboard_data import load_directory_tables, load_update_times, search_directory, build_match_tables, \
+    directory_page_size, rerun_on_data_change, DIRECTORY_DOCUMENTS, UPDATE_TIMES_DOCUMENTS
 pd.options.display.float_format = "{:.2f}".format
 
 # Set up the page
@@ -20,9 +22,6 @@ st.set_page_config(
     layout="wide"
 )
 
-# Refresh every 5 seconds
-st_autorefresh(interval=5000, key='dashboard_refresh')
-
 # Get whether the dashboard is viewed in dark mode
 theme = st_theme()
 if theme == None:
@@ -34,8 +33,18 @@ else:
     else:
         using_dark_mode = False
 
-with open("Data/update_times.json", "r") as f:
-    update_times = json.load(f)
+@st.fragment
+def show_update_times():
+    """
+    Shows when the site and the odds were last updated.
+    """
+
+    update_times = load_update_times()
+
+    # Specify when the site was last updated
+    st.write(f"""*Site last updated: {time.strftime('%H:%M:%S')}*    
+             *Polymarket last update: {update_times['Polymarket']}*    
+             *Bookmakers last update: {update_times['Bookmakers']}*""")
 
 # Format the sidebar
 with st.sidebar:
@@ -48,73 +57,51 @@ with st.sidebar:
     else:
         st.markdown(f'<a href="{github_url}" target="_blank" style="text-decoration: none; color: inherit;"><img src="https://upload.wikimedia.org/wikipedia/commons/9/91/Octicons-mark-github.svg" width="25" height="25" style="vertical-align: middle; margin-right: 10px;">`Sam Roughley`</a>', unsafe_allow_html=True)
 
-    # Specify when the site was last updated
-    st.write(f"""*Site last updated: {time.strftime('%H:%M:%S')}*    
-             *Polymarket last update: {update_times['Polymarket']}*    
-             *Bookmakers last update: {update_times['Bookmakers']}*""")
-
+    show_update_times()
 
-# Load the data
-# Use path relative to main streamlit dashboard
-with open("Data/full_bookies_odds.json","r") as f:
-    full_data = json.load(f)
 
-with open("Data/full_polymarket_odds.json","r") as f:
-    full_polymarket_data = json.load(f)
+@st.fragment
+def show_directory():
+    """
+    Shows the current page of the matches found by the search, re-running
+    on its own when the search or page is changed.
+    """
 
-# Go through each match
-for match, polymarket_odds in zip(full_data, full_polymarket_data):
-    
-    # Get match info
-    home_team = match["home_team"]
-    away_team = match["away_team"]
+    tables = load_directory_tables()
 
-    # Write the match title
-    st.markdown(f"### {home_team} vs {away_team}")
+    # Search the matches
+    search_col, page_col = st.columns([3, 1])
+    with search_col:
+        query = st.text_input("Search", placeholder="Team, date or bookmaker")
+    matches = search_directory(tables, query)
 
-    
-    # Get information about the odds from each bookmaker
-    all_odds = {
-        "Bookmaker": [],
-        home_team: [],
-        "Draw": [],
-        away_team: []
-    }
-    for bookmaker in match["bookmakers"]:
+    # Only show the current page of matches
+    n_pages = max(math.ceil(len(matches) / directory_page_size), 1)
+    with page_col:
+        page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1)
+    page_matches = matches[(page - 1) * directory_page_size:page * directory_page_size]
+    st.caption(f"Showing {len(page_matches)} of {len(matches)} matches")
 
-        all_odds["Bookmaker"].append(bookmaker["title"])
+    # Go through each match
+    for entry in page_matches:
 
-        for outcome in bookmaker["markets"][0]["outcomes"]:
+        # Write the match title
+        st.markdown(f"### {entry['title']}")
 
-            all_odds[outcome["name"]].append(outcome["price"])
+        # Show a table of results, with the best odds of each outcome highlighted
+        styled_odds, polymarket_df = build_match_tables(entry)
+        st.table(styled_odds)
 
-    # Show a table of results
 
-    all_odds_df = pd.DataFrame(all_odds)
-    all_odds_df = all_odds_df.set_index("Bookmaker")
-    all_odds_df = all_odds_df.T
-    # Highlight max value in each row
-    styled_df = all_odds_df.style.highlight_max(axis=1, color="lightgreen")  
-    st.table(styled_df)
+        # Add the Polymarket odds
+        st.markdown("**Polymarket Odds**")
+        if polymarket_df is None:
+            st.markdown("*Polymarket data not found*")
+        else:
+            # Show table of results
+            st.table(polymarket_df)
 
+show_directory()
 
-    # Add the Polymarket odds
-    st.markdown("**Polymarket Odds**")
-    if polymarket_odds == {}:
-        st.markdown("*Polymarket data not found*")
-    else:
-        polymarket_odds = {
-            "Market": ["Yes", "No"],
-            home_team: [polymarket_odds["home_team"]["Yes"],
-                        polymarket_odds["home_team"]["No"]],
-            "Draw": [polymarket_odds["draw"]["Yes"],
-                     polymarket_odds["draw"]["No"]],
-            away_team: [polymarket_odds["away_team"]["Yes"],
-                        polymarket_odds["away_team"]["No"]]
-        }
-
-        # Show table of results
-        polymarket_df = pd.DataFrame(polymarket_odds)
-        polymarket_df = polymarket_df.set_index("Market")
-        polymarket_df = polymarket_df.T
-        st.table(polymarket_df)
+# Re-run the page once the data shown on it changes
+rerun_on_data_change([DIRECTORY_DOCUMENTS, UPDATE_TIMES_DOCUMENTS])
\ No newline at end of file
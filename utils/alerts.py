@@ -0,0 +1,268 @@
+"""
+This script contains the alerting of arbitrage opportunities: as soon as
+the analysis finds an opportunity with at least the minimum return, an
+event is sent to each of the sinks (e.g. a file, a local webhook or a
+queue), rather than waiting for someone to see it on the dashboard.
+
+Each opportunity (a match, the kind of arbitrage and the outcome) is only
+alerted once when it opens, again if its return changes significantly,
+and once more when it closes. An opportunity is only closed once it has
+been gone for the debounce period, so odds flickering around the
+threshold do not send a stream of alerts.
+
+The events are sent by a background thread, so slow sinks do not hold up
+the collector, and the time from detecting each opportunity to notifying
+each sink is recorded in the metrics (see utils/metrics.py).
+"""
+
+# Import necessary packages
+import json
+import queue
+import threading
+import time
+from datetime import timedelta
+
+import requests
+
+from utils.analysis import OUTCOMES
+from utils.scheduler import SystemClock
+from utils.metrics import observe, increment
+
+
+def create_alerter(sinks, min_return_perc=0.0, debounce_period=timedelta(seconds=10), update_return_change=0.5,
+                   clock=None):
+    """
+    Returns the state of an alerter, and starts sending its events to the
+    given sinks. Each sink is a function taking an event (a dict), e.g.
+    from file_sink(), webhook_sink() or queue_sink().
+
+    Opportunities are alerted once their guaranteed percentage return is
+    at least min_return_perc, alerted again if it changes by at least
+    update_return_change (percentage points), and closed once they have
+    been gone for debounce_period.
+    """
+
+    alerter = {
+        "sinks": list(sinks),
+        "min_return_perc": min_return_perc,
+        "debounce_period": debounce_period,
+        "update_return_change": update_return_change,
+        "clock": SystemClock() if clock is None else clock,
+        "open": {},                 # The open opportunities, keyed by (match, kind, outcome)
+        "queue": queue.Queue()      # The events waiting to be sent
+    }
+
+    # Send the events in the background
+    threading.Thread(target=send_alerts, args=(alerter,), daemon=True).start()
+
+    return alerter
+
+
+def match_key(match):
+    """
+    Returns the key identifying a match across updates.
+    """
+
+    return match.get("match_id") or \
+        f'{match["home_team"]["team_name"]} vs {match["away_team"]["team_name"]} ({match["commence_date"]})'
+
+
+def find_alert_opportunities(analysed_match):
+    """
+    Returns the arbitrage opportunities in an analysed match, keyed by
+    (kind, outcome), with their return, maximum stake (None if not
+    limited) and stakes.
+    """
+
+    opportunities = {}
+
+    # 3-way arbitrage
+    arb = analysed_match["arb"]
+    if arb["possible"]:
+        opportunities[("3-way", None)] = {
+            "return_perc": arb["guaranteed_return_perc"],
+            "max_stake": arb.get("max_stake"),
+            "stakes": {"home_team": arb["home_stake"], "draw": arb["draw_stake"], "away_team": arb["away_stake"]}
+        }
+
+    # 2-bet arbitrage
+    for outcome in OUTCOMES:
+        two_bet_arb = analysed_match[outcome].get("2_bet_arb")
+        if two_bet_arb is not None:
+            opportunities[("2-bet", outcome)] = {
+                "return_perc": two_bet_arb["Percentage_return"],
+                "max_stake": two_bet_arb.get("Max_stake"),
+                "stakes": {"Yes": two_bet_arb["Yes_bet_size"], "No": two_bet_arb["No_bet_size"]}
+            }
+
+    # Unlimited stakes can not be sent as JSON
+    for opportunity in opportunities.values():
+        if opportunity["max_stake"] == float("inf"):
+            opportunity["max_stake"] = None
+
+    return opportunities
+
+
+def update_alerts(alerter, analysed_matches, detected_at=None):
+    """
+    Compares the opportunities in the analysed matches (e.g. the
+    "analysed_odds" of an arbitrage engine) with the open opportunities,
+    queueing an event for every opportunity that has opened, changed
+    significantly or closed.
+
+    detected_at is the time.perf_counter() from which the latency of the
+    alerts is measured, which should be when the analysis of the odds
+    started (e.g. the "update_started_at" of the engine), defaulting to
+    now.
+
+    Returns the events queued.
+    """
+
+    time_now = alerter["clock"].now()
+    if detected_at is None:
+        detected_at = time.perf_counter()
+
+    # Find the current opportunities
+    current_opportunities = {}
+    for analysed_match in analysed_matches:
+        if analysed_match is None:
+            continue
+        for (kind, outcome), opportunity in find_alert_opportunities(analysed_match).items():
+            if opportunity["return_perc"] >= alerter["min_return_perc"]:
+                current_opportunities[(match_key(analysed_match), kind, outcome)] = (analysed_match, opportunity)
+
+    events = []
+
+    # Open the new opportunities, and update the open ones
+    for key, (analysed_match, opportunity) in current_opportunities.items():
+        state = alerter["open"].get(key)
+        if state is None:
+            state = alerter["open"][key] = {
+                "match": f'{analysed_match["home_team"]["team_name"]} vs {analysed_match["away_team"]["team_name"]}',
+                "match_id": analysed_match.get("match_id"),
+                "commence_time": analysed_match.get("commence_time", analysed_match["commence_date"]),
+                "kind": key[1],
+                "outcome": key[2],
+                "first_seen": time_now,
+                "alerted_return_perc": opportunity["return_perc"]
+            }
+            event_type = "opened"
+        elif abs(opportunity["return_perc"] - state["alerted_return_perc"]) >= alerter["update_return_change"]:
+            state["alerted_return_perc"] = opportunity["return_perc"]
+            event_type = "updated"
+        else:
+            event_type = None
+        state["last_seen"] = time_now
+        state["gone_since"] = None
+        state["opportunity"] = opportunity
+
+        if event_type is not None:
+            events.append(alert_event(event_type, state, time_now))
+
+    # Close the opportunities that have been gone for long enough
+    for key in list(alerter["open"]):
+        if key in current_opportunities:
+            continue
+        state = alerter["open"][key]
+        if state["gone_since"] is None:
+            state["gone_since"] = time_now
+        if time_now - state["gone_since"] >= alerter["debounce_period"]:
+            events.append(alert_event("closed", alerter["open"].pop(key), time_now))
+
+    # Send the events
+    for event in events:
+        alerter["queue"].put((event, detected_at))
+
+    return events
+
+
+def alert_event(event_type, state, time_now):
+    """
+    Returns the event sent to the sinks for an opportunity.
+    """
+
+    event = {
+        "event": event_type,
+        "match": state["match"],
+        "match_id": state["match_id"],
+        "commence_time": state["commence_time"],
+        "kind": state["kind"],
+        "outcome": state["outcome"],
+        "return_perc": state["opportunity"]["return_perc"],
+        "max_stake": state["opportunity"]["max_stake"],
+        "stakes": state["opportunity"]["stakes"],
+        "first_seen": state["first_seen"].isoformat(),
+        "detected_at": time_now.isoformat()
+    }
+    if event_type == "closed":
+        event["last_seen"] = state["last_seen"].isoformat()
+        event["duration_seconds"] = (state["last_seen"] - state["first_seen"]).total_seconds()
+
+    return event
+
+
+def send_alerts(alerter):
+    """
+    Sends the queued events to every sink, recording the time from
+    detection to notification. Runs in a background thread.
+    """
+
+    while True:
+        event, detected_at = alerter["queue"].get()
+        for sink in alerter["sinks"]:
+            try:
+                sink(event)
+            except Exception as e:
+                increment("collector_alert_errors_total", sink=sink.__name__)
+                print(f"Alert could not be sent by {sink.__name__}: {e}")
+                continue
+            observe("collector_alert_latency_seconds", time.perf_counter() - detected_at, sink=sink.__name__)
+            increment("collector_alerts_total", sink=sink.__name__, event=event["event"])
+        alerter["queue"].task_done()
+
+
+def wait_for_alerts(alerter):
+    """
+    Waits until every queued event has been sent.
+    """
+
+    alerter["queue"].join()
+
+
+def file_sink(fpath):
+    """
+    Returns a sink that appends each event to a file, as a line of JSON.
+    """
+
+    def send_to_file(event):
+        with open(fpath, "a") as f:
+            f.write(json.dumps(event) + "\n")
+
+    return send_to_file
+
+
+def webhook_sink(url, request_timeout=5):
+    """
+    Returns a sink that POSTs each event as JSON to a webhook, re-using
+    the connection between events.
+    """
+
+    session = requests.Session()
+
+    def send_to_webhook(event):
+        response = session.post(url, json=event, timeout=request_timeout)
+        response.raise_for_status()
+
+    return send_to_webhook
+
+
+def queue_sink(event_queue):
+    """
+    Returns a sink that puts each event on a queue (e.g. a queue.Queue, or
+    a multiprocessing.Queue read by another process).
+    """
+
+    def send_to_queue(event):
+        event_queue.put(event)
+
+    return send_to_queue
@@ -6,13 +6,22 @@ saves the results of the analysis to be presented in a dashboard.
 
 # Import necessary packages
 import json
+import time
+import numpy as np
 
+from utils.arbitrage_kernel import arbitrage_kernel, two_bet_kernel, order_book_arbitrage_kernel, portfolio_kernel
+from utils.snapshot_store import save_json_atomic
 
 
+# The possible outcomes of each match
+OUTCOMES = ["home_team","draw","away_team"]
 
-def check_for_arbitrage(bookies_odds_fpath, save_file_fpath,consider_converse_outcomes=False):
+
+
+def calculate_arbitrage(matches):
     """
-    Check for arbitrage within the odds providied by the bookies.
+    Check for arbitrage between the best odds available for each outcome
+    of the given matches, returning the results for each match.
 
     Given the format of the odds (profit = (odds-1) * stake), find that
     arbitrage is possible when:
@@ -30,117 +39,437 @@ def check_for_arbitrage(bookies_odds_fpath, save_file_fpath,consider_converse_ou
     This can be derived by considering how the maximum guaranteed return
     comes when every outcome will return the same.
 
+    The calculations for every match are performed at once, see
+    arbitrage_kernel() in utils/arbitrage_kernel.py.
+    """
+
+    # Extract the odds
+    odds = [[match["home_team"]["best_odds"], match["away_team"]["best_odds"], match["draw"]["best_odds"]]
+            for match in matches]
+    if len(odds) == 0:
+        return []
+
+    # Check for arbitrage
+    kernel_results = arbitrage_kernel(odds)
+
+    # Store the results
+    arb_results = []
+    for i in range(len(odds)):
+
+        # If arbitrage is possible, include the bet sizes and maximum guaranteed return
+        if kernel_results["possible"][i]:
+            guaranteed_return_perc = float(kernel_results["guaranteed_return_perc"][i])
+            arb_results_dict = {
+                "possible":  True,
+                "home_stake": float(kernel_results["stakes"][i, 0]),
+                "away_stake": float(kernel_results["stakes"][i, 1]),
+                "draw_stake": float(kernel_results["stakes"][i, 2]),
+                "guaranteed_return_perc": guaranteed_return_perc,
+                # Python's power is used so the results match the scalar calculation exactly
+                "guaranteed_return_perc_annualised": (1+guaranteed_return_perc)**52-1
+            }
+
+            # Limit the size of the arbitrage to the depth of the Polymarket order books
+            legs = [yes_leg(matches[i][outcome]) for outcome in ["home_team","away_team","draw"]]
+            if any(len(prices) > 0 for prices, _, _ in legs):
+                depth_results = order_book_arbitrage_kernel(legs)
+                arb_results_dict["max_stake"] = depth_results["max_stake"]
+                arb_results_dict["max_stake_return_perc"] = depth_results["blended_return_perc"]
+
+        else:
+            arb_results_dict = {"possible": False}
+
+        arb_results.append(arb_results_dict)
+
+    return arb_results
+
+
+def calculate_2_bet_arbitrage(outcomes_odds):
+    """
+    Check for arbitrage between betting on an outcome happening and
+    betting on it not happening, taking advantage of being able to bet
+    against an event on the prediction markets.
+
+    Takes a list of the odds of outcomes that have converse odds. Returns,
+    for each outcome, the bet sizes and guaranteed return if arbitrage is
+    possible, or None if not. The calculations for every outcome are
+    performed at once, see two_bet_kernel() in utils/arbitrage_kernel.py.
+    """
+
+    if len(outcomes_odds) == 0:
+        return []
+
+    # Missing odds can not be used for arbitrage
+    yes_odds = [outcome_odds["best_odds"] for outcome_odds in outcomes_odds]
+    no_odds = [outcome_odds["converse_outcome_odds"] if isinstance(outcome_odds["converse_outcome_odds"], (int, float))
+               else np.nan for outcome_odds in outcomes_odds]
+
+    # Check for arbitrage
+    kernel_results = two_bet_kernel(yes_odds, no_odds)
+
+    # Store the results
+    two_bet_results = []
+    for i, outcome_odds in enumerate(outcomes_odds):
+        if kernel_results["possible"][i]:
+            two_bet_result = {"Yes_bet_size": float(kernel_results["yes_bet_size"][i]),
+                              "No_bet_size": float(kernel_results["no_bet_size"][i]),
+                              "Percentage_return": float(kernel_results["percentage_return"][i])}
+
+            # Limit the size of the arbitrage to the depth of the Polymarket order books
+            if "polymarket_asks" in outcome_odds:
+                depth_results = order_book_arbitrage_kernel([yes_leg(outcome_odds), no_leg(outcome_odds)])
+                two_bet_result["Max_stake"] = depth_results["max_stake"]
+                two_bet_result["Max_stake_return"] = depth_results["blended_return_perc"]
+
+            two_bet_results.append(two_bet_result)
+        else:
+            two_bet_results.append(None)
+
+    return two_bet_results
+
+
+def calculate_optimal_portfolios(matches):
+    """
+    Finds the best arbitrage for each of the given matches over every
+    combination of backing outcomes (at the best odds, from a bookmaker
+    or a Yes token on Polymarket) and betting against outcomes (with a No
+    token on Polymarket), rather than only the 3-way and 2-bet
+    combinations.
+
+    This is the linear programme of minimising the total stake needed to
+    guarantee a return of 1, whatever the outcome. Its optimum is at a
+    vertex of the portfolios that cover every outcome, and as these are
+    the same for every match, every match is solved at once, see
+    portfolio_kernel() in utils/arbitrage_kernel.py.
+
+    Returns the stakes and guaranteed return of each match if arbitrage
+    is possible.
+    """
+
+    if len(matches) == 0:
+        return []
+
+    # Extract the odds, where missing converse odds can not be used
+    outcomes = ["home_team","away_team","draw"]
+    back_odds = [[match[outcome]["best_odds"] for outcome in outcomes] for match in matches]
+    no_odds = [[match[outcome]["converse_outcome_odds"] if isinstance(match[outcome].get("converse_outcome_odds"), (int, float))
+                else np.nan for outcome in outcomes] for match in matches]
+
+    # Find the best portfolios
+    kernel_results = portfolio_kernel(back_odds, no_odds)
+
+    # Store the results
+    portfolio_results = []
+    for i, match in enumerate(matches):
+        if not kernel_results["possible"][i]:
+            portfolio_results.append({"possible": False})
+            continue
+
+        portfolio_result = {"possible": True}
+        for j, outcome in enumerate(["home", "away", "draw"]):
+            portfolio_result[f"{outcome}_stake"] = float(kernel_results["stakes"][i, j])
+            portfolio_result[f"not_{outcome}_stake"] = float(kernel_results["stakes"][i, 3 + j])
+        portfolio_result["guaranteed_return_perc"] = float(kernel_results["guaranteed_return_perc"][i])
+
+        # Limit the size of the arbitrage to the depth of the Polymarket order books, buying each leg in proportion
+        legs = []
+        for j, outcome in enumerate(outcomes):
+            if kernel_results["amounts"][i, j] > 0:
+                legs.append(scale_leg(yes_leg(match[outcome]), kernel_results["amounts"][i, j]))
+            if kernel_results["amounts"][i, 3 + j] > 0:
+                legs.append(scale_leg(no_leg(match[outcome]), kernel_results["amounts"][i, 3 + j])
+                            if "polymarket_asks" in match[outcome] else None)
+        if None not in legs and any(len(prices) > 0 for prices, _, _ in legs):
+            depth_results = order_book_arbitrage_kernel(legs)
+            portfolio_result["max_stake"] = depth_results["max_stake"]
+            portfolio_result["max_stake_return_perc"] = depth_results["blended_return_perc"]
+
+        portfolio_results.append(portfolio_result)
+
+    return portfolio_results
+
+
+def scale_leg(leg, amount):
+    """
+    Returns a leg of an arbitrage (see yes_leg()) priced per unit paid
+    out by the whole arbitrage, when the leg pays out amount for each
+    unit paid out by the arbitrage.
+    """
+
+    prices, sizes, fallback_price = leg
+
+    return ([price * amount for price in prices], [size / amount for size in sizes],
+            None if fallback_price is None else fallback_price * amount)
+
+
+def yes_leg(outcome_odds):
+    """
+    Returns the leg of an arbitrage that bets on the outcome happening,
+    in the form used by order_book_arbitrage_kernel().
+
+    If Polymarket provides strictly the best odds, the Polymarket asks
+    are used until they are worse than the bookmakers' best odds.
+    Otherwise, a bookmaker provides the best odds for any size.
+    """
+
+    if outcome_odds["bookies_providing"] == "polymarket" and "polymarket_asks" in outcome_odds:
+        asks = outcome_odds["polymarket_asks"]["Yes"]
+        return ([price for price, _ in asks], [size for _, size in asks], 1/outcome_odds["bookmakers_best_odds"])
+
+    return ([], [], 1/outcome_odds["best_odds"])
+
+
+def no_leg(outcome_odds):
+    """
+    Returns the leg of an arbitrage that bets on the outcome not
+    happening on Polymarket, in the form used by
+    order_book_arbitrage_kernel().
+    """
+
+    asks = outcome_odds["polymarket_asks"]["No"]
+    return ([price for price, _ in asks], [size for _, size in asks], None)
+
+
+def create_arbitrage_engine(consider_converse_outcomes=False):
+    """
+    Returns an arbitrage engine, which keeps the analysed odds and the
+    formatted results of every match so that only the matches whose odds
+    have changed need to be analysed again.
+
     consider_converse_outcomes refers to considering the binary scenario
     provided by the ability to bet on an outcome not happening on Polymarket.
     """
 
-    # Load the odds
-    with open(bookies_odds_fpath, "r") as f:
-        bookies_odds = json.load(f)
+    return {
+        "consider_converse_outcomes": consider_converse_outcomes,
+        "matches": [],              # The odds of each match, as last analysed
+        "analysed_odds": [],
+        "formatted_results": format_data([]),
+        "two_bet_results": [],
+        "formatted_portfolios": format_portfolios([]),
+        "changed_since_publish": False,
+        "update_started_at": None   # The time.perf_counter() when the last update started, see utils/alerts.py
+    }
 
-    # Go through each match
-    for i, match in enumerate(bookies_odds):
 
-        # Extract the odds
-        home_odds = match["home_team"]["best_odds"]
-        away_odds = match["away_team"]["best_odds"]
-        draw_odds = match["draw"]["best_odds"]
+def find_changed_outcomes(previous_matches, matches):
+    """
+    Compares the odds of each match with the odds when last analysed.
 
-        # Check for arbitrage
-        arb_check = 1/home_odds + 1/away_odds + 1/draw_odds
+    Returns the outcomes that have changed, keyed by match index, with
+    None in place of the outcomes if anything other than the odds of the
+    outcomes has changed.
+    """
 
-        # If arbitrage is possible, calculate the bet sizes and maximum guaranteed return
-        if arb_check < 1:
+    changes = {}
 
-            # Calculate the weights of the odds
-            home_weight = 1/home_odds
-            away_weight = 1/away_odds
-            draw_weight = 1/draw_odds
+    for i, (previous_match, match) in enumerate(zip(previous_matches, matches)):
 
-            # Calculate the relative bet sizes
-            home_stake = home_weight / arb_check
-            away_stake = away_weight / arb_check
-            draw_stake = draw_weight / arb_check
+        # Check for changes to the match itself
+        if {key: value for key, value in previous_match.items() if key not in OUTCOMES} != \
+           {key: value for key, value in match.items() if key not in OUTCOMES}:
+            changes[i] = None
+            continue
 
-            # Calculate the guaranteed return
-            guaranteed_return = 1 / arb_check - 1
+        # Check for changes to the odds of each outcome
+        changed_outcomes = {outcome for outcome in OUTCOMES if previous_match.get(outcome) != match.get(outcome)}
+        if changed_outcomes:
+            changes[i] = changed_outcomes
 
-            # Change into a percentage
-            guaranteed_return_perc = guaranteed_return * 100
+    return changes
 
-            # Store results
-            arb_results_dict = {
-                "possible":  True,
-                "home_stake": home_stake,
-                "away_stake": away_stake,
-                "draw_stake": draw_stake,
-                "guaranteed_return_perc": guaranteed_return_perc,
-                "guaranteed_return_perc_annualised": (1+guaranteed_return_perc)**52-1
-            }
 
+def prepare_engine_changes(engine, matches, changes=None):
+    """
+    Returns the outcomes of the given odds that need analysing by the
+    engine, keyed by match index, see update_arbitrage_engine(). Makes
+    room for every match if the number of matches has changed, and keeps
+    the odds being analysed to compare against later.
+    """
 
-        else:
-            # Generate the results dict
-            arb_results_dict = {"possible": False}
+    engine["update_started_at"] = time.perf_counter()
 
-        # Add to the results in the list
-        updated_match = match | {"arb": arb_results_dict}
-        bookies_odds[i] = updated_match
+    # Start again if the fixtures have changed
+    if len(matches) != len(engine["matches"]):
+        engine["matches"] = [None] * len(matches)
+        engine["analysed_odds"] = [None] * len(matches)
+        engine["formatted_results"] = {column: [None] * len(matches) for column in engine["formatted_results"]}
+        engine["two_bet_results"] = [None] * len(matches)
+        engine["formatted_portfolios"] = {column: [None] * len(matches) for column in engine["formatted_portfolios"]}
+        changes = {i: None for i in range(len(matches))}
+    elif changes is None:
+        changes = find_changed_outcomes(engine["matches"], matches)
 
-    # Format the data
-    formatted_results = format_data(bookies_odds)
+    # Keep the odds that are being analysed, to compare against later (they are never modified)
+    for i in changes:
+        engine["matches"][i] = matches[i]
 
-    # Save the analysed results
-    with open(save_file_fpath, "w") as f:
-        json.dump(formatted_results, f, indent=4)
+    return changes
 
 
-    if consider_converse_outcomes:
-        """
-        Check for arbitrage opportunities taking advantage of betting against
-        a particular event on the prediction markets.
-        """
-        
-        # Go through each match
-        for i, match in enumerate(bookies_odds):
+def previous_two_bet_arbs(analysed_match):
+    """
+    Returns the results of the 2-bet arbitrage of each outcome of an
+    analysed match, keyed by outcome, or None if the match has not been
+    analysed.
+    """
+
+    if analysed_match is None:
+        return None
 
-            # Consider each possible outcome
-            for outcome in ["home_team","draw","away_team"]:
+    return {outcome: analysed_match[outcome]["2_bet_arb"] for outcome in OUTCOMES
+            if "2_bet_arb" in analysed_match[outcome]}
+
+
+def analyse_matches(matches, changes, previous_results, consider_converse_outcomes=False):
+    """
+    Analyses the given matches for arbitrage.
+
+    changes gives the outcomes of each match that have changed (or None
+    if every outcome has), and previous_results the results of the 2-bet
+    arbitrage of each match when last analysed (see
+    previous_two_bet_arbs()), which are re-used for the outcomes that
+    have not changed.
+
+    If converse outcomes are considered, the best portfolio of every
+    match is also found, see calculate_optimal_portfolios().
+
+    The given matches are not modified, the results are added to copies.
+
+    Returns, for each match, a dict of the analysed match, its formatted
+    results, and its formatted 2-bet arbitrage results and best portfolio
+    (or None if converse outcomes are not considered).
+    """
+
+    # Check for 3-way arbitrage
+    arb_results = calculate_arbitrage(matches)
+    analysed_matches = [match | {"arb": arb_result} for match, arb_result in zip(matches, arb_results)]
+
+    # Check for 2-bet arbitrage in the changed outcomes
+    if consider_converse_outcomes:
+        changed_outcome_odds = []
+        for i, match in enumerate(matches):
+            for outcome in OUTCOMES:
 
                 # Check converse odds are provided
                 if "converse_outcome_odds" not in match[outcome]:
                     continue
 
-                # Get the odds
-                yes_odds = match[outcome]["best_odds"]
-                no_odds = match[outcome]["converse_outcome_odds"]
+                if previous_results[i] is None or changes[i] is None or outcome in changes[i] \
+                        or outcome not in previous_results[i]:
+                    changed_outcome_odds.append((i, outcome))
+                else:
+                    analysed_matches[i][outcome] = match[outcome] | {"2_bet_arb": previous_results[i][outcome]}
 
-                # Check for arbitrage
-                if (1/yes_odds + 1/no_odds) < 1:
-                    # Arbitrage is possible
+        two_bet_results = calculate_2_bet_arbitrage([matches[i][outcome] for i, outcome in changed_outcome_odds])
+        for (i, outcome), two_bet_result in zip(changed_outcome_odds, two_bet_results):
+            analysed_matches[i][outcome] = matches[i][outcome] | {"2_bet_arb": two_bet_result}
 
-                    # Calculate the bet ratio
-                    yes_bet = no_odds / (yes_odds + no_odds)
-                    no_bet = yes_odds / (yes_odds + no_odds)
+        # Find the best portfolio over every combination of bets
+        for analysed_match, portfolio_result in zip(analysed_matches, calculate_optimal_portfolios(matches)):
+            analysed_match["portfolio"] = portfolio_result
 
-                    # Calculate the guaranteed return
-                    A = (1/yes_odds + 1/no_odds)
-                    guaranteed_return_perc = (1-A)/A * 100
+    # Format the results of each match
+    return [{"analysed_match": analysed_match,
+             "formatted_match": format_match(analysed_match),
+             "two_bet_result": format_match_for_2_bet_arb(analysed_match) if consider_converse_outcomes else None,
+             "portfolio_result": format_match_portfolio(analysed_match) if consider_converse_outcomes else None}
+            for analysed_match in analysed_matches]
+
+
+def store_analysis_results(engine, indices, results):
+    """
+    Stores the results of analyse_matches() for the matches with the
+    given indices in the engine.
+    """
+
+    for i, result in zip(indices, results):
+        engine["analysed_odds"][i] = result["analysed_match"]
+        for column, value in result["formatted_match"].items():
+            engine["formatted_results"][column][i] = value
+        if engine["consider_converse_outcomes"]:
+            engine["two_bet_results"][i] = result["two_bet_result"]
+            for column, value in result["portfolio_result"].items():
+                engine["formatted_portfolios"][column][i] = value
+
+    if len(indices) > 0:
+        engine["changed_since_publish"] = True
+
+
+def update_arbitrage_engine(engine, matches, changes=None):
+    """
+    Brings the engine up to date with the given odds, only analysing the
+    matches and outcomes that have changed.
+
+    changes is a dict of the outcomes that have changed (or None if every
+    outcome has changed), keyed by match index. If not given, the changes
+    are found by comparing with the odds when last analysed. If the
+    number of matches has changed, every match is analysed again.
+
+    Returns the indices of the matches that were analysed.
+    """
+
+    changes = prepare_engine_changes(engine, matches, changes)
+
+    # Analyse the changed matches
+    changed_indices = sorted(changes)
+    results = analyse_matches([matches[i] for i in changed_indices],
+                              [changes[i] for i in changed_indices],
+                              [previous_two_bet_arbs(engine["analysed_odds"][i]) for i in changed_indices],
+                              engine["consider_converse_outcomes"])
+
+    # Update the results of each match
+    store_analysis_results(engine, changed_indices, results)
+
+    return set(changes)
 
-                    bookies_odds[i][outcome]["2_bet_arb"] = {"Yes_bet_size": yes_bet,
-                                                            "No_bet_size": no_bet,
-                                                            "Percentage_return": guaranteed_return_perc} 
-                else:
-                    bookies_odds[i][outcome]["2_bet_arb"] = None
 
-        
-        # Format the data in a convenient manner
-        bookies_odds = format_for_2_bet_arb(bookies_odds)
+def publish_arbitrage_engine(engine, save_file_fpath):
+    """
+    Saves the formatted results of the engine to be presented in the
+    dashboard, if they have changed since they were last saved.
+    """
+
+    if not engine["changed_since_publish"]:
+        return
+
+    # Save the analysed results
+    save_json_atomic(save_file_fpath, engine["formatted_results"])
+
+    if engine["consider_converse_outcomes"]:
 
         # Save the data
-        with open("Data/two_bet_arbitrage.json","w") as f:
-            json.dump(bookies_odds, f, indent=4)
-                     
+        save_json_atomic("Data/two_bet_arbitrage.json", engine["two_bet_results"])
+        save_json_atomic("Data/optimal_portfolios.json", engine["formatted_portfolios"])
+
+    engine["changed_since_publish"] = False
+
+
+def check_for_arbitrage(bookies_odds_fpath, save_file_fpath,consider_converse_outcomes=False, engine=None):
+    """
+    Check for arbitrage within the odds providied by the bookies, see
+    calculate_arbitrage() and calculate_2_bet_arbitrage() for details.
+
+    consider_converse_outcomes refers to considering the binary scenario
+    provided by the ability to bet on an outcome not happening on Polymarket.
+
+    If an engine from create_arbitrage_engine() is given, only the matches
+    that have changed since the engine was last updated are analysed, and
+    the results are only saved if they have changed.
+    """
+
+    # Load the odds
+    with open(bookies_odds_fpath, "r") as f:
+        bookies_odds = json.load(f)
+
+    # Analyse the odds
+    if engine is None:
+        engine = create_arbitrage_engine(consider_converse_outcomes)
+    update_arbitrage_engine(engine, bookies_odds)
+
+    # Save the analysed results
+    publish_arbitrage_engine(engine, save_file_fpath)
+
 
 
 def format_data(analysed_data):
@@ -162,40 +491,61 @@ def format_data(analysed_data):
         "Draw Stake": [],
         "Away Stake": [],
         "Return": [],
-        "Annualised Return": []
+        "Annualised Return": [],
+        "Max Stake": [],
+        "Return at Max Stake": []
     }
 
     # Add the results into the above dict
     for match in analysed_data:
-
-        # Add the date
-        formatted_results["Date"].append(match["commence_date"])
-
-        # Odds information
-        formatted_results["Home Team"].append(match["home_team"]["team_name"])
-        formatted_results["Away Team"].append(match["away_team"]["team_name"])
-        formatted_results["Home Win"].append(match["home_team"]["best_odds"])
-        formatted_results["Draw"].append(match["draw"]["best_odds"])
-        formatted_results["Away Win"].append(match["away_team"]["best_odds"])
-
-        # Arbitrage information
-        if match["arb"]["possible"]:
-            formatted_results["Home Stake"].append(f"{match['arb']['home_stake']:.3f}")
-            formatted_results["Draw Stake"].append(f"{match['arb']['draw_stake']:.3f}")
-            formatted_results["Away Stake"].append(f"{match['arb']['away_stake']:.3f}")
-            formatted_results["Return"].append(f"{match['arb']['guaranteed_return_perc']:.3f} %")
-            formatted_results["Annualised Return"].append(f"{match['arb']['guaranteed_return_perc_annualised']:.3f} %")
-        else:
-            formatted_results["Home Stake"].append("-")
-            formatted_results["Draw Stake"].append("-")
-            formatted_results["Away Stake"].append("-")
-            formatted_results["Return"].append("-")
-            formatted_results["Annualised Return"].append("-")
+        for column, value in format_match(match).items():
+            formatted_results[column].append(value)
 
 
     return formatted_results
 
 
+def format_match(match):
+    """
+    Formats the analysed odds of a single match, returning the match's
+    entry in each column of the results created by format_data().
+    """
+
+    # Add the date
+    formatted_match = {"Date": match["commence_date"]}
+
+    # Odds information
+    formatted_match["Home Team"] = match["home_team"]["team_name"]
+    formatted_match["Away Team"] = match["away_team"]["team_name"]
+    formatted_match["Home Win"] = match["home_team"]["best_odds"]
+    formatted_match["Draw"] = match["draw"]["best_odds"]
+    formatted_match["Away Win"] = match["away_team"]["best_odds"]
+
+    # Arbitrage information
+    if match["arb"]["possible"]:
+        formatted_match["Home Stake"] = f"{match['arb']['home_stake']:.3f}"
+        formatted_match["Draw Stake"] = f"{match['arb']['draw_stake']:.3f}"
+        formatted_match["Away Stake"] = f"{match['arb']['away_stake']:.3f}"
+        formatted_match["Return"] = f"{match['arb']['guaranteed_return_perc']:.3f} %"
+        formatted_match["Annualised Return"] = f"{match['arb']['guaranteed_return_perc_annualised']:.3f} %"
+    else:
+        formatted_match["Home Stake"] = "-"
+        formatted_match["Draw Stake"] = "-"
+        formatted_match["Away Stake"] = "-"
+        formatted_match["Return"] = "-"
+        formatted_match["Annualised Return"] = "-"
+
+    # Size of the arbitrage, if limited by the Polymarket order books
+    if match["arb"]["possible"] and "max_stake" in match["arb"] and match["arb"]["max_stake"] != float("inf"):
+        formatted_match["Max Stake"] = f"{match['arb']['max_stake']:.2f}"
+        formatted_match["Return at Max Stake"] = f"{match['arb']['max_stake_return_perc']:.3f} %"
+    else:
+        formatted_match["Max Stake"] = "-"
+        formatted_match["Return at Max Stake"] = "-"
+
+    return formatted_match
+
+
 def format_for_2_bet_arb(bookmakers_odds):
     """
     Formats the data in a convenient manner for monitoring two-bet
@@ -205,55 +555,140 @@ def format_for_2_bet_arb(bookmakers_odds):
     formatted_results = []
 
     for match in bookmakers_odds:
+        formatted_results.append(format_match_for_2_bet_arb(match))
+    
+    return formatted_results
+
+
+def format_match_for_2_bet_arb(match):
+    """
+    Formats the analysed odds of a single match for monitoring two-bet
+    arbitrage.
+    """
 
-        # Get team info
-        home_team = match["home_team"]["team_name"]
-        away_team = match["away_team"]["team_name"]
-        
-        # Begin match dict
-        match_dict = {"Match Name": f"{home_team} vs {away_team}"}
-
-        # Initialise the dataframe
-        results_dict = {
-            "Team": [],
-            "Yes Odds": [],
-            "No Odds": [],
-            "Yes Stake": [],
-            "No Stake": [],
-            "Return": []
-        }
-
-        for outcome, name in zip(["home_team","draw","away_team"],[home_team,"Draw",away_team]):
-
-            results_dict["Team"].append(name)
-            results_dict["Yes Odds"].append(match[outcome]["best_odds"])
-            if "converse_outcome_odds" in match[outcome]:
-                results_dict["No Odds"].append(match[outcome]["converse_outcome_odds"])
-
-                if match[outcome]["2_bet_arb"] is not None:
-                    results_dict["Yes Stake"].append(f"{match[outcome]['2_bet_arb']['Yes_bet_size']:.3f}")
-                    results_dict["No Stake"].append(f"{match[outcome]['2_bet_arb']['No_bet_size']:.3f}")
-                    results_dict["Return"].append(f"{match[outcome]['2_bet_arb']['Percentage_return']:.3f} %")
+    # Get team info
+    home_team = match["home_team"]["team_name"]
+    away_team = match["away_team"]["team_name"]
+    
+    # Begin match dict
+    match_dict = {"Match Name": f"{home_team} vs {away_team}"}
+
+    # Initialise the dataframe
+    results_dict = {
+        "Team": [],
+        "Yes Odds": [],
+        "No Odds": [],
+        "Yes Stake": [],
+        "No Stake": [],
+        "Return": [],
+        "Max Stake": [],
+        "Return at Max Stake": []
+    }
+
+    for outcome, name in zip(["home_team","draw","away_team"],[home_team,"Draw",away_team]):
+
+        results_dict["Team"].append(name)
+        results_dict["Yes Odds"].append(match[outcome]["best_odds"])
+        if "converse_outcome_odds" in match[outcome]:
+            results_dict["No Odds"].append(match[outcome]["converse_outcome_odds"])
+
+            if match[outcome]["2_bet_arb"] is not None:
+                results_dict["Yes Stake"].append(f"{match[outcome]['2_bet_arb']['Yes_bet_size']:.3f}")
+                results_dict["No Stake"].append(f"{match[outcome]['2_bet_arb']['No_bet_size']:.3f}")
+                results_dict["Return"].append(f"{match[outcome]['2_bet_arb']['Percentage_return']:.3f} %")
 
+                # Size of the arbitrage, if limited by the Polymarket order books
+                if "Max_stake" in match[outcome]["2_bet_arb"] and match[outcome]["2_bet_arb"]["Max_stake"] != float("inf"):
+                    results_dict["Max Stake"].append(f"{match[outcome]['2_bet_arb']['Max_stake']:.2f}")
+                    results_dict["Return at Max Stake"].append(f"{match[outcome]['2_bet_arb']['Max_stake_return']:.3f} %")
                 else:
-                    results_dict["Yes Stake"].append("-")
-                    results_dict["No Stake"].append("-")
-                    results_dict["Return"].append("-")
+                    results_dict["Max Stake"].append("-")
+                    results_dict["Return at Max Stake"].append("-")
 
             else:
-                results_dict["No Odds"].append("-")
                 results_dict["Yes Stake"].append("-")
                 results_dict["No Stake"].append("-")
                 results_dict["Return"].append("-")
+                results_dict["Max Stake"].append("-")
+                results_dict["Return at Max Stake"].append("-")
 
-        # Add to the match dict
-        match_dict["Arbitrage Table"] = results_dict
+        else:
+            results_dict["No Odds"].append("-")
+            results_dict["Yes Stake"].append("-")
+            results_dict["No Stake"].append("-")
+            results_dict["Return"].append("-")
+            results_dict["Max Stake"].append("-")
+            results_dict["Return at Max Stake"].append("-")
+
+    # Add to the match dict
+    match_dict["Arbitrage Table"] = results_dict
+
+    return match_dict
+
+
+def format_portfolios(analysed_data):
+    """
+    Formats the best portfolio of each match, found by
+    calculate_optimal_portfolios(), for saving, in the same way as
+    format_data().
+    """
+
+    # Initialise the correctly formatted dict
+    formatted_results = {
+        "Date": [],
+        "Home Team": [],
+        "Away Team": [],
+        "Home Stake": [],
+        "Draw Stake": [],
+        "Away Stake": [],
+        "Not Home Stake": [],
+        "Not Draw Stake": [],
+        "Not Away Stake": [],
+        "Return": [],
+        "Max Stake": [],
+        "Return at Max Stake": []
+    }
+
+    # Add the results into the above dict
+    for match in analysed_data:
+        for column, value in format_match_portfolio(match).items():
+            formatted_results[column].append(value)
 
-        # Append to results
-        formatted_results.append(match_dict)
-    
     return formatted_results
 
 
+def format_match_portfolio(match):
+    """
+    Formats the best portfolio of a single match, returning the match's
+    entry in each column of the results created by format_portfolios().
+    """
 
-    
+    # Match information
+    formatted_match = {"Date": match["commence_date"],
+                       "Home Team": match["home_team"]["team_name"],
+                       "Away Team": match["away_team"]["team_name"]}
+
+    # Stakes, leaving out the bets that are not part of the portfolio
+    portfolio = match["portfolio"]
+    for outcome, name in [("home", "Home"), ("draw", "Draw"), ("away", "Away")]:
+        for stake_key, column in [(f"{outcome}_stake", f"{name} Stake"), (f"not_{outcome}_stake", f"Not {name} Stake")]:
+            if portfolio["possible"] and portfolio[stake_key] > 0:
+                formatted_match[column] = f"{portfolio[stake_key]:.3f}"
+            else:
+                formatted_match[column] = "-"
+
+    # Arbitrage information
+    if portfolio["possible"]:
+        formatted_match["Return"] = f"{portfolio['guaranteed_return_perc']:.3f} %"
+    else:
+        formatted_match["Return"] = "-"
+
+    # Size of the arbitrage, if limited by the Polymarket order books
+    if portfolio["possible"] and "max_stake" in portfolio and portfolio["max_stake"] != float("inf"):
+        formatted_match["Max Stake"] = f"{portfolio['max_stake']:.2f}"
+        formatted_match["Return at Max Stake"] = f"{portfolio['max_stake_return_perc']:.3f} %"
+    else:
+        formatted_match["Max Stake"] = "-"
+        formatted_match["Return at Max Stake"] = "-"
+
+    return formatted_match
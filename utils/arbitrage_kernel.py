@@ -0,0 +1,269 @@
+"""
+This script contains the vectorised arbitrage calculations, which analyse
+the odds of many matches at once. The odds are given as a matrix with a
+row for each match and a column for each outcome, so any number of
+outcomes can be considered, with NaN used for outcomes that a match does
+not have.
+
+See utils/analysis.py for the derivation of the formulas.
+"""
+
+# Import necessary packages
+import itertools
+
+import numpy as np
+
+
+def arbitrage_kernel(odds):
+    """
+    Checks every row of the odds matrix (matches x outcomes) for arbitrage
+    between backing every outcome.
+
+    Returns a dict of arrays:
+    * implied_sum - sum of the implied probabilities of each match
+    * possible - whether arbitrage is possible for each match
+    * stakes - the fraction of the total stake to place on each outcome
+    * guaranteed_return_perc - the guaranteed percentage return
+    * guaranteed_return_perc_annualised - the annualised return
+    """
+
+    odds = np.asarray(odds, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+
+        # Calculate the weights of the odds, ignoring missing outcomes
+        weights = 1 / odds
+        implied_sum = np.nansum(weights, axis=1)
+        has_outcomes = ~np.isnan(odds).all(axis=1)
+
+        # Check for arbitrage
+        possible = (implied_sum < 1) & has_outcomes
+
+        # Calculate the relative bet sizes
+        stakes = weights / implied_sum[:, None]
+
+        # Calculate the guaranteed return, as a percentage
+        guaranteed_return_perc = (1 / implied_sum - 1) * 100
+        guaranteed_return_perc_annualised = (1 + guaranteed_return_perc)**52 - 1
+
+    return {
+        "implied_sum": implied_sum,
+        "possible": possible,
+        "stakes": stakes,
+        "guaranteed_return_perc": guaranteed_return_perc,
+        "guaranteed_return_perc_annualised": guaranteed_return_perc_annualised
+    }
+
+
+def two_bet_kernel(yes_odds, no_odds):
+    """
+    Checks each pair of odds for arbitrage between betting on an outcome
+    happening and betting on it not happening. Missing odds are NaN.
+
+    Returns a dict of arrays:
+    * possible - whether arbitrage is possible for each pair
+    * yes_bet_size / no_bet_size - the fraction of the total stake to
+      place on each side
+    * percentage_return - the guaranteed percentage return
+    """
+
+    yes_odds = np.asarray(yes_odds, dtype=float)
+    no_odds = np.asarray(no_odds, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        # Check for arbitrage
+        A = 1/yes_odds + 1/no_odds
+        possible = A < 1
+
+        # Calculate the bet ratio
+        yes_bet_size = no_odds / (yes_odds + no_odds)
+        no_bet_size = yes_odds / (yes_odds + no_odds)
+
+        # Calculate the guaranteed return
+        percentage_return = (1-A)/A * 100
+
+    return {
+        "possible": possible,
+        "yes_bet_size": yes_bet_size,
+        "no_bet_size": no_bet_size,
+        "percentage_return": percentage_return
+    }
+
+
+def order_book_arbitrage_kernel(legs):
+    """
+    Finds how large an arbitrage can be made when the size available at
+    each price is limited, by walking the ladder of asks of each leg.
+
+    Each leg is a (prices, sizes, fallback_price) tuple, where the prices
+    (sorted from best to worst) and sizes are the asks available for the
+    leg's outcome, priced per unit paid out if the outcome happens. The
+    fallback price is available for any size, e.g. from a bookmaker, or is
+    None. A bookmaker's odds are therefore given as ([], [], 1/odds).
+
+    Buying the same payout on every leg, the marginal cost of each extra
+    unit of payout is the sum of the legs' current ask prices. Every
+    extra unit is profitable while this sum is below 1, so the stake is
+    increased until it is not, or until a leg runs out of asks.
+
+    Returns a dict containing:
+    * max_payout - the payout at the largest profitable size
+    * leg_stakes - the stake placed on each leg at that size
+    * max_stake - the total stake at that size
+    * blended_return_perc - the percentage return at that size
+
+    The sizes are infinite if no leg is limited, and zero if there is no
+    arbitrage.
+    """
+
+    # Prepare each ladder, ignoring asks that are worse than the fallback price
+    ladders = []
+    for prices, sizes, fallback_price in legs:
+        prices = np.asarray(prices, dtype=float)
+        sizes = np.asarray(sizes, dtype=float)
+        if fallback_price is not None:
+            keep = prices < fallback_price
+            prices, sizes = prices[keep], sizes[keep]
+        ladders.append((prices, np.cumsum(sizes), np.cumsum(prices * sizes), fallback_price))
+
+    # The marginal cost only changes when a leg moves onto its next ask
+    breakpoints = np.unique(np.concatenate([[0.0]] + [cum_sizes for _, cum_sizes, _, _ in ladders]))
+
+    # Find the marginal cost of each leg after each breakpoint
+    marginal_cost = np.zeros(len(breakpoints))
+    for prices, cum_sizes, _, fallback_price in ladders:
+        level = np.searchsorted(cum_sizes, breakpoints, side="right")
+        exhausted_price = np.inf if fallback_price is None else fallback_price
+        if len(prices) == 0:
+            marginal_cost += exhausted_price
+        else:
+            marginal_cost += np.where(level < len(prices), prices[np.minimum(level, len(prices) - 1)], exhausted_price)
+
+    # Find the largest payout that is still profitable at the margin
+    profitable = marginal_cost < 1
+    if not profitable[0]:
+        max_payout = 0.0
+    elif profitable.all():
+        max_payout = np.inf
+    else:
+        max_payout = breakpoints[np.argmin(profitable)]
+
+    # Calculate the stakes at that payout
+    if np.isinf(max_payout):
+        # Unlimited, so find the return from the marginal cost instead
+        return {
+            "max_payout": np.inf,
+            "leg_stakes": [np.inf] * len(legs),
+            "max_stake": np.inf,
+            "blended_return_perc": float((1 / marginal_cost[-1] - 1) * 100)
+        }
+    leg_stakes = []
+    for prices, cum_sizes, cum_costs, fallback_price in ladders:
+        ladder_payout = min(max_payout, cum_sizes[-1]) if len(prices) > 0 else 0.0
+        stake = np.interp(ladder_payout, np.concatenate([[0.0], cum_sizes]), np.concatenate([[0.0], cum_costs]))
+        if max_payout > ladder_payout:
+            stake += (max_payout - ladder_payout) * fallback_price
+        leg_stakes.append(float(stake))
+    max_stake = sum(leg_stakes)
+
+    return {
+        "max_payout": float(max_payout),
+        "leg_stakes": leg_stakes,
+        "max_stake": max_stake,
+        "blended_return_perc": float((max_payout / max_stake - 1) * 100) if max_stake > 0 else 0.0
+    }
+
+
+def covering_vertices(payouts):
+    """
+    Finds every vertex of the portfolios that pay out at least 1 whatever
+    the outcome, given the payout of each instrument (columns) in each
+    outcome (rows), per unit bought.
+
+    Each vertex is found by choosing as many columns as there are
+    outcomes from the instruments and the slack of each outcome (paying
+    out more than 1), and solving for the amounts that pay out exactly 1
+    in every outcome. Every choice is solved at once, and the choices that
+    are singular or need negative amounts are discarded.
+
+    Returns a matrix of the amount of each instrument bought (vertices x
+    instruments).
+    """
+
+    payouts = np.asarray(payouts, dtype=float)
+    n_outcomes, n_instruments = payouts.shape
+
+    # Every choice of columns, including the slack of each outcome
+    columns = np.hstack([payouts, -np.eye(n_outcomes)])
+    bases = np.array(list(itertools.combinations(range(columns.shape[1]), n_outcomes)))
+    basis_matrices = np.transpose(columns[:, bases], (1, 0, 2))
+
+    # Solve the choices that are not singular
+    solvable = np.abs(np.linalg.det(basis_matrices)) > 1e-9
+    bases = bases[solvable]
+    amounts = np.linalg.solve(basis_matrices[solvable], np.ones((len(bases), n_outcomes, 1)))[:, :, 0]
+
+    # Keep the choices that are feasible
+    feasible = (amounts > -1e-9).all(axis=1)
+    vertices = np.zeros((feasible.sum(), columns.shape[1]))
+    np.put_along_axis(vertices, bases[feasible], np.clip(amounts[feasible], 0, None), axis=1)
+
+    return np.unique(vertices[:, :n_instruments].round(12), axis=0)
+
+
+# The payout of backing each outcome (home, away, draw) and of betting against each outcome, in each outcome
+PORTFOLIO_PAYOUTS = np.hstack([np.eye(3), 1 - np.eye(3)])
+PORTFOLIO_VERTICES = covering_vertices(PORTFOLIO_PAYOUTS)
+
+
+def portfolio_kernel(back_odds, no_odds, vertices=PORTFOLIO_VERTICES):
+    """
+    Finds, for every row of the odds matrices (matches x outcomes), the
+    cheapest portfolio of backing outcomes (at back_odds) and betting
+    against outcomes (at no_odds) that pays out the same whatever the
+    outcome. Missing odds are NaN.
+
+    This is the linear programme of minimising the cost of paying out at
+    least 1 in every outcome, whose optimum is at one of the vertices
+    from covering_vertices(). As the vertices are the same for every
+    match, the cost of every vertex for every match is found at once, and
+    the cheapest is chosen. This covers the 3-way back and the 2-bet
+    Yes/No arbitrage, along with mixed portfolios, such as betting against
+    the home team while backing a draw.
+
+    Returns a dict of arrays:
+    * cost - the cost of paying out 1 in every outcome, for each match
+    * possible - whether arbitrage is possible for each match
+    * stakes - the fraction of the total stake to place on each back
+      (first columns) and against each outcome (last columns)
+    * amounts - the payout bought of each instrument, per unit paid out
+    * guaranteed_return_perc - the guaranteed percentage return
+    """
+
+    odds = np.hstack([np.asarray(back_odds, dtype=float), np.asarray(no_odds, dtype=float)])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        # The price of each instrument per unit paid out, where missing odds can not be bought
+        prices = np.where(np.isnan(odds), np.inf, 1 / odds)
+
+        # Find the cost of every vertex, ignoring the instruments it does not buy
+        costs = np.where(vertices > 0, prices[:, None, :] * vertices, 0).sum(axis=2)
+
+        # Choose the cheapest vertex
+        best_vertex = np.argmin(costs, axis=1)
+        cost = costs[np.arange(len(odds)), best_vertex]
+        amounts = vertices[best_vertex]
+
+        # Calculate the relative bet sizes and the guaranteed return
+        stakes = np.where(amounts > 0, prices * amounts, 0) / cost[:, None]
+        guaranteed_return_perc = (1 / cost - 1) * 100
+
+    return {
+        "cost": cost,
+        "possible": cost < 1,
+        "stakes": stakes,
+        "amounts": amounts,
+        "guaranteed_return_perc": guaranteed_return_perc
+    }
@@ -7,24 +7,328 @@ preprocess the odds.
 # Import necessary packages
 import requests
 import json
+import hashlib
+import codecs
+import gzip
+import os
 from constants import ODDS_API_KEY
 import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from utils.snapshot_store import save_json_atomic
+from utils.metrics import time_api_request, increment, set_gauge
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 
+# The sessions used to request the odds API, keyed by pool size
+odds_api_sessions = {}
 
-def request_odds_api():
+# The usage quota of the odds API, as of the last response
+odds_api_quota = {"requests_remaining": None, "requests_used": None}
+
+# The ETag, Last-Modified date and odds of the last response for each (sport, region), for conditional requests
+odds_api_responses = {}
+
+# The fields kept for each outcome of a market, see reduce_match()
+OUTCOME_FIELDS = ("name", "price", "point")
+
+# The processed odds of each match, with the hash of its response when processed, keyed by match ID, and the
+# IDs of the matches in the order last processed
+processed_matches = {"by_id": {}, "match_ids": []}
+
+
+def get_odds_api_session(pool_size):
     """
-    Request the latest odds from the API.
+    Returns the session used for every request to the odds API, so the
+    connections are kept alive and shared between requests, with up to
+    pool_size connections open at once.
+    """
+
+    if odds_api_sessions.get(pool_size) is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        odds_api_sessions[pool_size] = session
+
+    return odds_api_sessions[pool_size]
+
+
+def iter_json_array(text_chunks):
+    """
+    Parses a JSON array arriving in the given chunks of text, yielding
+    each element as soon as it is complete, so only one element (plus a
+    chunk) is held in memory at a time.
+
+    Raises a ValueError if the text is not a JSON array, or ends before
+    the array does.
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    for chunk in text_chunks:
+        buffer += chunk
+        position = 0
+
+        while True:
+
+            # Skip the whitespace and commas between elements
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+
+            # Check the array has started, or has ended
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+
+            # Parse the next element, waiting for more text if it is incomplete
+            try:
+                element, position_after = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            yield element
+            position = position_after
+
+        # Only keep the unparsed text
+        buffer = buffer[position:]
+
+    raise ValueError("JSON array ended early")
+
+
+def reduce_match(match, markets=("h2h",)):
+    """
+    Returns the match from the response of the odds API, with the odds of
+    each bookmaker for only the given markets. Bookmakers without any of
+    the markets are left out.
+
+    The odds of every bookmaker are kept, rather than only the best odds,
+    as the odds directory and the odds history show each bookmaker, and
+    the regions are merged by bookmaker (see merge_odds_responses()), but
+    each is reduced to the fields those use: the key, title and last
+    update of the bookmaker, and the name, price and point (for totals
+    and spreads) of each outcome.
+    """
+
+    bookmakers = []
+    for bookie in match["bookmakers"]:
+        bookie_markets = [{"key": market["key"],
+                           "outcomes": [{field: outcome[field] for field in OUTCOME_FIELDS if field in outcome}
+                                        for outcome in market["outcomes"]]}
+                          for market in bookie["markets"] if market["key"] in markets]
+        if len(bookie_markets) > 0:
+            bookmakers.append({"key": bookie["key"], "title": bookie["title"], "last_update": bookie["last_update"],
+                               "markets": bookie_markets})
+
+    return match | {"bookmakers": bookmakers}
+
+
+def stream_response_text(odds_response, archive_file=None, chunk_size=65536):
+    """
+    Yields the (decompressed) text of a streamed response as it arrives,
+    also writing each chunk to archive_file if given.
+    """
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in odds_response.iter_content(chunk_size=chunk_size):
+        if archive_file is not None:
+            archive_file.write(chunk)
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def fetch_odds_api_request(session, sport, region, request_timeout, markets=("h2h",), raw_archive_dpath=None):
+    """
+    Requests the latest odds for a single sport and region, for the given
+    markets.
+
+    The response is parsed as it arrives, with each match reduced to only
+    the odds of the given markets, see reduce_match(), so the full response
+    is never held in memory. If raw_archive_dpath is given, the full response is saved
+    there, compressed, as {sport}-{region}.json.gz.
+
+    Returns the odds, or None if the request failed, and the headers of
+    the response.
     """
 
     # Define the necessary paramaters
-    sport = 'soccer_epl'    # Get Premier League odds
-    regions = 'uk'          # Get odds from UK bookies
-    markets = 'h2h'         # Only pull h2h market info
     odds_format = 'decimal'
     date_format = 'iso'
 
+    # Only ask for the odds if they have changed since the last response, where supported
+    last_response = odds_api_responses.get((sport, region))
+    headers = {'Accept-Encoding': 'gzip, deflate'}
+    if last_response is not None and last_response["etag"] is not None:
+        headers['If-None-Match'] = last_response["etag"]
+    if last_response is not None and last_response["last_modified"] is not None:
+        headers['If-Modified-Since'] = last_response["last_modified"]
+
+    # Request the api
+    try:
+        with time_api_request("odds"):
+            odds_response = session.get(
+                f'https://api.the-odds-api.com/v4/sports/{sport}/odds',
+                params={
+                    'api_key': ODDS_API_KEY,
+                    'regions': region,
+                    'markets': ",".join(markets),
+                    'oddsFormat': odds_format,
+                    'dateFormat': date_format,
+                },
+                headers=headers,
+                timeout=request_timeout,
+                stream=True
+            )
+
+            # Re-use the last odds if they have not changed
+            if odds_response.status_code == 304 and last_response is not None:
+                odds_response.close()
+                return last_response["odds_json"], odds_response.headers
+
+            # Check for a successful connection
+            if odds_response.status_code != 200:
+                increment("collector_api_errors_total", api="odds")
+                print(f'Failed to get odds for {sport} ({region}): status_code {odds_response.status_code}, '
+                      f'response body {odds_response.text}')
+                return None, odds_response.headers
+
+            # Parse each match as it arrives, archiving the full response
+            if raw_archive_dpath is not None:
+                os.makedirs(raw_archive_dpath, exist_ok=True)
+                archive_fpath = os.path.join(raw_archive_dpath, f"{sport}-{region}.json.gz")
+                with gzip.open(f"{archive_fpath}.tmp", "wb") as archive_file:
+                    odds_json = [reduce_match(match, markets) for match
+                                 in iter_json_array(stream_response_text(odds_response, archive_file))]
+                os.replace(f"{archive_fpath}.tmp", archive_fpath)
+            else:
+                odds_json = [reduce_match(match, markets)
+                             for match in iter_json_array(stream_response_text(odds_response))]
+
+    except (requests.RequestException, ValueError) as e:
+        print(f'Failed to get odds for {sport} ({region}): {e}')
+        return None, {}
+
+    # Keep the response for the next conditional request
+    if 'ETag' in odds_response.headers or 'Last-Modified' in odds_response.headers:
+        odds_api_responses[(sport, region)] = {"etag": odds_response.headers.get('ETag'),
+                                               "last_modified": odds_response.headers.get('Last-Modified'),
+                                               "odds_json": odds_json}
+
+    return odds_json, odds_response.headers
+
+
+def merge_odds_responses(responses):
+    """
+    Merges the responses of the odds API for several sports and regions
+    into a single response, combining the bookmakers of each match across
+    regions. A bookmaker listed in several regions is kept once, using its
+    most recently updated odds.
+
+    Matches without any bookmakers are left out.
+    """
+
+    # Combine the bookmakers of each match
+    merged_matches = {}
+    for odds_json in responses:
+        for match in odds_json:
+            if match["id"] not in merged_matches:
+                merged_matches[match["id"]] = match | {"bookmakers": {}}
+            merged_bookmakers = merged_matches[match["id"]]["bookmakers"]
+            for bookie in match["bookmakers"]:
+                if bookie["key"] not in merged_bookmakers or \
+                   bookie["last_update"] > merged_bookmakers[bookie["key"]]["last_update"]:
+                    merged_bookmakers[bookie["key"]] = bookie
+
+    # Order the matches by kick off, as the API does
+    merged_odds = [match | {"bookmakers": list(match["bookmakers"].values())}
+                   for match in merged_matches.values() if len(match["bookmakers"]) > 0]
+    merged_odds.sort(key=lambda match: match["commence_time"])
+
+    return merged_odds
+
+
+def fetch_odds_api(sports=("soccer_epl",), regions=("uk",), max_workers=8, request_timeout=30, markets=("h2h",),
+                   raw_archive_dpath=None):
+    """
+    Request the latest odds from the API, without saving anything.
+
+    Every combination of the given sports (e.g. soccer_epl) and regions
+    (e.g. uk, eu) is requested concurrently, using up to max_workers
+    connections, and the responses are merged, see merge_odds_responses().
+    See fetch_odds_api_request() for the markets and raw_archive_dpath.
+
+    Returns the odds, whether the request was successful, and the time
+    of the request. The request is successful if any sport and region
+    was collected.
+    """
+
+    # Record time of API request
+    request_time = datetime.now().astimezone().isoformat()
+
+    # Request every sport and region at once
+    requested = [(sport, region) for sport in sports for region in regions]
+    session = get_odds_api_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requested)))) as executor:
+        results = list(executor.map(lambda request: fetch_odds_api_request(session, *request, request_timeout,
+                                                                           markets, raw_archive_dpath),
+                                    requested))
+
+    # Check for a successful connection
+    responses = [odds_json for odds_json, _ in results if odds_json is not None]
+    if len(responses) == 0:
+        return {}, False, request_time
+    odds_json = merge_odds_responses(responses)
+
+    # Check the usage quota
+    print(f"Successfully collected odds for {len(responses)} of {len(requested)} sports and regions")
+    quota_headers = [headers for _, headers in results if 'x-requests-remaining' in headers]
+    if len(quota_headers) > 0:
+        requests_remaining = min(float(headers['x-requests-remaining']) for headers in quota_headers)
+        requests_used = max(float(headers['x-requests-used']) for headers in quota_headers)
+        print('Remaining requests', requests_remaining)
+        print('Used requests', requests_used)
+        set_gauge("collector_odds_api_requests_remaining", requests_remaining)
+        set_gauge("collector_odds_api_requests_used", requests_used)
+        odds_api_quota["requests_remaining"] = requests_remaining
+        odds_api_quota["requests_used"] = requests_used
+
+    # Return the repsonse
+    return odds_json, True, request_time
+
+
+def merge_refreshed_leagues(previous_odds, odds_json, kept_after_kickoff=timedelta(hours=3)):
+    """
+    Combines a response of the odds API for some of the leagues with the
+    previous response, keeping the previous matches of any league that
+    was not refreshed, unless they kicked off more than kept_after_kickoff
+    ago.
+    """
+
+    refreshed_sports = {match.get("sport_key") for match in odds_json}
+    oldest_kickoff = (datetime.now(timezone.utc) - kept_after_kickoff).strftime("%Y-%m-%dT%H:%M:%SZ")
+    kept_matches = [match for match in previous_odds
+                    if match.get("sport_key") not in refreshed_sports and match["commence_time"] >= oldest_kickoff]
+
+    return sorted(kept_matches + odds_json, key=lambda match: match["commence_time"])
+
+
+def request_odds_api(sports=("soccer_epl",), regions=("uk",), max_workers=8, markets=("h2h",), raw_archive_dpath=None):
+    """
+    Request the latest odds from the API.
+
+    See fetch_odds_api() for the arguments.
+    """
+
+    # Request the api
+    odds_json, successful_connection, request_time = fetch_odds_api(sports, regions, max_workers,
+                                                                    markets=markets, raw_archive_dpath=raw_archive_dpath)
+
     # Record time of API request
     try:
         with open("Data/update_times.json","r") as f:
@@ -32,114 +336,156 @@ def request_odds_api():
     except:
         update_times = {}
     # update_times["Bookmakers"] = time.strftime('%H:%M:%S')
-    update_times["Bookmakers"] = datetime.now().astimezone().isoformat()
-    with open("Data/update_times.json","w") as f:
-        json.dump(update_times, f, indent=4)
-
-    # Request the api
-    odds_response = requests.get(
-        f'https://api.the-odds-api.com/v4/sports/{sport}/odds',
-        params={
-            'api_key': ODDS_API_KEY,
-            'regions': regions,
-            'markets': markets,
-            'oddsFormat': odds_format,
-            'dateFormat': date_format,
-        }
-    )
+    update_times["Bookmakers"] = request_time
+    save_json_atomic("Data/update_times.json", update_times)
 
     # Check for a successful connection
-    if odds_response.status_code != 200:
-        print(f'Failed to get odds: status_code {odds_response.status_code}, response body {odds_response.text}')
+    if not successful_connection:
         return {}, False
     else:
-        odds_json = odds_response.json()
+        # Keep the odds of the leagues that were not refreshed
+        try:
+            with open("Data/full_bookies_odds.json", "r") as f:
+                previous_odds_json = json.load(f)
+        except (OSError, ValueError):
+            previous_odds_json = None
+        if previous_odds_json is not None:
+            odds_json = merge_refreshed_leagues(previous_odds_json, odds_json)
 
-        # Check the usage quota
-        print("Successfully collected odds")
-        print('Remaining requests', odds_response.headers['x-requests-remaining'])
-        print('Used requests', odds_response.headers['x-requests-used'])
-
-        # Save all the odds
-        with open("Data/full_bookies_odds.json","w") as f:
-            json.dump(odds_json, f, indent=4)
+        # Save all the odds, if they have changed
+        if odds_json != previous_odds_json:
+            save_json_atomic("Data/full_bookies_odds.json", odds_json)
 
         # Return the repsonse
         return odds_json, True
 
 
+def process_match(match):
+    """
+    Process the odds of a single match, from the response of the API, to
+    obtain the best available odds, and the bookies providing them.
+    """
+
+    # Initialise the dicts
+    home_team_dict = {"team_name": match["home_team"]}
+    away_team_dict = {"team_name": match["away_team"]}
+
+    # Get the odds from all the bookmakers
+    bookmakers = match["bookmakers"]
+
+    # Initialise the best odds dict
+    best_odds_dict = {}
+
+    # Go through all the bookies
+    for bookie in bookmakers:
+
+        # Go through each market (for redundancy)
+        for market in bookie["markets"]:
+
+            # Extra check
+            if not market["key"] == "h2h":
+                continue
+
+            # Go through the outcomes
+            for outcome in market["outcomes"]:
+
+                if outcome["name"] not in best_odds_dict:
+                    best_odds_dict[outcome["name"]] = {"best_odds": outcome["price"], "bookies_providing": [bookie["key"]]}
+                else:
+                    if outcome["price"] > best_odds_dict[outcome["name"]]["best_odds"]:
+                        best_odds_dict[outcome["name"]]["best_odds"] = outcome["price"]
+                        best_odds_dict[outcome["name"]]["bookies_providing"] = [bookie["key"]]
+                    elif outcome["price"] == best_odds_dict[outcome["name"]]["best_odds"]:
+                        best_odds_dict[outcome["name"]]["bookies_providing"].append(bookie["key"])
+    
+    # Create the full dict
+    home_team_dict = home_team_dict | best_odds_dict[home_team_dict["team_name"]]
+    away_team_dict = away_team_dict | best_odds_dict[away_team_dict["team_name"]]
+    full_dict = {"home_team": home_team_dict,
+                "away_team": away_team_dict,
+                "draw": best_odds_dict["Draw"]}
+    
+    # Add the date and kick off time of the match
+    full_dict["commence_date"] = match["commence_time"][:10]
+    full_dict["commence_time"] = match["commence_time"]
+
+    # Add the ID and league of the match
+    full_dict["match_id"] = match["id"]
+    full_dict["sport_key"] = match["sport_key"]
+
+    return full_dict
+
+
 def process_odds(full_odds_json):
     """
     Process the odds to obtain the best available odds, and the bookies
     providing them.
     """
 
-    # Initialise the full results
-    full_results = []
-
-    # Go through every match
-    for match in full_odds_json:
-
-        # Initialise the dicts
-        home_team_dict = {"team_name": match["home_team"]}
-        away_team_dict = {"team_name": match["away_team"]}
-
-        # Get the odds from all the bookmakers
-        bookmakers = match["bookmakers"]
-
-        # Initialise the best odds dict
-        best_odds_dict = {}
-
-        # Go through all the bookies
-        for bookie in bookmakers:
-
-            # Go through each market (for redundancy)
-            for market in bookie["markets"]:
-
-                # Extra check
-                if not market["key"] == "h2h":
-                    continue
-
-                # Go through the outcomes
-                for outcome in market["outcomes"]:
-
-                    if outcome["name"] not in best_odds_dict:
-                        best_odds_dict[outcome["name"]] = {"best_odds": outcome["price"], "bookies_providing": [bookie["key"]]}
-                    else:
-                        if outcome["price"] > best_odds_dict[outcome["name"]]["best_odds"]:
-                            best_odds_dict[outcome["name"]]["best_odds"] = outcome["price"]
-                            best_odds_dict[outcome["name"]]["bookies_providing"] = [bookie["key"]]
-                        elif outcome["price"] == best_odds_dict[outcome["name"]]["best_odds"]:
-                            best_odds_dict[outcome["name"]]["bookies_providing"].append(bookie["key"])
-        
-        # Create the full dict
-        home_team_dict = home_team_dict | best_odds_dict[home_team_dict["team_name"]]
-        away_team_dict = away_team_dict | best_odds_dict[away_team_dict["team_name"]]
-        full_dict = {"home_team": home_team_dict,
-                    "away_team": away_team_dict,
-                    "draw": best_odds_dict["Draw"]}
-        
-        # Add the date of the match
-        full_dict["commence_date"] = match["commence_time"][:10]
-        
-        # Add to the full set of results
-        full_results.append(full_dict)
-    
-    return full_results
+    return [process_match(match) for match in full_odds_json]
 
 
-def update_odds(save_fpath):
+def match_hash(match):
+    """
+    Returns a hash of a match in the response of the odds API, which
+    changes whenever any of its odds change.
+    """
+
+    return hashlib.sha256(json.dumps(match).encode()).hexdigest()
+
+
+def process_changed_odds(full_odds_json, process_matches=process_odds):
+    """
+    Processes the odds in the same way as process_odds(), but only
+    processes the matches whose odds have changed since they were last
+    processed, re-using the previous results of the others.
+
+    The changed matches are processed by process_matches, which takes and
+    returns a list of matches in the same way as process_odds(), e.g. see
+    process_odds_sharded() in utils/sharded_analysis.py.
+
+    Returns the processed odds, and the indices of the matches that have
+    changed, or None if the matches themselves have changed (added,
+    removed or re-ordered), so their indices can not be compared.
+    """
+
+    # Find the matches that have changed
+    hashes = [match_hash(match) for match in full_odds_json]
+    changed_indices = {i for i, (match, hash_) in enumerate(zip(full_odds_json, hashes))
+                       if processed_matches["by_id"].get(match["id"], (None, None))[0] != hash_}
+
+    # Process them
+    sorted_changed_indices = sorted(changed_indices)
+    processed_changed_matches = process_matches([full_odds_json[i] for i in sorted_changed_indices])
+    for i, processed_match in zip(sorted_changed_indices, processed_changed_matches):
+        processed_matches["by_id"][full_odds_json[i]["id"]] = (hashes[i], processed_match)
+
+    # Collect the results, forgetting the matches that are no longer listed
+    match_ids = [match["id"] for match in full_odds_json]
+    processed_matches["by_id"] = {match_id: processed_matches["by_id"][match_id] for match_id in match_ids}
+    processed_odds = [processed_matches["by_id"][match_id][1] for match_id in match_ids]
+    if match_ids != processed_matches["match_ids"]:
+        changed_indices = None
+    processed_matches["match_ids"] = match_ids
+
+    return processed_odds, changed_indices
+
+
+def update_odds(save_fpath, sports=("soccer_epl",), regions=("uk",), max_workers=8, markets=("h2h",),
+                raw_archive_dpath=None):
     """
     Performs all the necessary functions to obtain the processed odds.
+
+    See fetch_odds_api() for the arguments.
     """
 
     # Request odds from API
-    full_odds_json, successful_connection = request_odds_api()
+    full_odds_json, successful_connection = request_odds_api(sports, regions, max_workers, markets, raw_archive_dpath)
 
-    # Process the odds
+    # Process the odds that have changed
     if successful_connection:
-        processed_odds = process_odds(full_odds_json)
+        processed_odds, changed_indices = process_changed_odds(full_odds_json)
 
-        # Save the results
-        with open(save_fpath, "w") as f:
-            json.dump(processed_odds, f, indent=4)
+        # Save the results, if they have changed
+        if changed_indices != set():
+            save_json_atomic(save_fpath, processed_odds)
@@ -0,0 +1,295 @@
+"""
+This script contains the data layer shared by the pages of the Streamlit
+dashboard. The documents are loaded, and the tables built, once per
+version of the data, and shared between every viewer, rather than being
+re-loaded on every refresh of every viewer's page.
+
+The cached results are shared, so must not be modified by the pages.
+
+Each section of a page is a fragment, so changing its widgets only re-runs
+that section. A small fragment on each page, which renders nothing, checks
+every data_check_period whether the version of any of the documents shown
+on the page has changed, and only then re-runs the page. The published
+JSON files are watched for changes, so the version is only looked up once
+one of the documents has changed, and the tables are only rebuilt once
+their version has changed.
+"""
+
+# Import necessary packages
+import os
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+from utils.snapshot_store import DOCUMENT_FPATHS, dashboard_data_version, load_dashboard_documents
+
+
+# Number of versions of the data kept in the cache
+cached_versions = 2
+
+# How the pages are refreshed
+use_file_watcher = True                         # If False, check the version of the data on every re-run of a section
+watch_dpath = "Data"
+watch_check_interval = timedelta(seconds=1)     # How often each page checks for changes seen by the watcher
+refresh_period = timedelta(seconds=5)           # How often each page checks the data if not watching for changes
+data_check_period = watch_check_interval if use_file_watcher else refresh_period
+snapshot_catch_up_period = timedelta(seconds=30)    # How long to wait for a changed file's snapshot
+
+# The documents shown by each section of the dashboard, whose tables are only rebuilt when they change
+ARBITRAGE_DOCUMENTS = ("analysed_odds", "analysed_odds_with_polymarket")
+TWO_BET_DOCUMENTS = ("two_bet_arbitrage",)
+PORTFOLIO_DOCUMENTS = ("optimal_portfolios",)
+DIRECTORY_DOCUMENTS = ("odds_directory",)
+UPDATE_TIMES_DOCUMENTS = ("update_times",)
+directory_page_size = 10    # Number of matches shown on each page of the detailed odds directory
+
+
+@st.cache_resource(max_entries=cached_versions, show_spinner=False)
+def build_arbitrage_tables(data_version):
+    """
+    Builds the tables of 3-way arbitrage shown on the home page, for the
+    given version of the analysed odds.
+    """
+
+    documents = load_dashboard_documents(ARBITRAGE_DOCUMENTS, data_version)
+
+    return {
+        "analysed_odds": pd.DataFrame(documents["analysed_odds"]),
+        "analysed_odds_with_polymarket": pd.DataFrame(documents["analysed_odds_with_polymarket"])
+    }
+
+
+@st.cache_resource(max_entries=cached_versions, show_spinner=False)
+def build_two_bet_tables(data_version):
+    """
+    Builds the table of 2-bet arbitrage of each match shown on the home
+    page, for the given version of the 2-bet arbitrage results.
+    """
+
+    documents = load_dashboard_documents(TWO_BET_DOCUMENTS, data_version)
+
+    return [(match["Match Name"], pd.DataFrame(match["Arbitrage Table"])) for match in documents["two_bet_arbitrage"]]
+
+
+@st.cache_resource(max_entries=cached_versions, show_spinner=False)
+def build_portfolio_table(data_version):
+    """
+    Builds the table of the best portfolio of each match shown on the home
+    page, for the given version of the portfolios.
+    """
+
+    documents = load_dashboard_documents(PORTFOLIO_DOCUMENTS, data_version)
+
+    return pd.DataFrame(documents["optimal_portfolios"])
+
+
+@st.cache_resource(max_entries=cached_versions, show_spinner=False)
+def build_directory_tables(data_version):
+    """
+    Loads the detailed odds directory precomputed by the collector (see
+    utils/odds_directory.py), for the given version of the directory,
+    along with the text each match is searched by.
+    """
+
+    documents = load_dashboard_documents(DIRECTORY_DOCUMENTS, data_version)
+
+    return {
+        "matches": documents["odds_directory"],
+        "search_texts": [" ".join([entry["title"], entry["commence_time"][:10]] + entry["bookmakers"]).lower()
+                         for entry in documents["odds_directory"]]
+    }
+
+
+def search_directory(tables, query):
+    """
+    Returns the matches in the directory whose teams, date or bookmakers
+    contain every word of the query.
+    """
+
+    words = query.lower().split()
+
+    return [entry for entry, search_text in zip(tables["matches"], tables["search_texts"])
+            if all(word in search_text for word in words)]
+
+
+def build_match_tables(entry):
+    """
+    Builds the tables of a single match in the directory: the odds of
+    each bookmaker, styled to highlight the best odds of each outcome,
+    and the Polymarket odds (or None if there are none).
+    """
+
+    # Highlight the best odds, as flagged by the collector
+    odds_df = pd.DataFrame(entry["odds"], index=entry["outcomes"], columns=entry["bookmakers"], dtype=float)
+    highlights = np.where(entry["best"], "background-color: lightgreen", "") if len(entry["bookmakers"]) > 0 else ""
+    styled_odds = odds_df.style.apply(lambda _: highlights, axis=None).format("{:.2f}", na_rep="-")
+
+    # Add the Polymarket odds
+    if entry["polymarket"] is None:
+        polymarket_df = None
+    else:
+        polymarket_df = pd.DataFrame(entry["polymarket"], index=entry["outcomes"])
+
+    return styled_odds, polymarket_df
+
+
+def load_arbitrage_tables():
+    """
+    Returns the tables of 3-way arbitrage, for the latest data.
+    """
+
+    return build_arbitrage_tables(shown_data_version(ARBITRAGE_DOCUMENTS))
+
+
+def load_two_bet_tables():
+    """
+    Returns the tables of 2-bet arbitrage, for the latest data.
+    """
+
+    return build_two_bet_tables(shown_data_version(TWO_BET_DOCUMENTS))
+
+
+def load_portfolio_table():
+    """
+    Returns the table of the best portfolios, for the latest data.
+    """
+
+    return build_portfolio_table(shown_data_version(PORTFOLIO_DOCUMENTS))
+
+
+def load_directory_tables():
+    """
+    Returns the tables shown on the detailed odds directory, for the
+    latest data.
+    """
+
+    return build_directory_tables(shown_data_version(DIRECTORY_DOCUMENTS))
+
+
+def load_update_times():
+    """
+    Returns when the odds were last updated.
+    """
+
+    data_version = shown_data_version(UPDATE_TIMES_DOCUMENTS)
+
+    return load_dashboard_documents(UPDATE_TIMES_DOCUMENTS, data_version)["update_times"]
+
+
+class DataChangeHandler(FileSystemEventHandler):
+    """
+    Counts the changes made to each of the published JSON files, ignoring
+    every other file in the watched directory (e.g. the snapshot store,
+    the metrics log and temporary files).
+    """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.document_names = {os.path.abspath(fpath): name for name, fpath in DOCUMENT_FPATHS.items()}
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ("created", "modified", "moved", "deleted"):
+            return
+
+        # Files are replaced by moving a temporary file onto them
+        for fpath in [event.src_path, getattr(event, "dest_path", "")]:
+            name = self.document_names.get(os.path.abspath(fpath)) if fpath else None
+            if name is not None:
+                self.watcher["change_counts"][name] += 1
+
+
+@st.cache_resource(show_spinner=False)
+def start_data_watcher():
+    """
+    Starts watching the published JSON files for changes, shared by every
+    viewer.
+
+    Returns the state of the watcher, containing the number of changes
+    seen so far to each document.
+    """
+
+    watcher = {
+        "change_counts": {name: 0 for name in DOCUMENT_FPATHS},
+        "versions": {}      # The last version found of each set of documents, and the change counts it was found at
+    }
+
+    # Fall back to polling the directory if it can not be watched natively
+    try:
+        observer = Observer()
+        observer.schedule(DataChangeHandler(watcher), watch_dpath)
+        observer.start()
+    except OSError:
+        observer = PollingObserver()
+        observer.schedule(DataChangeHandler(watcher), watch_dpath)
+        observer.start()
+
+    return watcher
+
+
+def current_data_version(documents):
+    """
+    Returns the version of the given documents that should be shown. If
+    watching for changes, the version is only looked up again once the
+    watcher has seen one of the documents change, and is shared by every
+    viewer.
+
+    The collector may save a file before committing the snapshot
+    containing it, so if the version has not changed yet it is looked up
+    again on each check, for up to snapshot_catch_up_period.
+    """
+
+    if not use_file_watcher:
+        return dashboard_data_version(documents)
+
+    # Use the last version found if none of the documents have changed since
+    watcher = start_data_watcher()
+    change_counts = tuple(watcher["change_counts"][name] for name in documents)
+    seen = watcher["versions"].get(documents)
+    if seen is not None and seen["change_counts"] == change_counts and \
+       (not seen["catching_up"] or time.monotonic() - seen["changed_at"] > snapshot_catch_up_period.total_seconds()):
+        return seen["version"]
+
+    # Look up the version, which has not caught up with the change if it is the same as before
+    version = dashboard_data_version(documents)
+    watcher["versions"][documents] = {
+        "change_counts": change_counts,
+        "version": version,
+        "changed_at": time.monotonic() if seen is None or seen["change_counts"] != change_counts
+                      else seen["changed_at"],
+        "catching_up": seen is not None and seen["version"] == version
+    }
+
+    return version
+
+
+def shown_data_version(documents):
+    """
+    Returns the version of the given documents that should be shown, see
+    current_data_version(), recording it as the version shown to this
+    viewer.
+    """
+
+    version = current_data_version(documents)
+    st.session_state.setdefault("shown_versions", {})[documents] = version
+
+    return version
+
+
+@st.fragment(run_every=data_check_period)
+def rerun_on_data_change(page_documents):
+    """
+    Re-runs the page once the version of any of the documents shown on it
+    (a list of the documents of each section) differs from the version
+    last shown to this viewer. Renders nothing.
+    """
+
+    shown_versions = st.session_state.get("shown_versions", {})
+    for documents in page_documents:
+        if documents in shown_versions and current_data_version(documents) != shown_versions[documents]:
+            st.rerun()
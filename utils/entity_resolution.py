@@ -0,0 +1,212 @@
+"""
+This script contains all the functions used to resolve the same fixture
+across providers: the odds API names teams in full (e.g. "Manchester
+City"), while Polymarket identifies markets by slugs built from team codes
+(e.g. "epl-mac-che-2025-08-16-mac"), which have changed over time.
+
+Every team name and code is resolved to a canonical team through an alias
+table, and every Polymarket slug seen is parsed into its (league, home
+team, away team, date, outcome), so the markets of a fixture can be found
+with a single lookup, whichever codes the slugs use.
+"""
+
+# Import necessary packages
+import re
+
+
+# The prefix of the Polymarket market slugs of each league, keyed by the odds API's sport key
+POLYMARKET_LEAGUE_PREFIXES = {
+    "soccer_epl": "epl"
+}
+
+# The aliases of each team, keyed by league prefix then by the team's name on the odds API. The first
+# alias is the code used to construct the team's Polymarket slugs, and teams not listed use the first
+# three letters of their name
+TEAM_ALIASES = {
+    "epl": {
+        "Arsenal": ["ars"],
+        "Aston Villa": ["ast", "avl", "Villa"],
+        "Bournemouth": ["bou", "AFC Bournemouth"],
+        "Brentford": ["bre"],
+        "Brighton and Hove Albion": ["bri", "bha", "Brighton", "Brighton & Hove Albion"],
+        "Burnley": ["bur", "brn"],
+        "Chelsea": ["che"],
+        "Crystal Palace": ["cry", "Palace"],
+        "Everton": ["eve"],
+        "Fulham": ["ful"],
+        "Ipswich Town": ["ips", "Ipswich"],
+        "Leeds United": ["lee", "Leeds"],
+        "Leicester City": ["lei", "Leicester"],
+        "Liverpool": ["liv"],
+        "Manchester City": ["mac", "mci", "Man City"],
+        "Manchester United": ["mun", "mnu", "Man United", "Man Utd"],
+        "Newcastle United": ["new", "Newcastle"],
+        "Nottingham Forest": ["not", "nfo", "Nott'm Forest", "Forest"],
+        "Southampton": ["sou"],
+        "Sunderland": ["sun"],
+        "Tottenham Hotspur": ["tot", "Tottenham", "Spurs"],
+        "West Ham United": ["wes", "whu", "West Ham"],
+        "Wolverhampton Wanderers": ["wol", "Wolves"]
+    }
+}
+
+# The parts of a Polymarket slug of a match outcome, e.g. epl-mac-che-2025-08-16-mac
+SLUG_PATTERN = re.compile(r"^(?P<league>[a-z0-9]+)-(?P<home>[a-z0-9]+)-(?P<away>[a-z0-9]+)-"
+                          r"(?P<date>\d{4}-\d{2}-\d{2})-(?P<outcome>[a-z0-9]+)$")
+
+# The markets of each fixture, keyed by (league prefix, home team, away team, date), with the slug of each
+# outcome's market, and the fixture of each slug already indexed
+entity_index = {"fixtures": {}, "indexed_slugs": {}}
+
+
+def normalise_name(name):
+    """
+    Returns the name in the form used to compare aliases.
+    """
+
+    return " ".join(name.lower().replace("&", "and").split())
+
+
+def build_alias_index():
+    """
+    Returns the canonical name of every team, keyed by (league prefix,
+    normalised alias).
+    """
+
+    alias_index = {}
+    for league_prefix, teams in TEAM_ALIASES.items():
+        for team_name, aliases in teams.items():
+            for alias in [team_name] + aliases:
+                alias_index[(league_prefix, normalise_name(alias))] = team_name
+
+    return alias_index
+
+
+ALIAS_INDEX = build_alias_index()
+
+
+def canonical_team(league_prefix, name):
+    """
+    Returns the canonical name of the team with the given name or code,
+    or the name itself if it is not in the alias table.
+    """
+
+    return ALIAS_INDEX.get((league_prefix, normalise_name(name)), name)
+
+
+def team_code(league_prefix, team_name):
+    """
+    Returns the code used in the Polymarket slugs for the given team.
+    """
+
+    aliases = TEAM_ALIASES.get(league_prefix, {}).get(canonical_team(league_prefix, team_name))
+    if aliases:
+        return aliases[0]
+
+    # Code is first three letters
+    return normalise_name(team_name)[:3]
+
+
+def parse_market_slug(market_slug):
+    """
+    Returns the league prefix, canonical home and away teams, date and
+    outcome ("home_team", "draw" or "away_team") of the market with the
+    given slug, or None if it is not the market of a match outcome.
+    """
+
+    parts = SLUG_PATTERN.match(market_slug)
+    if parts is None or parts["league"] not in TEAM_ALIASES:
+        return None
+
+    # Resolve the teams
+    league_prefix = parts["league"]
+    home_team = canonical_team(league_prefix, parts["home"])
+    away_team = canonical_team(league_prefix, parts["away"])
+
+    # Resolve the outcome
+    if parts["outcome"] == "draw":
+        outcome = "draw"
+    elif canonical_team(league_prefix, parts["outcome"]) == home_team:
+        outcome = "home_team"
+    elif canonical_team(league_prefix, parts["outcome"]) == away_team:
+        outcome = "away_team"
+    else:
+        return None
+
+    return {"league": league_prefix, "home_team": home_team, "away_team": away_team,
+            "date": parts["date"], "outcome": outcome}
+
+
+def slug_entity(market_slug):
+    """
+    Returns the (league prefix, home team, away team, date, outcome) of
+    the market with the given slug, or None if it is not the market of a
+    match outcome. Slugs of the same outcome using different team codes
+    have the same entity.
+    """
+
+    parsed = parse_market_slug(market_slug)
+    if parsed is None:
+        return None
+
+    return parsed["league"], parsed["home_team"], parsed["away_team"], parsed["date"], parsed["outcome"]
+
+
+def fixture_key(match):
+    """
+    Returns the key of a processed match in the entity index, or None if
+    its league is not on Polymarket.
+    """
+
+    league_prefix = POLYMARKET_LEAGUE_PREFIXES.get(match.get("sport_key", "soccer_epl"))
+    if league_prefix is None:
+        return None
+
+    return (league_prefix,
+            canonical_team(league_prefix, match["home_team"]["team_name"]),
+            canonical_team(league_prefix, match["away_team"]["team_name"]),
+            match["commence_date"])
+
+
+def index_market_slugs(market_slugs):
+    """
+    Parses the given Polymarket slugs, adding the markets of match
+    outcomes to the entity index. Slugs already indexed are skipped.
+    """
+
+    for market_slug in market_slugs:
+        if market_slug in entity_index["indexed_slugs"]:
+            continue
+
+        entity = slug_entity(market_slug)
+        if entity is None:
+            continue
+        entity_index["indexed_slugs"][market_slug] = entity[:4]
+        entity_index["fixtures"].setdefault(entity[:4], {})[entity[4]] = market_slug
+
+
+def prune_entity_index(matches):
+    """
+    Removes the fixtures dated before every one of the given processed
+    matches from the entity index, along with their slugs, so the index
+    only holds the fixtures that can still be matched, however long the
+    collector (or a replay) runs.
+    """
+
+    if len(matches) == 0:
+        return
+    oldest_date = min(match["commence_date"] for match in matches)
+
+    for market_slug, key in list(entity_index["indexed_slugs"].items()):
+        if key[3] < oldest_date:
+            del entity_index["indexed_slugs"][market_slug]
+            entity_index["fixtures"].pop(key, None)
+
+
+def indexed_market_slugs(match):
+    """
+    Returns the slugs of the indexed Polymarket markets for each outcome
+    of a processed match.
+    """
+
+    return entity_index["fixtures"].get(fixture_key(match), {})
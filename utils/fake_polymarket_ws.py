@@ -0,0 +1,69 @@
+"""
+A local stand-in for Polymarket's market websocket, used to run the
+streaming mode of main.py offline. Replays a recorded list of events to
+every client, only sending the events for the tokens each client has
+subscribed to. Events given as strings are sent as they are, e.g. to test
+malformed messages.
+
+Run with:
+
+python -m utils.fake_polymarket_ws events.json
+
+and set polymarket_ws_url in main.py to "ws://localhost:8765". The stream
+is checked against it with python -m benchmarks.check_stream.
+"""
+
+# Import necessary packages
+import asyncio
+import json
+import sys
+
+import websockets
+
+
+async def replay_events(websocket, events, interval):
+    """
+    Waits for the client's subscription, then sends it the events for the
+    tokens it subscribed to.
+    """
+
+    # Get the subscribed tokens
+    subscription = json.loads(await websocket.recv())
+    token_ids = set(subscription["assets_ids"])
+
+    # Send the events
+    for event in events:
+        if isinstance(event, str):
+            await websocket.send(event)
+        elif event.get("asset_id") in token_ids or \
+             any(change["asset_id"] in token_ids for change in event.get("price_changes", [])):
+            await websocket.send(json.dumps([event]))
+        else:
+            continue
+        await asyncio.sleep(interval)
+
+    # Respond to keep-alive messages until the client disconnects
+    try:
+        async for message in websocket:
+            if message == "PING":
+                await websocket.send("PONG")
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+async def serve_fake_market_feed(events, host="localhost", port=8765, interval=0.1):
+    """
+    Serves the events until cancelled.
+    """
+
+    async with websockets.serve(lambda websocket: replay_events(websocket, events, interval), host, port):
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+
+    # Load the recorded events
+    with open(sys.argv[1], "r") as f:
+        recorded_events = json.load(f)
+
+    asyncio.run(serve_fake_market_feed(recorded_events))
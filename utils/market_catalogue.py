@@ -0,0 +1,216 @@
+"""
+This script contains all the functions used to maintain a local catalogue
+of the markets available on Polymarket. The catalogue is cached on disk so
+it can be warm-started, is only synced with the API periodically, and is
+indexed by market slug and condition ID so markets can be looked up
+without searching through every market.
+"""
+
+# Import necessary packages
+import json
+import os
+from datetime import datetime
+
+from utils.polymarket_functions import get_clob_client, fetch_markets_page
+from utils.entity_resolution import index_market_slugs
+
+
+# Fields of each market that are kept in the catalogue
+CATALOGUE_FIELDS = ["condition_id", "market_slug", "question", "tokens",
+                    "active", "closed", "accepting_orders", "end_date_iso",
+                    "game_start_time"]
+
+
+def create_market_catalogue():
+    """
+    Returns an empty market catalogue.
+
+    The catalogue is a dict containing:
+    * markets - every market, keyed by condition ID
+    * by_slug - the condition ID of every market, keyed by market slug
+    * resume_cursor - the cursor of the last page of markets fetched,
+      from which an incremental sync continues
+    * last_sync / last_full_sync - when the catalogue was last synced
+    """
+
+    return {
+        "markets": {},
+        "by_slug": {},
+        "resume_cursor": None,
+        "last_sync": None,
+        "last_full_sync": None
+    }
+
+
+def load_market_catalogue(cache_fpath):
+    """
+    Loads the market catalogue saved at the given path. Returns an empty
+    catalogue if there is no valid cache.
+    """
+
+    try:
+        with open(cache_fpath, "r") as f:
+            saved_catalogue = json.load(f)
+    except (OSError, ValueError):
+        return create_market_catalogue()
+
+    # Rebuild the catalogue, re-creating the slug index
+    catalogue = create_market_catalogue()
+    catalogue["resume_cursor"] = saved_catalogue.get("resume_cursor")
+    catalogue["last_sync"] = saved_catalogue.get("last_sync")
+    catalogue["last_full_sync"] = saved_catalogue.get("last_full_sync")
+    add_markets_to_catalogue(catalogue, saved_catalogue.get("markets", []))
+
+    return catalogue
+
+
+def save_market_catalogue(catalogue, cache_fpath):
+    """
+    Saves the market catalogue to the given path.
+
+    The file is written in full before replacing the previous cache, so
+    an interrupted save never leaves a partially written cache behind.
+    """
+
+    saved_catalogue = {
+        "resume_cursor": catalogue["resume_cursor"],
+        "last_sync": catalogue["last_sync"],
+        "last_full_sync": catalogue["last_full_sync"],
+        "markets": list(catalogue["markets"].values())
+    }
+
+    tmp_fpath = f"{cache_fpath}.tmp"
+    with open(tmp_fpath, "w") as f:
+        json.dump(saved_catalogue, f)
+    os.replace(tmp_fpath, cache_fpath)
+
+
+def add_markets_to_catalogue(catalogue, markets):
+    """
+    Adds the given markets to the catalogue, replacing any existing
+    records of the same markets.
+
+    Returns the number of markets that were new or had changed.
+    """
+
+    n_changed = 0
+
+    for market in markets:
+
+        # Only keep the necessary fields
+        record = {field: market.get(field) for field in CATALOGUE_FIELDS}
+
+        # Skip markets that can not be indexed
+        if not record["condition_id"] or not record["market_slug"]:
+            continue
+
+        # Check whether the market is new or has changed
+        previous_record = catalogue["markets"].get(record["condition_id"])
+        if previous_record == record:
+            continue
+
+        # Stop looking up the market by its old slug, if it has changed
+        if previous_record is not None and previous_record["market_slug"] != record["market_slug"] and \
+           catalogue["by_slug"].get(previous_record["market_slug"]) == record["condition_id"]:
+            del catalogue["by_slug"][previous_record["market_slug"]]
+
+        catalogue["markets"][record["condition_id"]] = record
+        catalogue["by_slug"][record["market_slug"]] = record["condition_id"]
+        index_market_slugs([record["market_slug"]])
+        n_changed += 1
+
+    return n_changed
+
+
+def sync_market_catalogue(catalogue, client=None, full_sync=False):
+    """
+    Brings the catalogue up to date with the markets available on
+    Polymarket.
+
+    New markets are added to the end of the list of markets, so an
+    incremental sync only fetches the pages from the last page fetched
+    previously onwards. A full sync fetches every page, picking up any
+    changes to existing markets.
+
+    Returns the number of markets that were new or had changed.
+    """
+
+    # Get the client
+    if client is None:
+        client = get_clob_client()
+
+    # Find where to start fetching pages from
+    if full_sync or catalogue["resume_cursor"] is None:
+        full_sync = True
+        next_cursor = None
+    else:
+        next_cursor = catalogue["resume_cursor"]
+
+    # Go through the pages
+    n_changed = 0
+    while True:
+        try:
+            page_cursor = next_cursor
+            markets_page, next_cursor = fetch_markets_page(client, page_cursor)
+        except Exception as e:
+            print(f"Failed to sync market catalogue: {e}")
+            return n_changed
+
+        n_changed += add_markets_to_catalogue(catalogue, markets_page)
+
+        # Remember the last page, as it is where new markets will appear
+        if page_cursor is not None:
+            catalogue["resume_cursor"] = page_cursor
+
+        # Exit loop if there are no more pages to fetch
+        if not next_cursor:
+            break
+
+    # Record the sync time
+    sync_time = datetime.now().astimezone().isoformat()
+    catalogue["last_sync"] = sync_time
+    if full_sync:
+        catalogue["last_full_sync"] = sync_time
+
+    return n_changed
+
+
+def refresh_market_catalogue(catalogue, cache_fpath, sync_period, full_sync_period, client=None):
+    """
+    Syncs the catalogue if it has not been synced within sync_period, or
+    performs a full sync if it has not had one within full_sync_period.
+    Saves the catalogue if any markets were new or had changed.
+    """
+
+    # Get the current time
+    time_now = datetime.now().astimezone()
+
+    # Check whether a sync is due
+    if catalogue["last_full_sync"] is None or \
+       time_now >= datetime.fromisoformat(catalogue["last_full_sync"]) + full_sync_period:
+        full_sync = True
+    elif catalogue["last_sync"] is None or \
+         time_now >= datetime.fromisoformat(catalogue["last_sync"]) + sync_period:
+        full_sync = False
+    else:
+        return
+
+    # Sync the catalogue
+    n_changed = sync_market_catalogue(catalogue, client=client, full_sync=full_sync)
+
+    # Update the cache
+    if n_changed > 0 or full_sync:
+        save_market_catalogue(catalogue, cache_fpath)
+
+
+def lookup_market(catalogue, market_slug):
+    """
+    Returns the catalogue record of the market with the given slug, or
+    None if the market is not in the catalogue.
+    """
+
+    cond_id = catalogue["by_slug"].get(market_slug)
+    if cond_id is None:
+        return None
+
+    return catalogue["markets"][cond_id]
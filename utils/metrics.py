@@ -0,0 +1,229 @@
+"""
+This script contains the metrics recorded by the collector: how long each
+stage of each update takes, the latency and errors of every API request,
+the remaining quota of the odds API, and how quickly alerts are sent.
+
+The metrics can be served in the Prometheus text format, see
+start_metrics_server(), and a summary of each update can be written to a
+rotating file, see start_metrics_file().
+"""
+
+# Import necessary packages
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+
+# Upper bounds of the histogram buckets, in seconds
+HISTOGRAM_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# The type and description of each metric
+METRIC_DEFINITIONS = {
+    "collector_tick_duration_seconds": ("histogram", "Time taken by each update of the collector loop."),
+    "collector_stage_duration_seconds": ("histogram", "Time taken by each stage of an update."),
+    "collector_api_request_duration_seconds": ("histogram", "Latency of the requests to each API."),
+    "collector_api_errors_total": ("counter", "Number of failed requests to each API."),
+    "collector_odds_api_requests_remaining": ("gauge", "Remaining requests in the odds API quota."),
+    "collector_odds_api_requests_used": ("gauge", "Requests used from the odds API quota."),
+    "collector_alert_latency_seconds": ("histogram", "Time from analysing an opportunity to notifying each alert sink."),
+    "collector_alerts_total": ("counter", "Number of alerts sent by each sink."),
+    "collector_alert_errors_total": ("counter", "Number of alerts each sink failed to send.")
+}
+
+# The recorded values, keyed by metric name then by labels
+metrics = {name: {} for name in METRIC_DEFINITIONS}
+metrics_lock = threading.Lock()
+
+# The stages of the current update, and where they are logged
+tick = {"start": None, "stages": {}}
+metrics_logger = logging.getLogger("collector_metrics")
+
+
+def label_key(labels):
+    """
+    Returns the labels in a hashable form.
+    """
+
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    """
+    Records a value of a histogram metric.
+    """
+
+    with metrics_lock:
+        histogram = metrics[name].setdefault(label_key(labels), {"buckets": [0] * len(HISTOGRAM_BUCKETS),
+                                                                 "sum": 0.0, "count": 0})
+        for i, upper_bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= upper_bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def increment(name, amount=1, **labels):
+    """
+    Increases a counter metric.
+    """
+
+    with metrics_lock:
+        metrics[name][label_key(labels)] = metrics[name].get(label_key(labels), 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets the value of a gauge metric.
+    """
+
+    with metrics_lock:
+        metrics[name][label_key(labels)] = value
+
+
+@contextmanager
+def time_stage(stage):
+    """
+    Records how long the code within the context takes, as a stage of the
+    current update.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        observe("collector_stage_duration_seconds", duration, stage=stage)
+        with metrics_lock:
+            tick["stages"][stage] = tick["stages"].get(stage, 0.0) + duration
+
+
+@contextmanager
+def time_api_request(api):
+    """
+    Records the latency of the API request within the context, counting
+    it as an error if it raises an exception.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment("collector_api_errors_total", api=api)
+        raise
+    finally:
+        observe("collector_api_request_duration_seconds", time.perf_counter() - start, api=api)
+
+
+def start_tick():
+    """
+    Marks the start of an update of the collector loop.
+    """
+
+    with metrics_lock:
+        tick["start"] = time.perf_counter()
+        tick["stages"] = {}
+
+
+def finish_tick():
+    """
+    Marks the end of an update of the collector loop, recording its
+    duration, and logging a summary of it if a metrics file has been
+    started.
+    """
+
+    if tick["start"] is None:
+        return
+    duration = time.perf_counter() - tick["start"]
+    observe("collector_tick_duration_seconds", duration)
+
+    if metrics_logger.handlers:
+        with metrics_lock:
+            summary = {
+                "time": datetime.now().astimezone().isoformat(),
+                "tick_seconds": duration,
+                "stage_seconds": dict(tick["stages"]),
+                "api_errors": {dict(labels)["api"]: count for labels, count in metrics["collector_api_errors_total"].items()},
+                "odds_api_requests_remaining": metrics["collector_odds_api_requests_remaining"].get(())
+            }
+        metrics_logger.info(json.dumps(summary))
+
+
+def render_metrics():
+    """
+    Returns every metric in the Prometheus text format.
+    """
+
+    def format_labels(labels):
+        if len(labels) == 0:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    lines = []
+    with metrics_lock:
+        for name, (metric_type, description) in METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in metrics[name].items():
+                if metric_type == "histogram":
+                    for upper_bound, count in zip(HISTOGRAM_BUCKETS, value["buckets"]):
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', str(upper_bound)),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value['count']}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {value['sum']}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics at /metrics.
+    """
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't print every request
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serves the metrics at http://host:port/metrics from a background
+    thread. By default they are only served to this machine; pass a host
+    such as "0.0.0.0" to serve them to other machines.
+    """
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def start_metrics_file(fpath, max_bytes=10_000_000, backup_count=5):
+    """
+    Logs a summary of every update to the given file, as a line of JSON,
+    starting a new file once it reaches max_bytes and keeping
+    backup_count previous files.
+    """
+
+    handler = RotatingFileHandler(fpath, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    metrics_logger.addHandler(handler)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
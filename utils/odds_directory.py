@@ -0,0 +1,100 @@
+"""
+This script contains the functions used by the collector to precompute
+the detailed odds directory shown on the dashboard: the odds of every
+bookmaker for each match, with the best odds for each outcome flagged,
+and the odds available on Polymarket.
+
+The directory is built once for each update of the odds and published
+with them, so the dashboard only has to render the matches being viewed,
+rather than rebuilding and styling every match's tables on every refresh.
+"""
+
+# Import necessary packages
+from utils.snapshot_store import DOCUMENT_FPATHS, load_documents_from_files, save_json_atomic
+
+
+def join_polymarket_odds(full_bookies_odds, full_polymarket_odds):
+    """
+    Returns the Polymarket odds of each match, keyed by match ID. Older
+    files without match IDs can only be joined by position.
+    """
+
+    if all("match_id" in polymarket_odds for polymarket_odds in full_polymarket_odds):
+        return {polymarket_odds["match_id"]: polymarket_odds for polymarket_odds in full_polymarket_odds}
+
+    return {match["id"]: polymarket_odds for match, polymarket_odds in zip(full_bookies_odds, full_polymarket_odds)}
+
+
+def directory_entry(match, polymarket_odds):
+    """
+    Returns the entry of a match in the directory, from its odds in the
+    response of the odds API and its Polymarket odds (see
+    merge_polymarket_odds() in utils/polymarket_functions.py).
+
+    The odds of each outcome (home team, draw, away team) are given for
+    each bookmaker, with a flag for each bookmaker providing the best
+    odds for the outcome.
+    """
+
+    # Get match info
+    home_team = match["home_team"]
+    away_team = match["away_team"]
+    outcomes = [home_team, "Draw", away_team]
+
+    # Get the odds from each bookmaker
+    bookmakers = []
+    odds = [[] for _ in outcomes]
+    for bookmaker in match["bookmakers"]:
+        h2h_markets = [market for market in bookmaker["markets"] if market["key"] == "h2h"]
+        if len(h2h_markets) == 0:
+            continue
+        prices = {outcome["name"]: outcome["price"] for outcome in h2h_markets[0]["outcomes"]}
+
+        bookmakers.append(bookmaker["title"])
+        for i, outcome in enumerate(outcomes):
+            odds[i].append(prices.get(outcome))
+
+    # Flag the best odds of each outcome
+    best = []
+    for outcome_odds in odds:
+        best_odds = max((price for price in outcome_odds if price is not None), default=None)
+        best.append([price is not None and price == best_odds for price in outcome_odds])
+
+    # Add the Polymarket odds, if every outcome has a market
+    if all(outcome in polymarket_odds for outcome in ["home_team", "draw", "away_team"]):
+        polymarket = {side: [polymarket_odds[outcome][side] for outcome in ["home_team", "draw", "away_team"]]
+                      for side in ["Yes", "No"]}
+    else:
+        polymarket = None
+
+    return {
+        "match_id": match["id"],
+        "title": f"{home_team} vs {away_team}",
+        "commence_time": match["commence_time"],
+        "outcomes": outcomes,
+        "bookmakers": bookmakers,
+        "odds": odds,
+        "best": best,
+        "polymarket": polymarket
+    }
+
+
+def build_odds_directory(full_bookies_odds, full_polymarket_odds):
+    """
+    Returns the directory: the entry of every match, see
+    directory_entry(), in the order of the bookmakers odds.
+    """
+
+    polymarket_odds_by_id = join_polymarket_odds(full_bookies_odds, full_polymarket_odds)
+
+    return [directory_entry(match, polymarket_odds_by_id.get(match["id"], {})) for match in full_bookies_odds]
+
+
+def save_odds_directory():
+    """
+    Builds the directory from the currently saved odds, and saves it.
+    """
+
+    documents = load_documents_from_files(["full_bookies_odds", "full_polymarket_odds"])
+    save_json_atomic(DOCUMENT_FPATHS["odds_directory"],
+                     build_odds_directory(documents["full_bookies_odds"], documents["full_polymarket_odds"]))
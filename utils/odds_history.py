@@ -0,0 +1,312 @@
+"""
+This script contains all the functions used to record the history of the
+odds, and to query it.
+
+Every quote is recorded with the time it was seen, keyed by match ID,
+venue (a bookmaker, or one side of Polymarket) and outcome. A quote is
+only recorded when its price differs from the last recorded price, so
+unchanged odds take no space.
+
+The quotes are appended to a segment file for each day, as fixed size
+records (see QUOTE_DTYPE), so recording never rewrites earlier data and
+the segments can be read back directly as NumPy arrays. The (match ID,
+venue, outcome) of each key are listed, one per line, in keys.jsonl.
+"""
+
+# Import necessary packages
+import glob
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+
+# Layout of each recorded quote
+QUOTE_DTYPE = np.dtype([
+    ("time", "<i8"),    # Milliseconds since the epoch, UTC
+    ("key", "<u4"),     # Line of keys.jsonl
+    ("price", "<f8")    # Decimal odds
+])
+
+OUTCOMES = ["home_team", "draw", "away_team"]
+
+
+def open_odds_history(history_dpath):
+    """
+    Opens the history saved in the given directory, creating it if
+    necessary.
+
+    Returns the state of the history.
+    """
+
+    os.makedirs(history_dpath, exist_ok=True)
+
+    history = {
+        "dpath": history_dpath,
+        "keys": {},
+        "last_prices": {},
+        "last_maintenance": None
+    }
+
+    # Load the keys
+    keys_fpath = os.path.join(history_dpath, "keys.jsonl")
+    if os.path.exists(keys_fpath):
+        with open(keys_fpath, "r") as f:
+            for line in f:
+                history["keys"][tuple(json.loads(line))] = len(history["keys"])
+
+    # Find the last recorded price of each key, so unchanged quotes are not recorded again, going back through the
+    # segments until every key is found
+    for _, segment_fpath in reversed(segment_fpaths(history)):
+        if len(history["last_prices"]) == len(history["keys"]):
+            break
+        quotes = load_segment(segment_fpath)
+        quotes = quotes[~np.isin(quotes["key"], list(history["last_prices"]))]
+        keys, last_index = np.unique(quotes["key"][::-1], return_index=True)
+        for key, price in zip(keys, quotes["price"][::-1][last_index]):
+            history["last_prices"][int(key)] = float(price)
+
+    return history
+
+
+def segment_fpaths(history):
+    """
+    Returns the (date, file path) of every segment, in order of date.
+
+    A day may have both a downsampled segment and a segment of quotes
+    recorded for it after it was downsampled (e.g. when replaying), in
+    which case the downsampled segment comes first.
+    """
+
+    segments = []
+    for fpath in glob.glob(os.path.join(history["dpath"], "*.bin")):
+        segments.append((os.path.basename(fpath).split(".")[0], fpath))
+
+    return sorted(segments, key=lambda segment: (segment[0], not segment[1].endswith(".downsampled.bin")))
+
+
+def load_segment(segment_fpath):
+    """
+    Returns the quotes in a segment, ignoring any partially written
+    record at the end.
+    """
+
+    n_quotes = os.path.getsize(segment_fpath) // QUOTE_DTYPE.itemsize
+    if n_quotes == 0:
+        return np.zeros(0, dtype=QUOTE_DTYPE)
+
+    return np.memmap(segment_fpath, dtype=QUOTE_DTYPE, mode="r", shape=(n_quotes,))
+
+
+def get_key(history, match_id, venue, outcome):
+    """
+    Returns the key of the (match ID, venue, outcome), adding it to the
+    keys if it is new.
+    """
+
+    key_tuple = (match_id, venue, outcome)
+    if key_tuple not in history["keys"]:
+        with open(os.path.join(history["dpath"], "keys.jsonl"), "a") as f:
+            f.write(json.dumps(key_tuple) + "\n")
+        history["keys"][key_tuple] = len(history["keys"])
+
+    return history["keys"][key_tuple]
+
+
+def record_quotes(history, quotes, quote_time=None):
+    """
+    Records the quotes, given as (match ID, venue, outcome, price), seen
+    at quote_time (a timezone aware datetime, defaulting to now).
+
+    Returns the number of quotes recorded, which excludes quotes whose
+    price has not changed.
+    """
+
+    if quote_time is None:
+        quote_time = datetime.now().astimezone()
+    time_ms = int(quote_time.timestamp() * 1000)
+
+    # Find the quotes that have changed
+    changed_keys = []
+    changed_prices = []
+    for match_id, venue, outcome, price in quotes:
+        key = get_key(history, match_id, venue, outcome)
+        if history["last_prices"].get(key) != price:
+            history["last_prices"][key] = price
+            changed_keys.append(key)
+            changed_prices.append(price)
+
+    if len(changed_keys) == 0:
+        return 0
+
+    # Append them to the day's segment
+    records = np.zeros(len(changed_keys), dtype=QUOTE_DTYPE)
+    records["time"] = time_ms
+    records["key"] = changed_keys
+    records["price"] = changed_prices
+    segment_date = quote_time.astimezone(timezone.utc).date().isoformat()
+    with open(os.path.join(history["dpath"], f"{segment_date}.bin"), "ab") as f:
+        f.write(records.tobytes())
+
+    return len(records)
+
+
+def bookmaker_quotes(full_odds_json):
+    """
+    Returns the quotes of every bookmaker, from the full response of the
+    odds API.
+    """
+
+    quotes = []
+    for match in full_odds_json:
+        outcome_names = {match["home_team"]: "home_team", "Draw": "draw", match["away_team"]: "away_team"}
+        for bookie in match["bookmakers"]:
+            for market in bookie["markets"]:
+                if not market["key"] == "h2h":
+                    continue
+                for outcome in market["outcomes"]:
+                    quotes.append((match["id"], bookie["key"], outcome_names[outcome["name"]], float(outcome["price"])))
+
+    return quotes
+
+
+def polymarket_quotes(bookmakers_odds, polymarket_odds):
+    """
+    Returns the quotes of Polymarket, with the Yes and No sides of each
+    market recorded as the venues "polymarket" and "polymarket_no".
+    """
+
+    quotes = []
+    for match, polymarket_match_odds in zip(bookmakers_odds, polymarket_odds):
+        match_id = polymarket_match_odds.get("match_id", match.get("match_id"))
+        if match_id is None:
+            continue
+        for outcome in OUTCOMES:
+            for side, venue in [("Yes", "polymarket"), ("No", "polymarket_no")]:
+                price = polymarket_match_odds.get(outcome, {}).get(side)
+                if isinstance(price, (int, float)):
+                    quotes.append((match_id, venue, outcome, float(price)))
+
+    return quotes
+
+
+def query_price_series(history, match_id, outcome, start, end, venues=None):
+    """
+    Returns the prices of the outcome of the match between start and end
+    (timezone aware datetimes), for the given venues or every venue.
+
+    Returns a dict of (times, prices) arrays, keyed by venue, where each
+    price was quoted at the corresponding time and held until the next.
+    Each series starts at start with the price held then, if the venue
+    was quoted before start, so venues whose price did not change
+    between start and end are still included.
+    """
+
+    # Find the keys of the series
+    wanted_keys = {key: venue for (key_match_id, venue, key_outcome), key in history["keys"].items()
+                   if key_match_id == match_id and key_outcome == outcome and (venues is None or venue in venues)}
+    start_ms = int(start.timestamp() * 1000)
+    end_ms = int(end.timestamp() * 1000)
+
+    # Collect the quotes from each segment in the range
+    start_date = start.astimezone(timezone.utc).date().isoformat()
+    end_date = end.astimezone(timezone.utc).date().isoformat()
+    selected = []
+    for segment_date, segment_fpath in segment_fpaths(history):
+        if not start_date <= segment_date <= end_date:
+            continue
+        quotes = load_segment(segment_fpath)
+
+        # Quotes are appended in time order, so the range can be found by bisection
+        first, last = np.searchsorted(quotes["time"], [start_ms, end_ms], side="left")
+        quotes = quotes[first:last]
+        selected.append(quotes[np.isin(quotes["key"], list(wanted_keys))])
+
+    # Find the price held at start, from the last quote before it, going back through the segments until every venue is found
+    held_prices = {}
+    for segment_date, segment_fpath in reversed(segment_fpaths(history)):
+        if len(held_prices) == len(wanted_keys):
+            break
+        if segment_date > start_date:
+            continue
+        quotes = load_segment(segment_fpath)
+        quotes = quotes[:np.searchsorted(quotes["time"], start_ms, side="left")]
+        quotes = quotes[np.isin(quotes["key"], [key for key in wanted_keys if key not in held_prices])]
+
+        # The last quote of each key
+        keys, positions_from_end = np.unique(quotes["key"][::-1], return_index=True)
+        for key, position_from_end in zip(keys, positions_from_end):
+            held_prices[int(key)] = float(quotes["price"][len(quotes) - 1 - position_from_end])
+
+    # Split them into a series for each venue
+    quotes = np.concatenate(selected) if len(selected) > 0 else np.zeros(0, dtype=QUOTE_DTYPE)
+    series = {}
+    for key, venue in wanted_keys.items():
+        venue_quotes = quotes[quotes["key"] == key]
+        venue_quotes = venue_quotes[np.argsort(venue_quotes["time"], kind="stable")]
+        times = venue_quotes["time"]
+        prices = np.array(venue_quotes["price"])
+        if key in held_prices:
+            times = np.concatenate([[start_ms], times])
+            prices = np.concatenate([[held_prices[key]], prices])
+        if len(times) > 0:
+            series[venue] = (times.astype("datetime64[ms]"), prices)
+
+    return series
+
+
+def downsample_segment(segment_fpath, interval):
+    """
+    Rewrites a segment, keeping only the last quote of each key in each
+    interval (a timedelta). If the day has already been downsampled, its
+    quotes are merged into the downsampled segment.
+    """
+
+    quotes = np.array(load_segment(segment_fpath))
+    downsampled_fpath = segment_fpath.replace(".bin", ".downsampled.bin")
+    if os.path.exists(downsampled_fpath):
+        quotes = np.concatenate([np.array(load_segment(downsampled_fpath)), quotes])
+    interval_ms = int(interval.total_seconds() * 1000)
+
+    # Keep the last quote of each key in each interval
+    bucket = quotes["time"] // interval_ms
+    order = np.lexsort((quotes["time"], bucket, quotes["key"]))
+    sorted_quotes = quotes[order]
+    sorted_bucket = bucket[order]
+    is_last = np.ones(len(sorted_quotes), dtype=bool)
+    is_last[:-1] = (sorted_quotes["key"][1:] != sorted_quotes["key"][:-1]) | (sorted_bucket[1:] != sorted_bucket[:-1])
+    kept = sorted_quotes[is_last]
+    kept = kept[np.argsort(kept["time"], kind="stable")]
+
+    # Replace the segment
+    with open(f"{downsampled_fpath}.tmp", "wb") as f:
+        f.write(kept.tobytes())
+    os.replace(f"{downsampled_fpath}.tmp", downsampled_fpath)
+    os.remove(segment_fpath)
+
+
+def maintain_odds_history(history, retention_period, downsample_after, downsample_interval, maintenance_period=timedelta(hours=1)):
+    """
+    Keeps the disk space used by the history bounded, deleting the
+    segments older than retention_period, and downsampling the segments
+    older than downsample_after to one quote per downsample_interval.
+
+    Only runs once per maintenance_period.
+    """
+
+    time_now = datetime.now(timezone.utc)
+    if history["last_maintenance"] is not None and time_now < history["last_maintenance"] + maintenance_period:
+        return
+    history["last_maintenance"] = time_now
+
+    for segment_date, segment_fpath in segment_fpaths(history):
+        segment_end = datetime.fromisoformat(segment_date).replace(tzinfo=timezone.utc) + timedelta(days=1)
+
+        # Delete old segments
+        if segment_end < time_now - retention_period:
+            os.remove(segment_fpath)
+
+        # Downsample older segments, which are no longer being appended to
+        elif segment_end < time_now - downsample_after and not segment_fpath.endswith(".downsampled.bin"):
+            downsample_segment(segment_fpath, downsample_interval)
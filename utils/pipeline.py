@@ -0,0 +1,177 @@
+"""
+This script contains the in-memory pipeline, which passes the results of
+each stage (bookmakers odds, Polymarket odds and the analysis) directly
+to the next stage, rather than saving and re-loading them from files.
+Everything is saved at once by publish_pipeline() at the end of each
+update.
+"""
+
+# Import necessary packages
+import json
+from datetime import datetime
+
+from utils.bookie_functions import fetch_odds_api, process_changed_odds, merge_refreshed_leagues
+from utils.analysis import create_arbitrage_engine, update_arbitrage_engine
+from utils.polymarket_functions import find_market_slug_index, fetch_order_book_infos, merge_polymarket_odds, \
+    market_infos_by_slug
+from utils.snapshot_store import DOCUMENT_FPATHS, publish_documents
+from utils.sharded_analysis import process_odds_sharded, update_arbitrage_engine_sharded
+from utils.odds_directory import build_odds_directory
+from utils.metrics import time_stage
+
+
+def create_pipeline(analysis_pool=None):
+    """
+    Returns the state of the pipeline, warm-started from the previously
+    saved bookmakers odds so the bookmakers' API is not called needlessly.
+
+    If a pool of worker processes from create_analysis_pool() (see
+    utils/sharded_analysis.py) is given, the odds are processed and
+    analysed across the pool, sharded by league.
+    """
+
+    pipeline = {
+        "documents": {},
+        "changed_documents": set(),
+        "polymarket_market_infos": {},    # The order book info of each market, keyed by slug
+        "analysis_pool": analysis_pool,
+        "bookmakers_engine": create_arbitrage_engine(),
+        "polymarket_engine": create_arbitrage_engine(consider_converse_outcomes=True)
+    }
+
+    # Load the previously saved documents
+    for name in ["full_bookies_odds", "bookies_odds", "update_times"]:
+        try:
+            with open(DOCUMENT_FPATHS[name], "r") as f:
+                pipeline["documents"][name] = json.load(f)
+        except (OSError, ValueError):
+            pipeline["documents"][name] = {} if name == "update_times" else []
+
+    # Analyse the bookmakers' odds
+    update_pipeline_engine(pipeline, pipeline["bookmakers_engine"], pipeline["documents"]["bookies_odds"])
+
+    return pipeline
+
+
+def update_pipeline_engine(pipeline, engine, matches, changes=None):
+    """
+    Brings an arbitrage engine up to date with the given odds, see
+    update_arbitrage_engine() in utils/analysis.py, using the pipeline's
+    pool of worker processes if it has one.
+    """
+
+    if pipeline["analysis_pool"] is None:
+        return update_arbitrage_engine(engine, matches, changes)
+
+    return update_arbitrage_engine_sharded(pipeline["analysis_pool"], engine, matches, changes)
+
+
+def update_bookmakers_stage(pipeline, sports=("soccer_epl",), regions=("uk",), max_workers=8, markets=("h2h",),
+                            raw_archive_dpath=None):
+    """
+    Gets the latest odds from the bookmakers, for the given sports and
+    regions, and checks them for arbitrage.
+
+    See fetch_odds_api() in utils/bookie_functions.py for details of the
+    arguments.
+    """
+
+    # Request odds from API
+    with time_stage("bookmakers_fetch"):
+        full_odds_json, successful_connection, request_time = fetch_odds_api(sports, regions, max_workers,
+                                                                             markets=markets,
+                                                                             raw_archive_dpath=raw_archive_dpath)
+    pipeline["documents"]["update_times"]["Bookmakers"] = request_time
+    pipeline["changed_documents"].add("update_times")
+
+    if not successful_connection:
+        return
+
+    # Process the odds that have changed, keeping the odds of the leagues that were not refreshed
+    with time_stage("bookmakers_process"):
+        full_odds_json = merge_refreshed_leagues(pipeline["documents"]["full_bookies_odds"], full_odds_json)
+        if pipeline["analysis_pool"] is None:
+            bookmakers_odds, changed_indices = process_changed_odds(full_odds_json)
+        else:
+            bookmakers_odds, changed_indices = process_changed_odds(
+                full_odds_json, lambda matches: process_odds_sharded(pipeline["analysis_pool"], matches))
+
+    # Nothing else needs doing if no odds have changed
+    if changed_indices == set():
+        return
+    pipeline["documents"]["full_bookies_odds"] = full_odds_json
+    pipeline["documents"]["bookies_odds"] = bookmakers_odds
+    pipeline["changed_documents"] |= {"full_bookies_odds", "bookies_odds"}
+
+    # Check for arbitrage in the matches that have changed
+    with time_stage("bookmakers_analysis"):
+        update_pipeline_engine(pipeline, pipeline["bookmakers_engine"], bookmakers_odds,
+                               None if changed_indices is None else {i: None for i in changed_indices})
+
+
+def update_polymarket_stage(pipeline, market_catalogue=None, max_workers=1, request_timeout=10):
+    """
+    Introduces the latest odds from Polymarket into the bookmakers odds,
+    and checks them for arbitrage.
+
+    See find_market_slug_index() and merge_polymarket_odds() in
+    utils/polymarket_functions.py for details of the arguments.
+    """
+
+    bookmakers_odds = pipeline["documents"]["bookies_odds"]
+
+    # Get the order books of the markets
+    with time_stage("polymarket_slug_resolution"):
+        slug_index = find_market_slug_index(bookmakers_odds, market_catalogue)
+    with time_stage("polymarket_order_books"):
+        order_book_infos = fetch_order_book_infos(bookmakers_odds, slug_index, max_workers, request_timeout)
+    pipeline["polymarket_market_infos"] = market_infos_by_slug(bookmakers_odds, slug_index, order_book_infos)
+
+    # Introduce the Polymarket odds
+    with time_stage("polymarket_merge"):
+        bookmakers_odds_with_polymarket, polymarket_odds = merge_polymarket_odds(bookmakers_odds, slug_index,
+                                                                                 order_book_infos=order_book_infos)
+    pipeline["documents"]["bookies_odds_with_polymarket"] = bookmakers_odds_with_polymarket
+    pipeline["documents"]["full_polymarket_odds"] = polymarket_odds
+    pipeline["documents"]["update_times"]["Polymarket"] = datetime.now().astimezone().isoformat()
+    pipeline["changed_documents"] |= {"bookies_odds_with_polymarket", "full_polymarket_odds", "update_times"}
+
+    # Check for arbitrage
+    with time_stage("polymarket_analysis"):
+        update_pipeline_engine(pipeline, pipeline["polymarket_engine"], bookmakers_odds_with_polymarket)
+
+
+def publish_pipeline(pipeline, snapshot_conn=None):
+    """
+    Saves every document that has changed since the pipeline was last
+    published, for use by the dashboard.
+
+    If a connection to the snapshot store (see utils/snapshot_store.py)
+    is given, the documents are also committed as a new snapshot, so the
+    dashboard sees every document from the same update.
+    """
+
+    # Collect the results of the analysis
+    for name, engine, two_bet_name in [("analysed_odds", pipeline["bookmakers_engine"], None),
+                                       ("analysed_odds_with_polymarket", pipeline["polymarket_engine"], "two_bet_arbitrage")]:
+        if engine["changed_since_publish"]:
+            pipeline["documents"][name] = engine["formatted_results"]
+            pipeline["changed_documents"].add(name)
+            if two_bet_name is not None:
+                pipeline["documents"][two_bet_name] = engine["two_bet_results"]
+                pipeline["documents"]["optimal_portfolios"] = engine["formatted_portfolios"]
+                pipeline["changed_documents"] |= {two_bet_name, "optimal_portfolios"}
+            engine["changed_since_publish"] = False
+
+    # Precompute the odds directory shown on the dashboard
+    if {"full_bookies_odds", "full_polymarket_odds"} & pipeline["changed_documents"]:
+        with time_stage("odds_directory"):
+            pipeline["documents"]["odds_directory"] = build_odds_directory(
+                pipeline["documents"]["full_bookies_odds"], pipeline["documents"].get("full_polymarket_odds", []))
+        pipeline["changed_documents"].add("odds_directory")
+
+    # Save the documents
+    with time_stage("publish"):
+        publish_documents({name: pipeline["documents"][name] for name in pipeline["changed_documents"]}, snapshot_conn)
+
+    pipeline["changed_documents"] = set()
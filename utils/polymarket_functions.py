@@ -6,18 +6,31 @@ dashboard.
 
 # Import necessary packages
 from py_clob_client.client import ClobClient
+from py_clob_client.constants import END_CURSOR
+from py_clob_client.exceptions import PolyApiException
+from py_clob_client.http_helpers import helpers as clob_http_helpers
 from constants import POLYMARKET_API_KEY
+import copy
+import httpx
 import json
-import re
-import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from utils.snapshot_store import save_json_atomic
+from utils.metrics import time_api_request
+from utils.entity_resolution import POLYMARKET_LEAGUE_PREFIXES, team_code, slug_entity, index_market_slugs, \
+    indexed_market_slugs, prune_entity_index
 
 
-def fetch_all_markets():
-    """
-    Calls the API to gain information about all the markets on the site.
+# Long-lived clients, shared between all calls to the API
+clob_clients = {}
+api_creds_lifetime = timedelta(hours=12)    # Re-derive the API credentials after this period
 
-    Returns a list of all available markets for premier league games.
+
+def create_clob_client(authenticated=False):
+    """
+    Initialises a client for the Polymarket CLOB API. An authenticated
+    client is set up with API credentials, for use with the endpoints
+    that require them.
     """
 
     # Define host and chain ID
@@ -25,14 +38,99 @@ def fetch_all_markets():
     chain_id = 137  # Polygon Mainnet
 
     # Initialise the client
-    client = ClobClient(
-        host,
-        key=POLYMARKET_API_KEY,
-        chain_id=chain_id
-    )
+    if not authenticated:
+        return ClobClient(
+            host,
+            key=POLYMARKET_API_KEY,
+            chain_id=chain_id
+        )
+
+    POLYMARKET_PROXY_ADDRESS: str = ''
+    return ClobClient(host,
+                      key=POLYMARKET_API_KEY,
+                      chain_id=chain_id,
+                      signature_type=1,
+                      funder=POLYMARKET_PROXY_ADDRESS)
+
+
+def get_clob_client(authenticated=False):
+    """
+    Returns a long-lived client for the Polymarket CLOB API, creating it
+    on first use.
+
+    The API credentials of the authenticated client are only derived
+    when it is created, or once they are older than api_creds_lifetime.
+    All clients send their requests through the py_clob_client module's
+    shared HTTP client, so connections are kept alive and reused between
+    calls.
+    """
+
+    # Create the client if necessary
+    if authenticated not in clob_clients:
+        clob_clients[authenticated] = {"client": create_clob_client(authenticated), "creds_derived_at": None}
+    client_info = clob_clients[authenticated]
+
+    # Derive the API credentials if necessary
+    if authenticated:
+        time_now = datetime.now().astimezone()
+        if client_info["creds_derived_at"] is None or \
+           time_now >= client_info["creds_derived_at"] + api_creds_lifetime:
+            client_info["client"].set_api_creds(client_info["client"].create_or_derive_api_creds())
+            client_info["creds_derived_at"] = time_now
+
+    return client_info["client"]
+
+
+def expire_api_creds():
+    """
+    Forces the API credentials to be derived again on the next call to
+    get_clob_client(), e.g. after they have been rejected by the API.
+    """
+
+    if True in clob_clients:
+        clob_clients[True]["creds_derived_at"] = None
+
+
+def fetch_markets_page(client, next_cursor=None):
+    """
+    Calls the API for a single page of markets.
+
+    Returns the markets on the page and the cursor of the following page,
+    which is None if there are no more pages to fetch.
+    """
+
+    # Make API call
+    with time_api_request("polymarket_markets"):
+        if next_cursor is None:
+            response = client.get_markets()
+        else:
+            response = client.get_markets(next_cursor=next_cursor)
+
+    # Check if response is successful
+    if 'data' not in response:
+        print("No data found in response")
+        return [], None
+
+    # Find the cursor of the next page
+    next_cursor = response.get("next_cursor")
+    if next_cursor == END_CURSOR:
+        next_cursor = None
+
+    return response['data'], next_cursor
+
+
+def iter_markets(client=None):
+    """
+    Calls the API to gain information about all the markets on the site,
+    yielding the markets one at a time as each page arrives rather than
+    holding every market in memory.
+    """
+
+    # Get the client
+    if client is None:
+        client = get_clob_client()
 
     # Initialise the variables
-    markets_list = []
     next_cursor = None
 
     # Fecth all available markets
@@ -40,59 +138,88 @@ def fetch_all_markets():
         try:
             
             # Make API call
-            if next_cursor is None:
-                response = client.get_markets()
-            else:
-                response = client.get_markets(next_cursor=next_cursor)
-
-            # Check if response is successful
-            if 'data' not in response:
-                print("No data found in response")
-                break
-        
-            markets_list.extend(response['data'])
-            next_cursor = response.get("next_cursor")
-
-            # Exit loop if no next_cursor, indicating no more data to fetch
-            if not next_cursor:
-                break
+            markets_page, next_cursor = fetch_markets_page(client, next_cursor)
 
         except Exception as e:
             # Print exception details for debugging
             #print(f"Exception occurred: {e}")
             #print(f"Exception details: {e.__class__.__name__}")
             #print(f"Error message: {e.args}")
-            break
+            return
 
+        yield from markets_page
 
-    return markets_list
+        # Exit loop if no next_cursor, indicating no more data to fetch
+        if not next_cursor:
+            return
 
 
-def get_order_book_info(market_cond_id):
+def fetch_all_markets():
     """
-    Returns info about the best bid and ask prices for the given market,
-    as well as the order book volume.
+    Calls the API to gain information about all the markets on the site.
+
+    Returns a list of all available markets for premier league games.
     """
-    
-    # Set up API link
-    host: str = "https://clob.polymarket.com"
-    key: str = POLYMARKET_API_KEY 
-    chain_id: int = 137 
-    POLYMARKET_PROXY_ADDRESS: str = ''
 
-    client = ClobClient(host,
-                        key=key,
-                        chain_id=chain_id,
-                        signature_type=1,
-                        funder=POLYMARKET_PROXY_ADDRESS)
-    
-    client.set_api_creds(client.create_or_derive_api_creds())
+    return list(iter_markets())
+
+
+def discover_markets(wanted_slugs, client=None):
+    """
+    Finds the condition IDs of the markets with the given slugs, without
+    storing any of the other markets on the site.
+
+    A market is also found if its slug refers to the same outcome of the
+    same match using different team codes (see
+    utils/entity_resolution.py), in which case its own slug is indexed.
+
+    Stops fetching pages as soon as every wanted market has been found.
+    Markets that are not listed on the site can only be ruled out by
+    fetching every page.
+
+    Returns a dict of condition IDs, keyed by market slug.
+    """
+
+    # Initialise the variables
+    wanted_entities = {slug_entity(slug) or slug for slug in wanted_slugs}
+    found_entities = set()
+    slug_index = {}
+
+    # Check for wanted markets as each page arrives
+    if wanted_entities:
+        for market in iter_markets(client):
+            entity = slug_entity(market["market_slug"]) or market["market_slug"]
+            if entity in wanted_entities:
+                slug_index[market["market_slug"]] = market["condition_id"]
+                index_market_slugs([market["market_slug"]])
+                found_entities.add(entity)
+
+                # Stop once every market has been found (an entity can be listed under several slugs)
+                if found_entities == wanted_entities:
+                    break
+
+    return slug_index
+
+
+def get_market_info(client, market_cond_id):
+    """
+    Returns info about the prices and token IDs of the given market, or
+    None if the market could not be found.
+    """
 
     # Get the data from the API
     try:
-        resp = client.get_market(condition_id=market_cond_id)
+        with time_api_request("polymarket_market"):
+            resp = client.get_market(condition_id=market_cond_id)
+    except PolyApiException as e:
+        # Credentials may have been revoked, so derive them again next time
+        if e.status_code == 401:
+            expire_api_creds()
+        print("Market not found when finding order book")
+        return None
     except:
         print("Market not found when finding order book")
+        return None
 
     # Extract the wanted info
     market_info = {
@@ -103,15 +230,16 @@ def get_order_book_info(market_cond_id):
         f"{resp['tokens'][1]['outcome']} token ID": resp['tokens'][1]['token_id']
     }
 
-    # Get the order book info
-    try:
-        yes_order_book = client.get_order_book(token_id=market_info["Yes token ID"])
-        no_order_book = client.get_order_book(token_id=market_info["No token ID"])
-        market_info = market_info | {"Order Book": True}
-    except:
-        # Order book doesn't exist
-        print("Order book not found")
-        return market_info | {"Order Book": False}
+    return market_info
+
+
+def add_order_book_info(market_info, yes_order_book, no_order_book):
+    """
+    Adds info about the best bid and ask prices, as well as the order book
+    volume, to the given market info.
+    """
+
+    market_info = market_info | {"Order Book": True}
 
     # Add on order book info
     if len(yes_order_book.bids) == 0:
@@ -139,68 +267,298 @@ def get_order_book_info(market_cond_id):
         market_info["No Best Ask"] = no_order_book.asks[-1].price
         market_info["No Best Ask Volume"] = no_order_book.asks[-1].size
 
+    # Add on the full depth of the order books
+    market_info["Yes Asks"] = order_book_ladder(yes_order_book.asks)
+    market_info["Yes Bids"] = order_book_ladder(yes_order_book.bids, best_first="highest")
+    market_info["No Asks"] = order_book_ladder(no_order_book.asks)
+    market_info["No Bids"] = order_book_ladder(no_order_book.bids, best_first="highest")
+
     return market_info
 
 
-def team_abr(team_name):
-    """
-    Returns the three letter abbreviation for the given team name.
-    """
-
-    # Make team name lower case
-    team_name = team_name.lower()
-
-    # Go through every possible team
-    if team_name == "aston villa":
-        # return "avl"
-        return "ast"
-    elif team_name == "brighton and hove albion":
-        # return "bha"
-        return "bri"
-    elif team_name == "burnley":
-        # return "brn"
-        return "bur"
-    elif team_name == "manchester city":
-        # return "mci"
-        return "mac"
-    elif team_name == "manchester united":
-        # return "mnu"
-        return "mun"
-    elif team_name == "nottingham forest":
-        # return "nfo"
-        return "not"
-    elif team_name == "west ham united":
-        return "wes"
-        # return "whu"
+def order_book_ladder(orders, best_first="lowest"):
+    """
+    Converts one side of an order book into a list of [price, size]
+    levels, sorted from the best price to the worst.
+    """
+
+    ladder = [[float(order.price), float(order.size)] for order in orders]
+    ladder.sort(reverse=(best_first == "highest"))
+
+    return ladder
+
+
+def fetch_order_book(client, token_id):
+    """
+    Returns the order book of the given token.
+    """
+
+    with time_api_request("polymarket_order_book"):
+        return client.get_order_book(token_id=token_id)
+
+
+def get_order_book_info(market_cond_id):
+    """
+    Returns info about the best bid and ask prices for the given market,
+    as well as the order book volume.
+    """
+    
+    # Get the client
+    client = get_clob_client(authenticated=True)
+
+    # Get the market info
+    market_info = get_market_info(client, market_cond_id)
+    if market_info is None:
+        return {"Order Book": False}
+
+    # Get the order book info
+    try:
+        yes_order_book = fetch_order_book(client, market_info["Yes token ID"])
+        no_order_book = fetch_order_book(client, market_info["No token ID"])
+    except:
+        # Order book doesn't exist
+        print("Order book not found")
+        return market_info | {"Order Book": False}
+
+    return add_order_book_info(market_info, yes_order_book, no_order_book)
+
+
+def set_request_timeout(request_timeout):
+    """
+    Gives each request to the Polymarket API request_timeout seconds, on
+    the py_clob_client module's shared HTTP client, so a slow request
+    fails on its own rather than holding up the others.
+    """
+
+    http_client = getattr(clob_http_helpers, "_http_client", None)
+    if http_client is not None:
+        http_client.timeout = httpx.Timeout(request_timeout)
+
+
+def run_concurrently(function, arguments, max_workers):
+    """
+    Calls the function once for each of the arguments, using a pool of
+    max_workers threads, waiting for every call to finish so no threads
+    are left running. The requests made by each call should have their
+    own timeout (see set_request_timeout()).
+
+    Returns the results in the same order as the arguments, with None for
+    any calls that failed or timed out.
+    """
+
+    # Initialise the results
+    results = [None] * len(arguments)
+    if len(arguments) == 0:
+        return results
+
+    # Make the calls, waiting for them all to finish
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(function, argument) for argument in arguments]
+
+    # Collect the results
+    for i, future in enumerate(futures):
+        if future.exception() is not None:
+            print(f"Request failed: {future.exception()}")
+        else:
+            results[i] = future.result()
+
+    return results
+
+
+def get_order_book_info_concurrently(market_cond_ids, max_workers, request_timeout):
+    """
+    Returns the same info as get_order_book_info() for each of the given
+    markets, keyed by condition ID.
+
+    The markets are requested in parallel, followed by all of their
+    order books in parallel, so the time taken is set by the slowest
+    requests rather than the total of all the requests. Each request is
+    given request_timeout seconds.
+    """
+
+    # Get the client
+    client = get_clob_client(authenticated=True)
+    set_request_timeout(request_timeout)
+
+    # Get the info of every market
+    market_cond_ids = list(dict.fromkeys(market_cond_ids))
+    market_infos = run_concurrently(lambda cond_id: get_market_info(client, cond_id), market_cond_ids, max_workers)
+
+    # Get every order book
+    token_ids = []
+    for market_info in market_infos:
+        if market_info is not None:
+            token_ids.extend([market_info["Yes token ID"], market_info["No token ID"]])
+    order_books = run_concurrently(lambda token_id: fetch_order_book(client, token_id), token_ids, max_workers)
+    order_books = dict(zip(token_ids, order_books))
+
+    # Combine the info
+    order_book_infos = {}
+    for cond_id, market_info in zip(market_cond_ids, market_infos):
+
+        if market_info is None:
+            order_book_infos[cond_id] = {"Order Book": False}
+            continue
+
+        yes_order_book = order_books[market_info["Yes token ID"]]
+        no_order_book = order_books[market_info["No token ID"]]
+        if yes_order_book is None or no_order_book is None:
+            # Order book doesn't exist
+            print("Order book not found")
+            order_book_infos[cond_id] = market_info | {"Order Book": False}
+        else:
+            order_book_infos[cond_id] = add_order_book_info(market_info, yes_order_book, no_order_book)
+
+    return order_book_infos
+
+
+def market_slugs(match):
+    """
+    Returns the slugs of the Polymarket markets for each outcome of the
+    given match, or no slugs if its league is not covered by
+    POLYMARKET_LEAGUE_PREFIXES (see utils/entity_resolution.py).
+
+    Markets already seen on Polymarket are found in the entity index,
+    whichever team codes their slugs use. The slugs of any other outcomes
+    are constructed from the teams' usual codes.
+    """
+
+    # Get the league's prefix
+    league_prefix = POLYMARKET_LEAGUE_PREFIXES.get(match.get("sport_key", "soccer_epl"))
+    if league_prefix is None:
+        return {}
+
+    # Get the team codes
+    home_team_code = team_code(league_prefix, match["home_team"]["team_name"])
+    away_team_code = team_code(league_prefix, match["away_team"]["team_name"])
+
+    # Get the match date
+    match_date = match["commence_date"]
+
+    # Construct the market slugs, using the slugs of the indexed markets where known
+    return {
+        "home_team": f"{league_prefix}-{home_team_code}-{away_team_code}-{match_date}-{home_team_code}",
+        "draw": f"{league_prefix}-{home_team_code}-{away_team_code}-{match_date}-draw",
+        "away_team": f"{league_prefix}-{home_team_code}-{away_team_code}-{match_date}-{away_team_code}"
+    } | indexed_market_slugs(match)
+
+
+def add_polymarket_outcome_odds(match, outcome, yes_ask_price, no_ask_price, yes_asks=None, no_asks=None):
+    """
+    Introduces the odds available on Polymarket for the given outcome of
+    the match, based upon the best ask prices of the Yes and No tokens.
+
+    If the full depth of the order books is given (see
+    order_book_ladder()), it is kept so the size of any arbitrage can be
+    limited to what is available, along with the bookmakers' best odds.
+
+    Returns the Polymarket odds for the outcome, or None if there are no
+    Yes tokens for sale.
+    """
+
+    # Get the equiavlent odds of the outcome
+    if yes_ask_price == "N/A":
+        return None
+    eff_odd = 1 / float(yes_ask_price)
+
+    # Keep the depth of the order books
+    if yes_asks is not None and no_asks is not None:
+        match[outcome]["bookmakers_best_odds"] = match[outcome]["best_odds"]
+        match[outcome]["polymarket_asks"] = {"Yes": yes_asks, "No": no_asks}
+
+    # Update the best odds if necessary
+    if match[outcome]["best_odds"] < eff_odd:
+        match[outcome]["best_odds"] = eff_odd
+        match[outcome]["bookies_providing"] = "polymarket"
+    elif match[outcome]["best_odds"] == eff_odd:
+        match[outcome]["bookies_providing"].append("polymarket")
+
+    # Get the equivalent odds for the converse
+    if no_ask_price == "N/A":
+        match[outcome]["converse_outcome_odds"] = "N/A"
     else:
-        # Abbreviation is first three letters
-        return "".join(list(team_name)[:3])
+        match[outcome]["converse_outcome_odds"] = 1 / float(no_ask_price)
 
+    return {"Yes": eff_odd, "No": "-" if no_ask_price=="N/A" else 1/float(no_ask_price)}
 
 
-def introduce_polymarket_odds(bookies_odds_fpath, updated_file_fpath):
+def find_market_slug_index(bookmakers_odds, market_catalogue=None):
     """
-    Takes in the currently saved bookmakers odds, and introduces the
-    odds available on Polymarket. Saves the resulting odds in a separate
-    file.
+    Returns the condition IDs of the Polymarket markets, keyed by market
+    slug.
+
+    If a market catalogue (see utils/market_catalogue.py) is given, the
+    markets are looked up in it. Otherwise, only the markets for the
+    given matches are searched for on the API.
     """
 
-    # Load the bookmakers' odds
-    with open(bookies_odds_fpath, "r") as f:
-        bookmakers_odds = json.load(f)
+    # Forget the fixtures that have already been played
+    prune_entity_index(bookmakers_odds)
 
-    # Get all the currently available Polymarket markets
-    markets_list = fetch_all_markets()
-        
-    # Save it for now
-    # import pickle
-    # with open("testing_scripts/markets_list.pkl","wb") as f:
-    #     pickle.dump(markets_list, f)
-    # with open("testing_scripts/markets_list.pkl", "rb") as f:
-    #     markets_list = pickle.load(f)
-    #     print()
-    #     print("Currently using archived markets list!!")
-    #     print()
+    if market_catalogue is not None:
+        return market_catalogue["by_slug"]
+
+    wanted_slugs = [slug for match in bookmakers_odds for slug in market_slugs(match).values()]
+    return discover_markets(wanted_slugs)
+
+
+def fetch_order_book_infos(bookmakers_odds, slug_index, max_workers=1, request_timeout=10):
+    """
+    Gets the order book info of the Polymarket markets of every match.
+
+    If max_workers is greater than one, the markets and order books are
+    requested in parallel using that many threads, with each request
+    given request_timeout seconds.
+
+    Returns the order book info of each market, keyed by condition ID.
+    """
+
+    # Get the condition IDs of the markets
+    market_cond_ids = []
+    for match in bookmakers_odds:
+        for market_slug in market_slugs(match).values():
+            if market_slug in slug_index:
+                market_cond_ids.append(slug_index[market_slug])
+
+    # Get the order book info of every market in parallel
+    if max_workers > 1:
+        return get_order_book_info_concurrently(market_cond_ids, max_workers, request_timeout)
+
+    set_request_timeout(request_timeout)
+    return {cond_id: get_order_book_info(cond_id) for cond_id in market_cond_ids}
+
+
+def market_infos_by_slug(bookmakers_odds, slug_index, order_book_infos):
+    """
+    Returns the order book info of the Polymarket markets of every match,
+    keyed by market slug rather than condition ID, e.g. to be recorded
+    (see utils/replay.py).
+    """
+
+    return {market_slug: order_book_infos[slug_index[market_slug]]
+            for match in bookmakers_odds for market_slug in market_slugs(match).values()
+            if slug_index.get(market_slug) in order_book_infos}
+
+
+def merge_polymarket_odds(bookmakers_odds, slug_index, max_workers=1, request_timeout=10, order_book_infos=None):
+    """
+    Introduces the odds available on Polymarket into the bookmakers odds,
+    without modifying them or saving anything.
+
+    The order book info of the markets is requested, see
+    fetch_order_book_infos(), unless it is given as order_book_infos,
+    keyed by the values of slug_index.
+
+    Returns the updated odds, and a record of the Polymarket odds for
+    each match.
+    """
+
+    # Copy the bookmakers' odds
+    bookmakers_odds = copy.deepcopy(bookmakers_odds)
+
+    # Get the order book info of every market
+    if order_book_infos is None:
+        order_book_infos = fetch_order_book_infos(bookmakers_odds, slug_index, max_workers, request_timeout)
 
     # Initialise a record of all Polymarket odds
     polymarket_odds = []
@@ -209,73 +567,84 @@ def introduce_polymarket_odds(bookies_odds_fpath, updated_file_fpath):
     # Go through each match
     for i, match in enumerate(bookmakers_odds):
 
-        # Get the team abbreviations
-        home_team_abr = team_abr(match["home_team"]["team_name"])
-        away_team_abr = team_abr(match["away_team"]["team_name"])
-
-        # Get the match date
-        match_date = match["commence_date"]
-
-        # Construct the market slug
-        home_win_market_slug = f"epl-{home_team_abr}-{away_team_abr}-{match_date}-{home_team_abr}" 
-        draw_market_slug = f"epl-{home_team_abr}-{away_team_abr}-{match_date}-draw"
-        away_win_market_slug = f"epl-{home_team_abr}-{away_team_abr}-{match_date}-{away_team_abr}"
+        # Get the market slugs
+        match_market_slugs = market_slugs(match)
 
-        # Initialise dict
-        polymarket_match_odds = {}
+        # Initialise dict, identifying the match so it can be joined with the bookmakers odds
+        polymarket_match_odds = {"match_id": match.get("match_id")}
 
         # Go through the three markets
-        for outcome, market_slug in zip(["home_team","draw","away_team"],[home_win_market_slug,draw_market_slug,away_win_market_slug]):
+        for outcome, market_slug in match_market_slugs.items():
 
-            # Get the market condition id
-            cond_id = next((item["condition_id"] for item in markets_list if item["market_slug"]==market_slug), None)
-
-            # Get market info
-            if cond_id is not None:
-                market_info = get_order_book_info(cond_id)
-            else:
+            # Get the market info
+            cond_id = slug_index.get(market_slug)
+            if cond_id is None or cond_id not in order_book_infos:
                 print("Market not found")
                 continue
+            market_info = order_book_infos[cond_id]
 
             # For redundancy
             if not market_info["Order Book"]:
                 continue
 
-            # Get the equiavlent odds of the outcome
-            ask_price = market_info["Yes Best Ask"]
-            if ask_price == "N/A":
-                continue
-            eff_odd = 1 / float(ask_price)
-
-            # Update the best odds if necessary
-            if match[outcome]["best_odds"] < eff_odd:
-                bookmakers_odds[i][outcome]["best_odds"] = eff_odd
-                bookmakers_odds[i][outcome]["bookies_providing"] = "polymarket"
-            elif match[outcome]["best_odds"] == eff_odd:
-                bookmakers_odds[i][outcome]["bookies_providing"].append("polymarket")
-
-            # Get the equivalent odds for the converse
-            ask_price = market_info["No Best Ask"]
-            if ask_price == "N/A":
-                bookmakers_odds[i][outcome]["converse_outcome_odds"] = "N/A"
-            else:
-                bookmakers_odds[i][outcome]["converse_outcome_odds"] = 1 / float(ask_price)
+            # Introduce the odds of the outcome
+            outcome_odds = add_polymarket_outcome_odds(bookmakers_odds[i], outcome,
+                                                       market_info["Yes Best Ask"],
+                                                       market_info["No Best Ask"],
+                                                       market_info["Yes Asks"],
+                                                       market_info["No Asks"])
 
             # Add to record of polymarket odds
-            polymarket_match_odds[outcome] = {"Yes": eff_odd, "No": "-" if ask_price=="N/A" else 1/float(ask_price)}
+            if outcome_odds is not None:
+                polymarket_match_odds[outcome] = outcome_odds
 
 
         polymarket_odds.append(polymarket_match_odds)
 
+    return bookmakers_odds, polymarket_odds
+
+
+def introduce_polymarket_odds(bookies_odds_fpath, updated_file_fpath, market_catalogue=None,
+                              max_workers=1, request_timeout=10):
+    """
+    Takes in the currently saved bookmakers odds, and introduces the
+    odds available on Polymarket. Saves the resulting odds in a separate
+    file.
+
+    See find_market_slug_index() and merge_polymarket_odds() for details
+    of the market_catalogue, max_workers and request_timeout arguments.
+
+    Returns the order book info of every market, keyed by market slug.
+    """
+
+    # Load the bookmakers' odds
+    with open(bookies_odds_fpath, "r") as f:
+        bookmakers_odds = json.load(f)
+
+    # Get the condition IDs of the relevant Polymarket markets
+    slug_index = find_market_slug_index(bookmakers_odds, market_catalogue)
+
+    # Introduce the Polymarket odds
+    order_book_infos = fetch_order_book_infos(bookmakers_odds, slug_index, max_workers, request_timeout)
+    merged_odds, polymarket_odds = merge_polymarket_odds(bookmakers_odds, slug_index, order_book_infos=order_book_infos)
+
     # Save the updated file
-    with open(updated_file_fpath, "w") as f:
-        json.dump(bookmakers_odds,f,indent=4)
+    save_json_atomic(updated_file_fpath, merged_odds)
 
     # Save the Polymarket odds
-    with open("Data/full_polymarket_odds.json","w") as f:
-        json.dump(polymarket_odds, f, indent=4)
+    save_json_atomic("Data/full_polymarket_odds.json", polymarket_odds)
 
     # Save the last update time
+    save_polymarket_update_time()
+
+    return market_infos_by_slug(bookmakers_odds, slug_index, order_book_infos)
+
+
+def save_polymarket_update_time():
+    """
+    Records the time the Polymarket odds were last updated.
+    """
+
     try:
         with open("Data/update_times.json","r") as f:
             update_times = json.load(f)
@@ -283,8 +652,7 @@ def introduce_polymarket_odds(bookies_odds_fpath, updated_file_fpath):
         update_times = {}
     # update_times["Polymarket"] = time.strftime('%H:%M:%S')
     update_times["Polymarket"] = datetime.now().astimezone().isoformat()
-    with open("Data/update_times.json","w") as f:
-        json.dump(update_times, f, indent=4)
+    save_json_atomic("Data/update_times.json", update_times)
 
     
 
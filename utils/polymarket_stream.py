@@ -0,0 +1,354 @@
+"""
+This script contains all the functions used to stream the order books of
+the relevant Polymarket markets over a websocket, rather than polling the
+API. Arbitrage is checked for as soon as the best price of a market
+changes, and only for the outcome and match the market belongs to.
+"""
+
+# Import necessary packages
+import asyncio
+import copy
+import json
+from datetime import datetime
+
+import websockets
+
+from utils.analysis import create_arbitrage_engine, update_arbitrage_engine
+from utils.polymarket_functions import market_slugs, add_polymarket_outcome_odds
+from utils.snapshot_store import DOCUMENT_FPATHS, publish_documents
+from utils.odds_history import record_quotes, polymarket_quotes
+from utils.alerts import update_alerts
+from utils.replay import record_update
+from utils.odds_directory import build_odds_directory, directory_entry
+from utils.metrics import time_stage
+
+
+# Polymarket's websocket for market data
+MARKET_WS_URL = "wss://ws-subscriptions-clob.polymarket.com/ws/market"
+
+
+def get_token_map(bookmakers_odds, slug_index, market_catalogue):
+    """
+    Finds the Yes and No token IDs of the Polymarket markets for every
+    outcome of every match, from their records in the market catalogue
+    (see utils/market_catalogue.py), without requesting anything from
+    the API.
+
+    Returns a dict of (match index, outcome, "Yes"/"No"), keyed by token ID.
+    """
+
+    token_map = {}
+    for i, match in enumerate(bookmakers_odds):
+        for outcome, market_slug in market_slugs(match).items():
+
+            # Get the tokens of the market
+            market = market_catalogue["markets"].get(slug_index.get(market_slug))
+            if market is None:
+                print("Market not found")
+                continue
+            token_ids = {token["outcome"]: token["token_id"] for token in market.get("tokens") or []}
+            if "Yes" not in token_ids or "No" not in token_ids:
+                continue
+
+            token_map[token_ids["Yes"]] = (i, outcome, "Yes")
+            token_map[token_ids["No"]] = (i, outcome, "No")
+
+    return token_map
+
+
+def best_ask(order_book):
+    """
+    Returns the best (lowest) ask price in the order book, or "N/A" if
+    there are no asks.
+    """
+
+    if len(order_book["asks"]) == 0:
+        return "N/A"
+
+    return min(order_book["asks"], key=float)
+
+
+def ask_ladder(order_book):
+    """
+    Returns the asks in the order book as a list of [price, size] levels,
+    sorted from the best price to the worst.
+    """
+
+    return sorted([float(price), float(size)] for price, size in order_book["asks"].items())
+
+
+def streamed_market_infos(token_map, token_slugs, order_books):
+    """
+    Returns the order book info of every market whose order books have
+    both been received, in the same form as get_order_book_info() in
+    utils/polymarket_functions.py (with the best asks and the depth of the
+    asks), keyed by market slug, so it can be recorded and replayed (see
+    utils/replay.py).
+    """
+
+    market_infos = {}
+    for token_id, (_, _, token_outcome) in token_map.items():
+        if token_id not in order_books:
+            continue
+        market_info = market_infos.setdefault(token_slugs[token_id], {"Order Book": True})
+        market_info[f"{token_outcome} token ID"] = token_id
+        market_info[f"{token_outcome} Best Ask"] = best_ask(order_books[token_id])
+        market_info[f"{token_outcome} Asks"] = ask_ladder(order_books[token_id])
+
+    return {market_slug: market_info for market_slug, market_info in market_infos.items()
+            if "Yes Asks" in market_info and "No Asks" in market_info}
+
+
+def apply_market_event(order_books, event):
+    """
+    Applies a websocket event to the order books, which are kept as
+    {"bids": {price: size}, "asks": {price: size}}, keyed by token ID.
+
+    Returns the token IDs whose best ask price changed.
+    """
+
+    changed_tokens = set()
+
+    if event.get("event_type") == "book":
+        # Full snapshot of the order book
+        token_id = event["asset_id"]
+        previous_ask = best_ask(order_books[token_id]) if token_id in order_books else None
+        order_books[token_id] = {
+            "bids": {level["price"]: level["size"] for level in event.get("bids", event.get("buys", []))},
+            "asks": {level["price"]: level["size"] for level in event.get("asks", event.get("sells", []))}
+        }
+        if best_ask(order_books[token_id]) != previous_ask:
+            changed_tokens.add(token_id)
+
+    elif event.get("event_type") == "price_change":
+        # Changes to individual price levels
+        if "price_changes" in event:
+            changes = event["price_changes"]
+        else:
+            changes = [change | {"asset_id": event["asset_id"]} for change in event.get("changes", [])]
+
+        for change in changes:
+            token_id = change["asset_id"]
+            if token_id not in order_books:
+                continue
+            previous_ask = best_ask(order_books[token_id])
+
+            # Update the price level
+            side = "bids" if change["side"] == "BUY" else "asks"
+            if float(change["size"]) == 0:
+                order_books[token_id][side].pop(change["price"], None)
+            else:
+                order_books[token_id][side][change["price"]] = change["size"]
+
+            if best_ask(order_books[token_id]) != previous_ask:
+                changed_tokens.add(token_id)
+
+    return changed_tokens
+
+
+def merge_streamed_odds(match, match_index, token_map, order_books):
+    """
+    Returns a copy of the bookmakers' odds for the match, with the odds
+    currently available on Polymarket introduced, along with the
+    Polymarket odds of each outcome.
+    """
+
+    # Copy the bookmakers' odds, so they can be re-used for later updates
+    match = copy.deepcopy(match)
+
+    # Find the best asks, and the depth of the asks, for each outcome
+    ask_prices = {}
+    ask_ladders = {}
+    for token_id, (i, outcome, token_outcome) in token_map.items():
+        if i == match_index and token_id in order_books:
+            ask_prices.setdefault(outcome, {})[token_outcome] = best_ask(order_books[token_id])
+            ask_ladders.setdefault(outcome, {})[token_outcome] = ask_ladder(order_books[token_id])
+
+    # Introduce the odds of each outcome
+    polymarket_match_odds = {"match_id": match.get("match_id")}
+    for outcome in ["home_team","draw","away_team"]:
+        if "Yes" in ask_prices.get(outcome, {}) and "No" in ask_prices[outcome]:
+            outcome_odds = add_polymarket_outcome_odds(match, outcome, ask_prices[outcome]["Yes"], ask_prices[outcome]["No"],
+                                                       ask_ladders[outcome]["Yes"], ask_ladders[outcome]["No"])
+            if outcome_odds is not None:
+                polymarket_match_odds[outcome] = outcome_odds
+
+    return match, polymarket_match_odds
+
+
+async def stream_polymarket_odds(bookmakers_odds, token_map, on_match_update, ws_url=MARKET_WS_URL,
+                                 run_until=None, ping_interval=10, order_books=None):
+    """
+    Subscribes to the order books of every token in the token map, and
+    updates the odds whenever the best ask price of a token changes.
+
+    on_match_update(match_index, match, polymarket_match_odds, changed_outcomes)
+    is called for every match affected by a change, with the updated
+    odds and Polymarket odds of the match, and the outcomes whose
+    Polymarket odds changed. Reconnects if the
+    connection drops, and returns once run_until (a timezone aware
+    datetime) is reached.
+
+    The order books are kept in order_books (see apply_market_event()),
+    if given, so they can be read by on_match_update.
+    """
+
+    # Initialise the order books
+    if order_books is None:
+        order_books = {}
+
+    while run_until is None or datetime.now().astimezone() < run_until:
+        try:
+            async with websockets.connect(ws_url) as websocket:
+
+                # Subscribe to the markets
+                await websocket.send(json.dumps({"assets_ids": list(token_map), "type": "market"}))
+
+                while run_until is None or datetime.now().astimezone() < run_until:
+
+                    # Wait for the next message, keeping the connection alive
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), timeout=ping_interval)
+                    except asyncio.TimeoutError:
+                        await websocket.send("PING")
+                        continue
+                    if message == "PONG":
+                        continue
+
+                    # Messages can contain a single event or a list of events, skip anything else
+                    try:
+                        events = json.loads(message)
+                    except ValueError:
+                        print(f"Skipping Polymarket websocket message that is not JSON: {message[:100]}")
+                        continue
+                    if isinstance(events, dict):
+                        events = [events]
+                    elif not isinstance(events, list):
+                        continue
+                    events = [event for event in events if isinstance(event, dict)]
+
+                    # Update the order books
+                    changed_tokens = set()
+                    for event in events:
+                        changed_tokens |= apply_market_event(order_books, event)
+
+                    # Find the affected outcomes of each match
+                    changed_outcomes = {}
+                    for token_id in changed_tokens:
+                        if token_id in token_map:
+                            i, outcome, _ = token_map[token_id]
+                            changed_outcomes.setdefault(i, set()).add(outcome)
+
+                    # Update the affected matches
+                    for i in sorted(changed_outcomes):
+                        match, polymarket_match_odds = merge_streamed_odds(bookmakers_odds[i], i, token_map, order_books)
+                        on_match_update(i, match, polymarket_match_odds, changed_outcomes[i])
+
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            print(f"Polymarket websocket disconnected: {e}")
+            await asyncio.sleep(1)
+
+
+def stream_polymarket_odds_to_files(bookies_odds_fpath, slug_index, market_catalogue, run_until,
+                                    ws_url=MARKET_WS_URL, snapshot_conn=None, odds_history=None, alerter=None,
+                                    recorder=None):
+    """
+    Streams the Polymarket odds for the currently saved bookmakers odds,
+    saving the analysed odds every time a match is updated, until
+    run_until is reached. The tokens of the markets are found in the
+    market catalogue (see get_token_map()).
+
+    If a connection to the snapshot store (see utils/snapshot_store.py)
+    is given, each update is also committed as a new snapshot. If the
+    history of the odds (see utils/odds_history.py) is given, the changes
+    in the Polymarket odds are recorded. If an alerter (see
+    utils/alerts.py) is given, opportunities are alerted as soon as they
+    are found. If a recorder (see utils/replay.py) is given, the order
+    books are recorded after every update, so the stream can be replayed.
+
+    Returns the latest update times, bookmakers odds with the Polymarket
+    odds, and Polymarket odds, keyed by document name.
+    """
+
+    # Load the bookmakers' odds, and the update times
+    with open(bookies_odds_fpath, "r") as f:
+        bookmakers_odds = json.load(f)
+    with open(DOCUMENT_FPATHS["full_bookies_odds"], "r") as f:
+        full_bookmakers_odds = json.load(f)
+    try:
+        with open(DOCUMENT_FPATHS["update_times"], "r") as f:
+            update_times = json.load(f)
+    except (OSError, ValueError):
+        update_times = {}
+
+    # Find the tokens of the relevant markets
+    token_map = get_token_map(bookmakers_odds, slug_index, market_catalogue)
+    token_slugs = {token_id: market_slugs(bookmakers_odds[i])[outcome] for token_id, (i, outcome, _) in token_map.items()}
+    order_books = {}
+
+    # Analyse the bookmakers' odds, and initialise the record of all Polymarket odds
+    merged_odds = list(bookmakers_odds)
+    engine = create_arbitrage_engine(consider_converse_outcomes=True)
+    update_arbitrage_engine(engine, merged_odds)
+    polymarket_odds = [{"match_id": match.get("match_id")} for match in bookmakers_odds]
+    odds_directory = build_odds_directory(full_bookmakers_odds, polymarket_odds)
+    directory_positions = {entry["match_id"]: i for i, entry in enumerate(odds_directory)}
+    if alerter is not None:
+        update_alerts(alerter, engine["analysed_odds"], engine["update_started_at"])
+
+    def on_match_update(match_index, match, polymarket_match_odds, changed_outcomes):
+
+        # Keep the updated odds, noting which documents have changed
+        documents = {"update_times": update_times}
+        if match != merged_odds[match_index]:
+            merged_odds[match_index] = match
+            documents["bookies_odds_with_polymarket"] = merged_odds
+        if polymarket_match_odds != polymarket_odds[match_index]:
+            polymarket_odds[match_index] = polymarket_match_odds
+            documents["full_polymarket_odds"] = polymarket_odds
+
+        # Check for arbitrage in the affected outcomes, if the odds have changed
+        if "bookies_odds_with_polymarket" in documents:
+            with time_stage("stream_analysis"):
+                update_arbitrage_engine(engine, merged_odds, {match_index: changed_outcomes})
+
+        # Alert any opportunities found, before anything else, timed from when their odds started being analysed
+        if alerter is not None:
+            with time_stage("alerts"):
+                update_alerts(alerter, engine["analysed_odds"],
+                              engine["update_started_at"] if "bookies_odds_with_polymarket" in documents else None)
+
+        # Update the match in the odds directory
+        match_id = bookmakers_odds[match_index].get("match_id")
+        if match_id in directory_positions:
+            entry = directory_entry(full_bookmakers_odds[directory_positions[match_id]], polymarket_match_odds)
+            if entry != odds_directory[directory_positions[match_id]]:
+                odds_directory[directory_positions[match_id]] = entry
+                documents["odds_directory"] = odds_directory
+
+        # Save the changed results
+        update_times["Polymarket"] = datetime.now().astimezone().isoformat()
+        if engine["changed_since_publish"]:
+            documents["analysed_odds_with_polymarket"] = engine["formatted_results"]
+            documents["two_bet_arbitrage"] = engine["two_bet_results"]
+            documents["optimal_portfolios"] = engine["formatted_portfolios"]
+            engine["changed_since_publish"] = False
+        with time_stage("stream_publish"):
+            publish_documents(documents, snapshot_conn)
+
+        # Record the changes in the Polymarket odds
+        if odds_history is not None:
+            with time_stage("record"):
+                record_quotes(odds_history, polymarket_quotes([bookmakers_odds[match_index]], [polymarket_match_odds]))
+
+        # Record the order books, so the stream can be replayed
+        if recorder is not None:
+            with time_stage("record"):
+                record_update(recorder, "polymarket", streamed_market_infos(token_map, token_slugs, order_books))
+
+    # Stream the odds
+    asyncio.run(stream_polymarket_odds(bookmakers_odds, token_map, on_match_update,
+                                       ws_url=ws_url, run_until=run_until, order_books=order_books))
+
+    return {"update_times": update_times, "bookies_odds_with_polymarket": merged_odds,
+            "full_polymarket_odds": polymarket_odds}
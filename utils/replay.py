@@ -0,0 +1,304 @@
+"""
+This script contains all the functions used to record the data collected
+by main.py, and to replay the recordings offline to measure the arbitrage
+opportunities that would have been found.
+
+Each day is recorded to its own file, containing a line for every update
+of the bookmakers' odds (the full response of the odds API) and every
+change in the Polymarket order books (the order book info of each market,
+keyed by market slug). The recordings are replayed through the same
+processing, merging and analysis as main.py, without any API calls.
+
+Run with:
+
+python -m utils.replay Data/recordings/*.jsonl.gz --processes 4
+"""
+
+# Import necessary packages
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import statistics
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from utils.analysis import OUTCOMES, create_arbitrage_engine, update_arbitrage_engine
+from utils.bookie_functions import process_odds
+from utils.polymarket_functions import merge_polymarket_odds
+from utils.entity_resolution import index_market_slugs, prune_entity_index
+
+
+def create_recorder(recording_dpath):
+    """
+    Returns a recorder, which records to the given directory, continuing
+    from the latest update of each kind in the latest recording.
+    """
+
+    os.makedirs(recording_dpath, exist_ok=True)
+    recorder = {"dpath": recording_dpath, "date": None, "last_hashes": {}, "last_lines": {}}
+
+    # Find the latest update of each kind, so they can start the next day's recording
+    recording_fnames = sorted(fname for fname in os.listdir(recording_dpath) if fname.endswith(".jsonl.gz"))
+    if len(recording_fnames) > 0:
+        for update_time, kind, payload in load_recording(os.path.join(recording_dpath, recording_fnames[-1])):
+            recorder["last_lines"][kind] = recording_line(update_time, kind, json.dumps(payload))
+        recorder["date"] = recording_fnames[-1].removesuffix(".jsonl.gz")
+
+    return recorder
+
+
+def recording_line(update_time, kind, payload_json):
+    """
+    Returns the line recording an update.
+    """
+
+    return f'{{"time": "{update_time.isoformat()}", "kind": "{kind}", "payload": {payload_json}}}\n'
+
+
+def record_update(recorder, kind, payload, update_time=None):
+    """
+    Records the payload of an update, where kind is "bookmakers" or
+    "polymarket", at update_time (a timezone aware datetime, defaulting to
+    now). Payloads that are unchanged since the last update of the same
+    kind are not recorded.
+
+    Each day's recording starts with the latest update of every other
+    kind, so it can be replayed on its own.
+    """
+
+    if update_time is None:
+        update_time = datetime.now().astimezone()
+    payload_json = json.dumps(payload)
+    payload_hash = hashlib.sha256(payload_json.encode()).hexdigest()
+    recording_date = update_time.astimezone(timezone.utc).date().isoformat()
+
+    # Start a new day's recording with the latest updates, as nothing has been recorded in it yet
+    if recording_date != recorder["date"]:
+        recorder["date"] = recording_date
+        recorder["last_hashes"] = {}
+        lines = [line for last_kind, line in recorder["last_lines"].items() if last_kind != kind]
+    else:
+        lines = []
+
+    # Skip unchanged payloads
+    if recorder["last_hashes"].get(kind) == payload_hash:
+        return
+    recorder["last_hashes"][kind] = payload_hash
+    recorder["last_lines"][kind] = recording_line(update_time, kind, payload_json)
+    lines.append(recorder["last_lines"][kind])
+
+    # Append to the day's recording
+    with gzip.open(os.path.join(recorder["dpath"], f"{recording_date}.jsonl.gz"), "at") as f:
+        f.writelines(lines)
+
+
+def load_recording(recording_fpath):
+    """
+    Yields each update in a recording, as (time, kind, payload).
+    """
+
+    with gzip.open(recording_fpath, "rt") as f:
+        try:
+            for line in f:
+                try:
+                    update = json.loads(line)
+                except ValueError:
+                    # Partially written line
+                    continue
+                yield datetime.fromisoformat(update["time"]), update["kind"], update["payload"]
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            # The end of a recording that was cut off, or corrupted, while being written
+            print(f"Recording {recording_fpath} is incomplete, replaying the updates before the end")
+
+
+def find_opportunities(analysed_match, min_return_perc):
+    """
+    Returns the arbitrage opportunities in an analysed match, as
+    (kind, outcome): (return, max stake).
+    """
+
+    opportunities = {}
+
+    # 3-way arbitrage
+    if analysed_match["arb"]["possible"] and analysed_match["arb"]["guaranteed_return_perc"] >= min_return_perc:
+        opportunities[("3-way", None)] = (analysed_match["arb"]["guaranteed_return_perc"],
+                                          analysed_match["arb"].get("max_stake", float("inf")))
+
+    # 2-bet arbitrage
+    for outcome in OUTCOMES:
+        two_bet_arb = analysed_match[outcome].get("2_bet_arb")
+        if two_bet_arb is not None and two_bet_arb["Percentage_return"] >= min_return_perc:
+            opportunities[("2-bet", outcome)] = (two_bet_arb["Percentage_return"],
+                                                 two_bet_arb.get("Max_stake", float("inf")))
+
+    return opportunities
+
+
+def match_name(match):
+    """
+    Returns a name for the match, used to identify it across updates.
+    """
+
+    return f'{match["home_team"]["team_name"]} vs {match["away_team"]["team_name"]} ({match["commence_date"]})'
+
+
+def replay_recording(recording_fpath, min_return_perc=0.0, bookmakers_update_period=None,
+                     polymarket_update_period=None):
+    """
+    Replays a recording, finding every arbitrage opportunity with a return
+    of at least min_return_perc.
+
+    Different update schedules can be tested by only using the recorded
+    updates that are at least bookmakers_update_period and
+    polymarket_update_period (timedeltas) after the last used update.
+
+    Returns a list of the opportunities, with when they were first and
+    last seen, their return and maximum stake when first seen, and their
+    best return. Opportunities still open at the end of the recording end
+    at its last update.
+    """
+
+    bookmakers_odds = None
+    market_infos = None
+    last_used = {"bookmakers": None, "polymarket": None}
+    update_periods = {"bookmakers": bookmakers_update_period, "polymarket": polymarket_update_period}
+    engine = create_arbitrage_engine(consider_converse_outcomes=True)
+    match_opportunities = []
+    open_opportunities = {}
+    opportunities = []
+    update_time = None
+
+    for update_time, kind, payload in load_recording(recording_fpath):
+
+        # Skip updates that would not have been made on the schedule
+        if last_used[kind] is not None and update_periods[kind] is not None and \
+           update_time < last_used[kind] + update_periods[kind]:
+            continue
+        last_used[kind] = update_time
+
+        # Apply the update
+        if kind == "bookmakers":
+            bookmakers_odds = process_odds(payload)
+            prune_entity_index(bookmakers_odds)
+        else:
+            market_infos = payload
+            index_market_slugs(market_infos)
+        if bookmakers_odds is None:
+            continue
+
+        # Introduce the Polymarket odds, and check for arbitrage
+        if market_infos is None:
+            odds = bookmakers_odds
+        else:
+            odds, _ = merge_polymarket_odds(bookmakers_odds, {market_slug: market_slug for market_slug in market_infos},
+                                            order_book_infos=market_infos)
+        analysed_indices = update_arbitrage_engine(engine, odds)
+
+        # Find the opportunities that are available now, only checking the re-analysed matches
+        if len(match_opportunities) != len(engine["analysed_odds"]):
+            match_opportunities = [{}] * len(engine["analysed_odds"])
+            analysed_indices = range(len(engine["analysed_odds"]))
+        for i in analysed_indices:
+            analysed_match = engine["analysed_odds"][i]
+            match_opportunities[i] = {(match_name(analysed_match), arb_kind, outcome): result for (arb_kind, outcome), result
+                                      in find_opportunities(analysed_match, min_return_perc).items()}
+        current_opportunities = {key: result for opportunities_of_match in match_opportunities
+                                 for key, result in opportunities_of_match.items()}
+
+        # Close the opportunities that have gone
+        for key in list(open_opportunities):
+            if key not in current_opportunities:
+                opportunities.append(open_opportunities.pop(key) | {"end": update_time})
+
+        # Open new opportunities, and update the open ones
+        for key, (return_perc, max_stake) in current_opportunities.items():
+            if key not in open_opportunities:
+                open_opportunities[key] = {
+                    "match": key[0],
+                    "kind": key[1],
+                    "outcome": key[2],
+                    "start": update_time,
+                    "return_perc": return_perc,
+                    "max_stake": max_stake,
+                    "best_return_perc": return_perc
+                }
+            else:
+                open_opportunities[key]["best_return_perc"] = max(open_opportunities[key]["best_return_perc"], return_perc)
+
+    # Close the opportunities still open at the end
+    for opportunity in open_opportunities.values():
+        opportunities.append(opportunity | {"end": update_time})
+
+    return opportunities
+
+
+def replay_recordings(recording_fpaths, processes=1, **replay_settings):
+    """
+    Replays each recording, in parallel using the given number of
+    processes. See replay_recording() for the settings.
+
+    Returns the opportunities found in every recording.
+    """
+
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(replay_recording, fpath, **replay_settings) for fpath in recording_fpaths]
+            results = [future.result() for future in futures]
+    else:
+        results = [replay_recording(fpath, **replay_settings) for fpath in recording_fpaths]
+
+    return [opportunity for opportunities in results for opportunity in opportunities]
+
+
+def summarise_opportunities(opportunities):
+    """
+    Returns a summary of the opportunities: how many were found, how long
+    they lasted, and the return that could have been made by placing the
+    maximum stake on each as soon as it was found.
+    """
+
+    durations = [(opportunity["end"] - opportunity["start"]).total_seconds() for opportunity in opportunities]
+    returns = [opportunity["return_perc"] for opportunity in opportunities]
+    limited = [opportunity for opportunity in opportunities if opportunity["max_stake"] != float("inf")]
+
+    return {
+        "Opportunities": len(opportunities),
+        "3-way Opportunities": sum(opportunity["kind"] == "3-way" for opportunity in opportunities),
+        "2-bet Opportunities": sum(opportunity["kind"] == "2-bet" for opportunity in opportunities),
+        "Median Duration (s)": statistics.median(durations) if durations else 0,
+        "Max Duration (s)": max(durations, default=0),
+        "Mean Return (%)": statistics.mean(returns) if returns else 0,
+        "Max Return (%)": max(returns, default=0),
+        "Limited by Order Books": len(limited),
+        "Captured Profit at Max Stake": sum(opportunity["max_stake"] * opportunity["return_perc"] / 100
+                                            for opportunity in limited)
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay recordings to find the arbitrage opportunities.")
+    parser.add_argument("recordings", nargs="+", help="Recording files, one for each day")
+    parser.add_argument("--processes", type=int, default=1, help="Number of recordings replayed in parallel")
+    parser.add_argument("--min-return", type=float, default=0.0, help="Minimum percentage return of an opportunity")
+    parser.add_argument("--bookmakers-update-minutes", type=float, default=None,
+                        help="Only use bookmakers updates at least this far apart")
+    parser.add_argument("--polymarket-update-seconds", type=float, default=None,
+                        help="Only use Polymarket updates at least this far apart")
+    args = parser.parse_args()
+
+    found_opportunities = replay_recordings(
+        args.recordings,
+        processes=args.processes,
+        min_return_perc=args.min_return,
+        bookmakers_update_period=None if args.bookmakers_update_minutes is None
+                                 else timedelta(minutes=args.bookmakers_update_minutes),
+        polymarket_update_period=None if args.polymarket_update_seconds is None
+                                 else timedelta(seconds=args.polymarket_update_seconds)
+    )
+
+    for name, value in summarise_opportunities(found_opportunities).items():
+        print(f"{name}: {value}")
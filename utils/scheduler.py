@@ -0,0 +1,356 @@
+"""
+This script contains the scheduler, which decides when to refresh the
+odds of each league from the odds API.
+
+The remaining requests in the odds API quota (from the x-requests-remaining
+and x-requests-used headers) are spread over the time left until the quota
+resets. Each league gets a share of the budget in proportion to its
+priority: leagues with fixtures close to kick off, or with fixtures close
+to arbitrage (the implied probabilities of the best odds summing to close
+to 1), are refreshed more often than leagues whose fixtures are far away.
+
+Polymarket does not use the quota, so it is still updated every
+polymarket_period, between the refreshes of the leagues.
+
+The scheduler reads the time from a clock, so it can be tested against a
+SimulatedClock rather than waiting in real time. Run a simulated month of
+refreshes, checking the quota is never overspent, with:
+
+python -m utils.scheduler
+"""
+
+# Import necessary packages
+import argparse
+import calendar
+import math
+import time
+from datetime import datetime, timedelta
+
+from utils.analysis import OUTCOMES
+
+
+class SystemClock:
+    """
+    Tells the real time, and sleeps in real time.
+    """
+
+    def now(self):
+        return datetime.now().astimezone()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock:
+    """
+    Tells a simulated time, starting from start (a timezone aware
+    datetime), which only moves forward when slept.
+    """
+
+    def __init__(self, start):
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += timedelta(seconds=seconds)
+
+
+def create_refresh_scheduler(sports, cost_per_refresh=1, quota_reset_day=1, last_refreshed=None,
+                             default_period=timedelta(hours=3), min_period=timedelta(minutes=10),
+                             max_period=timedelta(hours=12), reserved_requests=10,
+                             kickoff_boost=7.0, kickoff_scale=timedelta(hours=12),
+                             near_arb_boost=4.0, near_arb_margin=0.03,
+                             polymarket_period=timedelta(seconds=2),
+                             clock=None):
+    """
+    Returns the state of a scheduler for the given sports (odds API sport
+    keys).
+
+    cost_per_refresh is the number of requests used to refresh a league
+    (one per region and market), and the quota resets on quota_reset_day
+    of each month. Until the quota is known (see update_quota()) every league is
+    refreshed every default_period after last_refreshed (a timezone aware
+    datetime, defaulting to a refresh being due now). Once known, each
+    league is refreshed every min_period to max_period, keeping
+    reserved_requests unused.
+
+    A fixture's priority is multiplied by up to 1 + kickoff_boost as it
+    approaches kick off, over about kickoff_scale, and by up to
+    1 + near_arb_boost as the implied probabilities of its best odds sum
+    to within near_arb_margin of 1. The Polymarket updates are made every
+    polymarket_period.
+    """
+
+    if clock is None:
+        clock = SystemClock()
+    if last_refreshed is None:
+        last_refreshed = clock.now() - default_period
+
+    scheduler = {
+        "clock": clock,
+        "sports": list(sports),
+        "cost_per_refresh": cost_per_refresh,
+        "quota_reset_day": quota_reset_day,
+        "default_period": default_period,
+        "min_period": min_period,
+        "max_period": max_period,
+        "reserved_requests": reserved_requests,
+        "kickoff_boost": kickoff_boost,
+        "kickoff_scale": kickoff_scale,
+        "near_arb_boost": near_arb_boost,
+        "near_arb_margin": near_arb_margin,
+        "polymarket_period": polymarket_period,
+        "requests_remaining": None,
+        "requests_used": None,
+        "priorities": {sport: 1.0 for sport in sports},
+        "last_refreshed": {sport: last_refreshed for sport in sports},
+        "next_refresh": {}
+    }
+    schedule_refreshes(scheduler)
+
+    return scheduler
+
+
+def next_quota_reset(scheduler):
+    """
+    Returns when the odds API quota next resets.
+    """
+
+    time_now = scheduler["clock"].now()
+    reset = quota_reset_in_month(scheduler, time_now.year, time_now.month)
+    if reset <= time_now:
+        if time_now.month == 12:
+            reset = quota_reset_in_month(scheduler, time_now.year + 1, 1)
+        else:
+            reset = quota_reset_in_month(scheduler, time_now.year, time_now.month + 1)
+
+    return reset
+
+
+def quota_reset_in_month(scheduler, year, month):
+    """
+    Returns when the odds API quota resets in the given month, on the last
+    day of the month if it is shorter than the reset day (e.g. the 28th of
+    February for a reset day of 31).
+    """
+
+    time_now = scheduler["clock"].now()
+    day = min(scheduler["quota_reset_day"], calendar.monthrange(year, month)[1])
+
+    return time_now.replace(year=year, month=month, day=day, hour=0, minute=0, second=0, microsecond=0)
+
+
+def fixture_priority(scheduler, match, time_now):
+    """
+    Returns the priority of refreshing the odds of a processed match,
+    which is 1 for a fixture far from kick off and far from arbitrage.
+    """
+
+    # Fixtures close to kick off (matches already under way count as kicking off now)
+    if "commence_time" in match:
+        kickoff = datetime.fromisoformat(match["commence_time"])
+    else:
+        kickoff = datetime.fromisoformat(match["commence_date"] + "T00:00:00+00:00")
+    hours_to_kickoff = max((kickoff - time_now).total_seconds(), 0) / 3600
+    kickoff_scale_hours = scheduler["kickoff_scale"].total_seconds() / 3600
+    priority = 1 + scheduler["kickoff_boost"] * math.exp(-hours_to_kickoff / kickoff_scale_hours)
+
+    # Fixtures close to arbitrage
+    try:
+        implied_sum = sum(1 / float(match[outcome]["best_odds"]) for outcome in OUTCOMES)
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return priority
+    closeness = 1 - max(implied_sum - 1, 0) / scheduler["near_arb_margin"]
+    priority *= 1 + scheduler["near_arb_boost"] * max(closeness, 0)
+
+    return priority
+
+
+def update_priorities(scheduler, matches):
+    """
+    Updates the priority of each league from its processed matches (e.g.
+    bookies_odds.json, or bookies_odds_with_polymarket.json), and
+    re-schedules the refreshes.
+
+    The priority of a league is the highest priority of its fixtures, or
+    1 if it has none.
+    """
+
+    time_now = scheduler["clock"].now()
+    priorities = {sport: 1.0 for sport in scheduler["sports"]}
+    for match in matches:
+        sport = match.get("sport_key", scheduler["sports"][0])
+        if sport in priorities:
+            priorities[sport] = max(priorities[sport], fixture_priority(scheduler, match, time_now))
+    scheduler["priorities"] = priorities
+
+    schedule_refreshes(scheduler)
+
+
+def update_quota(scheduler, requests_remaining, requests_used=None):
+    """
+    Records the remaining requests in the odds API quota, as given by the
+    x-requests-remaining header, and re-schedules the refreshes.
+    """
+
+    if requests_remaining is None:
+        return
+    scheduler["requests_remaining"] = float(requests_remaining)
+    scheduler["requests_used"] = None if requests_used is None else float(requests_used)
+
+    schedule_refreshes(scheduler)
+
+
+def refresh_periods(scheduler):
+    """
+    Returns the period between refreshes of each league, keyed by sport.
+    """
+
+    # Use the default period until the quota is known
+    if scheduler["requests_remaining"] is None:
+        return {sport: scheduler["default_period"] for sport in scheduler["sports"]}
+
+    # Wait for the quota to reset if it has been used up
+    quota_reset = next_quota_reset(scheduler)
+    time_left = quota_reset - scheduler["clock"].now()
+    usable_requests = scheduler["requests_remaining"] - scheduler["reserved_requests"]
+    if usable_requests < scheduler["cost_per_refresh"]:
+        return {sport: quota_reset - scheduler["last_refreshed"][sport] for sport in scheduler["sports"]}
+
+    # Share the refreshes that can be afforded in the time left between the leagues, by priority
+    refreshes_per_second = usable_requests / scheduler["cost_per_refresh"] / time_left.total_seconds()
+    total_priority = sum(scheduler["priorities"].values())
+    periods = {}
+    for sport, priority in scheduler["priorities"].items():
+        period = timedelta(seconds=total_priority / (priority * refreshes_per_second))
+        periods[sport] = min(max(period, scheduler["min_period"]), scheduler["max_period"])
+
+    # Slow every league down if refreshing at least every max_period can't be afforded
+    overspend = sum(1 / period.total_seconds() for period in periods.values()) / refreshes_per_second
+    if overspend > 1:
+        periods = {sport: period * overspend for sport, period in periods.items()}
+
+    return periods
+
+
+def schedule_refreshes(scheduler):
+    """
+    Sets when each league is next refreshed.
+    """
+
+    for sport, period in refresh_periods(scheduler).items():
+        scheduler["next_refresh"][sport] = scheduler["last_refreshed"][sport] + period
+
+
+def due_sports(scheduler):
+    """
+    Returns the leagues that are due to be refreshed.
+    """
+
+    time_now = scheduler["clock"].now()
+
+    return [sport for sport in scheduler["sports"] if scheduler["next_refresh"][sport] <= time_now]
+
+
+def mark_refreshed(scheduler, sports):
+    """
+    Records that the given leagues have just been refreshed.
+    """
+
+    time_now = scheduler["clock"].now()
+    for sport in sports:
+        scheduler["last_refreshed"][sport] = time_now
+    schedule_refreshes(scheduler)
+
+
+def next_refresh_time(scheduler):
+    """
+    Returns when the next league is due to be refreshed.
+    """
+
+    return min(scheduler["next_refresh"].values())
+
+
+def wait_for_next_update(scheduler):
+    """
+    Sleeps until the next Polymarket update, or the next refresh of a
+    league if that is sooner.
+    """
+
+    delay = min(scheduler["polymarket_period"], next_refresh_time(scheduler) - scheduler["clock"].now())
+    scheduler["clock"].sleep(max(delay.total_seconds(), 0))
+
+
+def simulate_refreshes(scheduler, matches, quota, duration):
+    """
+    Runs the scheduler (which should read from a SimulatedClock) for the
+    given duration against a simulated odds API quota, which resets to
+    quota requests on each reset day, with the priorities of the leagues
+    set from the given processed matches.
+
+    Returns the number of refreshes of each league, and the fewest
+    requests left in the quota at any time.
+    """
+
+    clock = scheduler["clock"]
+    end = clock.now() + duration
+    requests_remaining = quota
+    quota_reset = next_quota_reset(scheduler)
+    update_quota(scheduler, requests_remaining)
+    update_priorities(scheduler, matches)
+
+    refreshes = {sport: 0 for sport in scheduler["sports"]}
+    min_requests_remaining = requests_remaining
+    while clock.now() < end:
+
+        # Reset the quota
+        if clock.now() >= quota_reset:
+            requests_remaining = quota
+            quota_reset = next_quota_reset(scheduler)
+
+        # Refresh the leagues that are due
+        sports = due_sports(scheduler)
+        for sport in sports:
+            refreshes[sport] += 1
+            requests_remaining -= scheduler["cost_per_refresh"]
+        min_requests_remaining = min(min_requests_remaining, requests_remaining)
+        update_quota(scheduler, requests_remaining)
+        mark_refreshed(scheduler, sports)
+
+        # Skip to the next refresh, or the quota reset, as the Polymarket updates do not use the quota
+        delay = min(next_refresh_time(scheduler), quota_reset, end) - clock.now()
+        clock.sleep(max(delay.total_seconds(), 0))
+
+    return refreshes, min_requests_remaining
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Simulate the refreshes of the leagues over a month.")
+    parser.add_argument("--sports", nargs="+", default=["soccer_epl", "soccer_spain_la_liga", "soccer_germany_bundesliga"],
+                        help="Leagues to refresh, the first with a fixture about to kick off")
+    parser.add_argument("--quota", type=int, default=500, help="Requests in the odds API quota each month")
+    parser.add_argument("--reset-day", type=int, default=31, help="Day of the month the quota resets")
+    parser.add_argument("--start", default="2025-02-27T12:00:00+00:00", help="Time the simulation starts")
+    parser.add_argument("--days", type=float, default=31, help="Number of days simulated")
+    args = parser.parse_args()
+
+    # Give the first league a fixture about to kick off, and the others fixtures a week away
+    start = datetime.fromisoformat(args.start)
+    simulated_matches = [{"sport_key": sport,
+                          "commence_time": (start + timedelta(hours=1 if i == 0 else 24 * 7)).isoformat()}
+                         for i, sport in enumerate(args.sports)]
+
+    simulated_scheduler = create_refresh_scheduler(args.sports, quota_reset_day=args.reset_day,
+                                                   clock=SimulatedClock(start))
+    simulated_refreshes, fewest_remaining = simulate_refreshes(simulated_scheduler, simulated_matches, args.quota,
+                                                               timedelta(days=args.days))
+
+    for sport, count in simulated_refreshes.items():
+        print(f"{sport}: {count} refreshes")
+    print(f"Fewest requests remaining: {fewest_remaining}")
+
+    # The scheduler must never spend the reserved requests
+    assert fewest_remaining >= simulated_scheduler["reserved_requests"], "The quota was overspent"
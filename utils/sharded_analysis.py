@@ -0,0 +1,193 @@
+"""
+This script contains the functions used to spread the processing and
+analysis of the odds across a pool of worker processes, so a universe of
+many leagues can be analysed within the refresh interval rather than being
+limited to a single core.
+
+The matches are sharded by league (sport key), with leagues that have more
+matches than their share of the workers split into several shards. Each
+shard is encoded as JSON into a single block of shared memory, which the
+workers read from directly, rather than the matches being pickled and
+piped to the workers as dicts. The results of every shard are merged back
+in the original order of the matches, so they are published as a single
+snapshot, exactly as if they had been analysed in a single process.
+"""
+
+# Import necessary packages
+import json
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from utils.bookie_functions import process_odds
+from utils.analysis import prepare_engine_changes, previous_two_bet_arbs, analyse_matches, store_analysis_results
+
+
+def create_analysis_pool(processes, min_shard_size=50):
+    """
+    Returns a pool of the given number of worker processes.
+
+    Shards have at least min_shard_size matches, and work on fewer than
+    two shards' worth of matches is done in the calling process, as it is
+    quicker than passing it to the workers.
+
+    The workers are started straight away, so the pool should be created
+    before any threads are started (e.g. the metrics server).
+    """
+
+    # Fork the workers where possible, so the collector is not re-imported by each worker
+    if "fork" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("fork")
+    else:
+        mp_context = None
+
+    # Share the parent's resource tracker, so the workers do not report the shared memory as leaked
+    resource_tracker.ensure_running()
+
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=mp_context)
+
+    # Start the workers
+    list(executor.map(abs, range(processes)))
+
+    return {"executor": executor, "processes": processes, "min_shard_size": min_shard_size}
+
+
+def close_analysis_pool(pool):
+    """
+    Stops the worker processes of the pool.
+    """
+
+    pool["executor"].shutdown()
+
+
+def shard_positions(shard_keys, processes, min_shard_size=50):
+    """
+    Groups the positions of the items with the same shard key (e.g. the
+    league of each match), splitting groups larger than an equal share of
+    the processes into several shards.
+
+    Returns a list of the positions in each shard.
+    """
+
+    # Group the items by key
+    groups = {}
+    for position, shard_key in enumerate(shard_keys):
+        groups.setdefault(shard_key, []).append(position)
+
+    # Split the large groups
+    shard_size = max(math.ceil(len(shard_keys) / processes), min_shard_size)
+    shards = []
+    for positions in groups.values():
+        shards += [positions[start:start + shard_size] for start in range(0, len(positions), shard_size)]
+
+    return shards
+
+
+def run_shared_shard(function, shared_memory_name, offset, length, args):
+    """
+    Runs in a worker process. Reads a shard of items from the shared
+    memory, and returns the result of calling the function with them.
+    """
+
+    # Read the shard
+    shared_memory = SharedMemory(name=shared_memory_name)
+    try:
+        items = json.loads(bytes(shared_memory.buf[offset:offset + length]))
+    finally:
+        shared_memory.close()
+
+    return function(items, *args)
+
+
+def map_shards(pool, function, items, shard_keys, *args):
+    """
+    Calls the function (which takes a list of items, followed by args,
+    and returns a list of results) on each shard of the items, across the
+    worker processes of the pool. The items must be JSON serialisable.
+
+    Returns the results in the order of the items.
+    """
+
+    # Do small amounts of work in this process
+    shards = shard_positions(shard_keys, pool["processes"], pool["min_shard_size"])
+    if len(shards) <= 1 or len(items) < 2 * pool["min_shard_size"]:
+        return function(items, *args)
+
+    # Encode the shards
+    encoded_shards = [json.dumps([items[position] for position in shard]).encode() for shard in shards]
+
+    # Put every shard into a single block of shared memory
+    shared_memory = SharedMemory(create=True, size=sum(len(encoded_shard) for encoded_shard in encoded_shards))
+    try:
+        locations = []
+        offset = 0
+        for encoded_shard in encoded_shards:
+            shared_memory.buf[offset:offset + len(encoded_shard)] = encoded_shard
+            locations.append((offset, len(encoded_shard)))
+            offset += len(encoded_shard)
+
+        # Process the shards
+        futures = [pool["executor"].submit(run_shared_shard, function, shared_memory.name, offset, length, args)
+                   for offset, length in locations]
+
+        # Collect the results in the original order
+        results = [None] * len(items)
+        for shard, future in zip(shards, futures):
+            for position, result in zip(shard, future.result()):
+                results[position] = result
+
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+    return results
+
+
+def process_odds_sharded(pool, full_odds_json):
+    """
+    Processes the odds in the same way as process_odds() in
+    utils/bookie_functions.py, sharded by league across the pool.
+    """
+
+    return map_shards(pool, process_odds, full_odds_json, [match.get("sport_key") for match in full_odds_json])
+
+
+def analyse_entries(entries, consider_converse_outcomes):
+    """
+    Runs in a worker process. Analyses the matches of a shard, given as
+    dicts of the match, its changed outcomes and its previous 2-bet
+    arbitrage results, see analyse_matches() in utils/analysis.py.
+    """
+
+    return analyse_matches([entry["match"] for entry in entries],
+                           [entry["changes"] for entry in entries],
+                           [entry["previous_results"] for entry in entries],
+                           consider_converse_outcomes)
+
+
+def update_arbitrage_engine_sharded(pool, engine, matches, changes=None):
+    """
+    Brings the engine up to date with the given odds in the same way as
+    update_arbitrage_engine() in utils/analysis.py, with the changed
+    matches analysed across the pool, sharded by league.
+
+    Returns the indices of the matches that were analysed.
+    """
+
+    changes = prepare_engine_changes(engine, matches, changes)
+
+    # Analyse the changed matches
+    changed_indices = sorted(changes)
+    entries = [{"match": matches[i],
+                "changes": None if changes[i] is None else sorted(changes[i]),
+                "previous_results": previous_two_bet_arbs(engine["analysed_odds"][i])}
+               for i in changed_indices]
+    results = map_shards(pool, analyse_entries, entries, [matches[i].get("sport_key") for i in changed_indices],
+                         engine["consider_converse_outcomes"])
+
+    # Update the results of each match
+    store_analysis_results(engine, changed_indices, results)
+
+    return set(changes)
@@ -0,0 +1,241 @@
+"""
+This script contains all the functions used to publish the collector's
+results as consistent, versioned snapshots, and to read them back for the
+dashboard.
+
+Snapshots are kept in a SQLite database in WAL mode, so the dashboard can
+read the latest snapshot while the collector is writing the next one. Each
+snapshot contains every document (bookmakers odds, Polymarket odds,
+analysis tables and update times) as they were at the same moment, with
+unchanged documents shared between snapshots rather than stored again.
+
+The JSON files in Data/ are also kept up to date, written in full before
+replacing the previous version so they are never seen partially written.
+"""
+
+# Import necessary packages
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+
+# Where the snapshots are stored
+SNAPSHOT_DB_FPATH = "Data/snapshots.db"
+snapshots_kept = 100    # Older snapshots are deleted
+
+# Where each of the documents is saved
+DOCUMENT_FPATHS = {
+    "full_bookies_odds": "Data/full_bookies_odds.json",
+    "bookies_odds": "Data/bookies_odds.json",
+    "analysed_odds": "Data/analysed_odds.json",
+    "bookies_odds_with_polymarket": "Data/bookies_odds_with_polymarket.json",
+    "full_polymarket_odds": "Data/full_polymarket_odds.json",
+    "analysed_odds_with_polymarket": "Data/analysed_odds_with_polymarket.json",
+    "two_bet_arbitrage": "Data/two_bet_arbitrage.json",
+    "optimal_portfolios": "Data/optimal_portfolios.json",
+    "odds_directory": "Data/odds_directory.json",
+    "update_times": "Data/update_times.json"
+}
+
+
+def open_snapshot_store(db_fpath=SNAPSHOT_DB_FPATH):
+    """
+    Opens the snapshot store, creating it if necessary. A new store is
+    seeded with the currently saved documents, so every snapshot contains
+    every document.
+    """
+
+    conn = sqlite3.connect(db_fpath, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS documents (
+            hash TEXT PRIMARY KEY,
+            body TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS snapshots (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS snapshot_documents (
+            version INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (version, name)
+        );
+    """)
+
+    # Seed a new store with the saved documents
+    if latest_snapshot_version(conn) is None:
+        commit_snapshot(conn, load_documents_from_files([name for name, fpath in DOCUMENT_FPATHS.items()
+                                                         if os.path.exists(fpath)]))
+
+    return conn
+
+
+def commit_snapshot(conn, documents):
+    """
+    Commits a new snapshot, containing the given documents (keyed by
+    name) along with the unchanged documents of the previous snapshot.
+
+    Returns the version of the new snapshot.
+    """
+
+    # Serialise the documents
+    bodies = {name: json.dumps(document) for name, document in documents.items()}
+    hashes = {name: hashlib.sha256(body.encode()).hexdigest() for name, body in bodies.items()}
+
+    with conn:
+
+        # Store the documents that have not been stored before
+        conn.executemany("INSERT OR IGNORE INTO documents (hash, body) VALUES (?, ?)",
+                         [(hashes[name], body) for name, body in bodies.items()])
+
+        # Create the snapshot
+        previous_version = latest_snapshot_version(conn)
+        version = conn.execute("INSERT INTO snapshots (created_at) VALUES (?)",
+                               (datetime.now().astimezone().isoformat(),)).lastrowid
+
+        # Add the documents, carrying over the unchanged documents
+        conn.executemany("INSERT INTO snapshot_documents (version, name, hash) VALUES (?, ?, ?)",
+                         [(version, name, hash) for name, hash in hashes.items()])
+        if previous_version is not None:
+            conn.execute(f"""
+                INSERT INTO snapshot_documents (version, name, hash)
+                SELECT ?, name, hash FROM snapshot_documents
+                WHERE version = ? AND name NOT IN ({",".join("?" * len(hashes))})
+            """, (version, previous_version, *hashes))
+
+        # Delete old snapshots, and any documents they no longer share
+        conn.execute("DELETE FROM snapshot_documents WHERE version <= ?", (version - snapshots_kept,))
+        conn.execute("DELETE FROM snapshots WHERE version <= ?", (version - snapshots_kept,))
+        conn.execute("DELETE FROM documents WHERE hash NOT IN (SELECT hash FROM snapshot_documents)")
+
+    return version
+
+
+def latest_snapshot_version(conn):
+    """
+    Returns the version of the latest snapshot, or None if there are no
+    snapshots.
+    """
+
+    return conn.execute("SELECT MAX(version) FROM snapshots").fetchone()[0]
+
+
+def load_snapshot(conn, version=None):
+    """
+    Returns the version and documents (keyed by name) of the given
+    snapshot, or of the latest snapshot if no version is given.
+    """
+
+    if version is None:
+        version = latest_snapshot_version(conn)
+
+    rows = conn.execute("""
+        SELECT snapshot_documents.name, documents.body
+        FROM snapshot_documents JOIN documents ON documents.hash = snapshot_documents.hash
+        WHERE snapshot_documents.version = ?
+    """, (version,)).fetchall()
+
+    return version, {name: json.loads(body) for name, body in rows}
+
+
+def save_json_atomic(fpath, data):
+    """
+    Saves the data as JSON, writing it in full before replacing any
+    existing file so the file is never seen partially written.
+    """
+
+    tmp_fpath = f"{fpath}.tmp"
+    with open(tmp_fpath, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_fpath, fpath)
+
+
+def publish_documents(documents, conn=None):
+    """
+    Publishes the given documents (keyed by name): commits them as a new
+    snapshot, if a connection to the snapshot store is given, and saves
+    each to its JSON file.
+
+    The snapshot is committed first, so once the dashboard sees a file
+    change the snapshot containing it can already be read.
+    """
+
+    if conn is not None:
+        commit_snapshot(conn, documents)
+
+    for name in sorted(documents):
+        save_json_atomic(DOCUMENT_FPATHS[name], documents[name])
+
+
+def load_documents_from_files(names):
+    """
+    Loads the given documents from their JSON files.
+    """
+
+    documents = {}
+    for name in names:
+        with open(DOCUMENT_FPATHS[name], "r") as f:
+            documents[name] = json.load(f)
+
+    return documents
+
+
+def dashboard_data_version(names, db_fpath=SNAPSHOT_DB_FPATH):
+    """
+    Returns the version of the given documents that the dashboard should
+    show: their hashes in the latest snapshot if the snapshot store
+    exists, or otherwise the modification times of their JSON files. The
+    version only changes when one of the given documents changes, and is
+    cheap to find, so can be checked on every refresh.
+    """
+
+    if os.path.exists(db_fpath):
+        conn = sqlite3.connect(f"file:{db_fpath}?mode=ro", uri=True, timeout=10)
+        try:
+            hashes = dict(conn.execute(f"""
+                SELECT name, hash FROM snapshot_documents
+                WHERE version = (SELECT MAX(version) FROM snapshots) AND name IN ({",".join("?" * len(names))})
+            """, tuple(names)).fetchall())
+        finally:
+            conn.close()
+        if len(hashes) > 0:
+            # Documents the collector has not published yet are versioned by their files
+            return ("snapshot", tuple((name, hashes.get(name) or os.stat(DOCUMENT_FPATHS[name]).st_mtime_ns)
+                                      for name in names))
+
+    # Fall back to the JSON files if the collector is not publishing snapshots
+    return ("files", tuple((name, os.stat(DOCUMENT_FPATHS[name]).st_mtime_ns) for name in names))
+
+
+def load_dashboard_documents(names, data_version, db_fpath=SNAPSHOT_DB_FPATH):
+    """
+    Loads the given documents, as of the version returned by
+    dashboard_data_version(), keyed by name.
+    """
+
+    if data_version[0] == "files":
+        return load_documents_from_files(names)
+
+    # Load the documents by their hashes
+    hashes = {name: document_hash for name, document_hash in data_version[1] if isinstance(document_hash, str)}
+    conn = sqlite3.connect(f"file:{db_fpath}?mode=ro", uri=True, timeout=10)
+    try:
+        bodies = dict(conn.execute(f"""
+            SELECT hash, body FROM documents WHERE hash IN ({",".join("?" * len(hashes))})
+        """, tuple(hashes.values())).fetchall())
+    finally:
+        conn.close()
+    documents = {name: json.loads(bodies[document_hash]) for name, document_hash in hashes.items()
+                 if document_hash in bodies}
+
+    # Load any documents the collector has not published yet, or has since deleted, from the files
+    missing_names = [name for name in names if name not in documents]
+    documents |= load_documents_from_files(missing_names)
+
+    return {name: documents[name] for name in names}